@@ -0,0 +1,18 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks running tests against local stand-ins for DNS and XMPP servers.
+
+See ``python -m benchmarks.run -h`` for usage.
+"""
@@ -0,0 +1,190 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Compare TLS probes with a new SSL context for every probe to probes with cached contexts.
+
+Contexts are created the way the ``tls_cipher`` test creates them: one TLS version and one cipher per
+probe. With ``CONTEXT_CACHE_SIZE = 0``, every call of ``TLS_VERSION.get_context()`` creates a new context.
+
+The stand-in server accepts every cipher it can use with its certificate, and probes only use the TLS
+versions and ciphers that the server accepted in a first pass, so that successful handshakes are measured.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import ssl
+import sys
+import tempfile
+import time
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from tabulate import tabulate  # type: ignore
+
+from xmpp_test import types
+from xmpp_test.probe import StreamProbe
+from xmpp_test.tls import get_cipher_names
+from xmpp_test.types import TLS_VERSION
+from xmpp_test.types import Timeouts
+
+from .xmpp_server import XMPPServer
+from .xmpp_server import create_certificate
+
+
+def run_server(connection) -> None:
+    """Run the stand-in XMPP server until the process is terminated, sends the port to `connection`."""
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = XMPPServer(*create_certificate(directory), minimum_version=ssl.TLSVersion.TLSv1,
+                            ciphers='ALL:@SECLEVEL=0')
+        starttls_port, tls_port = loop.run_until_complete(server.start())
+        connection.send(starttls_port)
+        loop.run_forever()
+
+
+def get_parameters() -> List[Tuple[TLS_VERSION, str]]:
+    """Get all TLS versions and ciphers that a ``tls_cipher`` test would probe, except for TLSv1.3."""
+
+    return [(v, c) for v in (TLS_VERSION.TLSv1_2, TLS_VERSION.TLSv1_1, TLS_VERSION.TLSv1)
+            for c in get_cipher_names(v)]
+
+
+async def get_accepted_parameters(port: int, concurrency: int) -> List[Tuple[TLS_VERSION, str]]:
+    """Get the TLS versions and ciphers of :py:func:`get_parameters` that a handshake succeeds with."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def accepted(tls_version: TLS_VERSION, cipher: str) -> bool:
+        async with semaphore:
+            probe = StreamProbe('bench.test', ssl_context=TLS_VERSION.get_context(tls_version, cipher),
+                                timeouts=Timeouts(connect=5, tls=5, features=5))
+            await probe.run('127.0.0.1', port)
+            return probe.success
+
+    parameters = get_parameters()
+    results = await asyncio.gather(*[accepted(*p) for p in parameters])
+    return [p for p, success in zip(parameters, results) if success]
+
+
+def bench_contexts(parameters: List[Tuple[TLS_VERSION, str]], count: int, cache_size: int) -> Dict:
+    """Measure how many contexts per second ``TLS_VERSION.get_context()`` returns."""
+
+    types.CONTEXT_CACHE_SIZE = cache_size
+    types._CONTEXT_CACHE.clear()
+    cycle = itertools.cycle(parameters)
+
+    start = time.perf_counter()
+    for i in range(count):
+        TLS_VERSION.get_context(*next(cycle))
+    duration = time.perf_counter() - start
+
+    return {
+        'benchmark': 'contexts',
+        'cache size': cache_size,
+        'count': count,
+        'seconds': round(duration, 3),
+        'per second': round(count / duration, 1),
+    }
+
+
+async def bench_probes(parameters: List[Tuple[TLS_VERSION, str]], port: int, count: int, concurrency: int,
+                       cache_size: int) -> Dict:
+    """Measure how many TLS probes per second can be made against the stand-in server.
+
+    Raises ``SystemExit`` if less than 90% of the probes succeed, as the numbers would not measure successful
+    handshakes.
+    """
+
+    types.CONTEXT_CACHE_SIZE = cache_size
+    types._CONTEXT_CACHE.clear()
+    cycle = itertools.cycle(parameters)
+    semaphore = asyncio.Semaphore(concurrency)
+    successful = 0
+
+    async def probe(tls_version: TLS_VERSION, cipher: str) -> None:
+        nonlocal successful
+        async with semaphore:
+            probe = StreamProbe('bench.test', ssl_context=TLS_VERSION.get_context(tls_version, cipher),
+                                timeouts=Timeouts(connect=5, tls=5, features=5))
+            await probe.run('127.0.0.1', port)
+            successful += probe.success
+
+    start = time.perf_counter()
+    await asyncio.gather(*[probe(*next(cycle)) for i in range(count)])
+    duration = time.perf_counter() - start
+
+    if successful < count * 0.9:
+        raise SystemExit('Only %s of %s probes succeeded with a cache size of %s.' % (
+            successful, count, cache_size))
+
+    return {
+        'benchmark': 'probes',
+        'cache size': cache_size,
+        'count': count,
+        'successful': successful,
+        'seconds': round(duration, 3),
+        'per second': round(count / duration, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=2000, metavar='N',
+                        help="Number of probes in every run (default: %(default)s).")
+    parser.add_argument('-c', '--concurrency', type=int, default=16, metavar='N',
+                        help="Number of probes running at the same time (default: %(default)s).")
+    parser.add_argument('--contexts', type=int, default=20000, metavar='N',
+                        help="Number of contexts to get in the context benchmark (default: %(default)s).")
+    parser.add_argument('--json', action='store_true', default=False,
+                        help="Print results as JSON instead of a table.")
+    args = parser.parse_args()
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_server, args=(child, ), daemon=True)
+    server.start()
+
+    cache_size = types.CONTEXT_CACHE_SIZE
+    try:
+        port = parent.recv()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        parameters = loop.run_until_complete(get_accepted_parameters(port, args.concurrency))
+        if not parameters:
+            raise SystemExit('The server did not accept any TLS version and cipher.')
+        print('Server accepts %s of %s TLS versions and ciphers.' % (len(parameters), len(get_parameters())),
+              file=sys.stderr)
+
+        results = []
+        for size in (0, cache_size):  # a size of 0 creates a new context for every probe
+            results.append(bench_contexts(parameters, args.contexts, size))
+            results.append(loop.run_until_complete(
+                bench_probes(parameters, port, args.count, args.concurrency, size)))
+    finally:
+        server.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(tabulate(results, headers='keys'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A minimal authoritative DNS server (UDP only) for synthetic benchmark domains.
+
+Every name below the zone (``bench.test`` by default) is an XMPP domain: SRV records for client and server
+connections point to ``xmpp.<domain>``, which resolves to ``127.0.0.1`` and ``::1``. All other names do not
+exist.
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import struct
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+TYPE_A = 1
+TYPE_AAAA = 28
+TYPE_SRV = 33
+CLASS_IN = 1
+
+SERVICES = ('xmpp-client', 'xmpp-server', 'xmpps-client', 'xmpps-server')
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_NXDOMAIN = 3
+
+
+def encode_name(name: str) -> bytes:
+    """Encode a domain name in DNS wire format.
+
+    >>> encode_name('example.com')
+    b'\\x07example\\x03com\\x00'
+    """
+    labels = [label.encode('ascii') for label in name.strip('.').split('.') if label]
+    return b''.join(struct.pack('!B', len(label)) + label for label in labels) + b'\x00'
+
+
+def decode_question(packet: bytes) -> Tuple[str, int, int, int]:
+    """Decode the first question of a query, returns the name, type, class and the end of the question.
+
+    >>> decode_question(b'\\x00' * 12 + encode_name('example.com') + b'\\x00\\x21\\x00\\x01')
+    ('example.com', 33, 1, 29)
+    """
+    offset = 12
+    labels = []
+    while True:
+        length = packet[offset]
+        offset += 1
+        if length == 0:
+            break
+        if length & 0xC0:  # compressed names are not valid in a question
+            raise ValueError('Compressed name in question.')
+        labels.append(packet[offset:offset + length].decode('ascii'))
+        offset += length
+
+    qtype, qclass = struct.unpack('!HH', packet[offset:offset + 4])
+    return '.'.join(labels), qtype, qclass, offset + 4
+
+
+class Zone:
+    """The records served by :py:class:`DNSServer`.
+
+    Parameters
+    ----------
+
+    zone : str, optional
+        The zone, every name directly below it is an XMPP domain.
+    starttls_port : int
+        Port for ``_xmpp-client`` and ``_xmpp-server`` SRV records.
+    tls_port : int, optional
+        Port for ``_xmpps-client`` and ``_xmpps-server`` SRV records, no such records exist if not given.
+    ipv4 : str, optional
+        Address in A records.
+    ipv6 : str, optional
+        Address in AAAA records, no AAAA records exist if set to ``None``.
+    ttl : int, optional
+        TTL of all records.
+    """
+
+    def __init__(self, zone: str = 'bench.test', starttls_port: int = 5222, tls_port: Optional[int] = None,
+                 ipv4: str = '127.0.0.1', ipv6: Optional[str] = '::1', ttl: int = 60) -> None:
+        self.zone = zone.strip('.').lower()
+        self.starttls_port = starttls_port
+        self.tls_port = tls_port
+        self.ipv4 = ipaddress.IPv4Address(ipv4)
+        self.ipv6 = None if ipv6 is None else ipaddress.IPv6Address(ipv6)
+        self.ttl = ttl
+
+    def is_domain(self, name: str) -> bool:
+        return name.endswith('.%s' % self.zone) and '_' not in name
+
+    def lookup(self, name: str, qtype: int) -> Optional[List[Tuple[int, bytes]]]:
+        """Get a list of ``(type, rdata)`` tuples for the answer, ``None`` if the name does not exist."""
+
+        name = name.lower()
+        labels = name.split('.')
+
+        if labels[0].startswith('_') and len(labels) > 2 and self.is_domain('.'.join(labels[2:])):
+            service, proto, domain = labels[0][1:], labels[1], '.'.join(labels[2:])
+            if proto != '_tcp' or service not in SERVICES:
+                return None
+            port = self.tls_port if service.startswith('xmpps-') else self.starttls_port
+            if port is None:
+                return None
+            if qtype != TYPE_SRV:
+                return []
+
+            rdata = struct.pack('!HHH', 0, 0, port) + encode_name('xmpp.%s' % domain)
+            return [(TYPE_SRV, rdata)]
+
+        elif labels[0] == 'xmpp' and self.is_domain('.'.join(labels[1:])):
+            if qtype == TYPE_A:
+                return [(TYPE_A, self.ipv4.packed)]
+            elif qtype == TYPE_AAAA and self.ipv6 is not None:
+                return [(TYPE_AAAA, self.ipv6.packed)]
+            return []
+
+        return None
+
+
+class DNSServer(asyncio.DatagramProtocol):
+    """An asyncio UDP protocol answering queries from a :py:class:`Zone`."""
+
+    def __init__(self, zone: Zone) -> None:
+        self.zone = zone
+        self.queries = 0
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore
+
+    def answer(self, packet: bytes) -> bytes:
+        query_id, flags = struct.unpack('!HH', packet[:4])
+        rd = flags & 0x0100
+        try:
+            name, qtype, qclass, end = decode_question(packet)
+        except (ValueError, IndexError, struct.error):
+            return struct.pack('!HHHHHH', query_id, 0x8400 | rd | RCODE_FORMERR, 0, 0, 0, 0)
+
+        question = packet[12:end]
+        answers = self.zone.lookup(name, qtype) if qclass == CLASS_IN else None
+        if answers is None:
+            return struct.pack('!HHHHHH', query_id, 0x8400 | rd | RCODE_NXDOMAIN, 1, 0, 0, 0) + question
+
+        response = [struct.pack('!HHHHHH', query_id, 0x8400 | rd | RCODE_NOERROR, 1, len(answers), 0, 0),
+                    question]
+        for rtype, rdata in answers:
+            # 0xC00C is a pointer to the name in the question
+            response.append(struct.pack('!HHHIH', 0xC00C, rtype, CLASS_IN, self.zone.ttl, len(rdata)))
+            response.append(rdata)
+        return b''.join(response)
+
+    def datagram_received(self, data: bytes, addr: Tuple) -> None:
+        self.queries += 1
+        if len(data) < 12:
+            return
+        self.transport.sendto(self.answer(data), addr)
+
+
+async def start_server(zone: Zone, host: str = '127.0.0.1',
+                       port: int = 0) -> Tuple[asyncio.BaseTransport, DNSServer]:
+    """Start a :py:class:`DNSServer`, returns the transport and the protocol.
+
+    Use ``transport.get_extra_info('sockname')`` to get the port if `port` is ``0``.
+    """
+
+    loop = asyncio.get_event_loop()
+    return await loop.create_datagram_endpoint(lambda: DNSServer(zone), local_addr=(host, port))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: %(default)s).")
+    parser.add_argument('--port', type=int, default=5353, help="Port to listen on (default: %(default)s).")
+    parser.add_argument('--zone', default='bench.test', help="Zone to serve (default: %(default)s).")
+    parser.add_argument('--starttls-port', type=int, default=5222, metavar='PORT',
+                        help="Port in xmpp-client/xmpp-server SRV records (default: %(default)s).")
+    parser.add_argument('--tls-port', type=int, metavar='PORT',
+                        help="Port in xmpps-client/xmpps-server SRV records (default: no such records).")
+    parser.add_argument('--no-ipv6', dest='ipv6', default='::1', action='store_const', const=None,
+                        help="Do not serve AAAA records.")
+    args = parser.parse_args()
+
+    zone = Zone(args.zone, starttls_port=args.starttls_port, tls_port=args.tls_port, ipv6=args.ipv6)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(start_server(zone, host=args.host, port=args.port))
+    loop.run_forever()
+
+
+if __name__ == '__main__':
+    main()
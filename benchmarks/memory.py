@@ -0,0 +1,221 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Measure how much memory the results of a cipher scan use.
+
+Results are created the way a ``tls_cipher`` test creates them, but without connecting to anything: every
+domain has an SRV record for clients and for servers, every SRV record resolves to one IPv4 and one IPv6
+address, and every target gets one result for every cipher. Domains are hosted by a few providers, so SRV
+targets and addresses repeat like they do in a real scan.
+
+Results are created twice: Once with the classes of :py:mod:`xmpp_test` (``slots``) and once with
+equivalents of the classes used before results had ``__slots__`` (``dict``). The latter keep their
+attributes in a ``__dict__``, do not intern strings or share IP addresses, store timings in an
+``OrderedDict`` and keep a reference to the SSL context used by the test.
+"""
+
+import argparse
+import collections
+import gc
+import json
+import ssl
+import time
+import tracemalloc
+from ipaddress import ip_address
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from tabulate import tabulate  # type: ignore
+
+from xmpp_test.base import SRVRecord
+from xmpp_test.base import XMPPTarget
+from xmpp_test.tests.xmpp import TLSCipherTestResult
+from xmpp_test.timings import Timings
+from xmpp_test.tls import get_cipher_names
+from xmpp_test.types import STARTTLS
+from xmpp_test.types import TLS_VERSION
+
+SERVICES = ('xmpp-client', 'xmpp-server')
+PROBE_PHASES = ('start', 'connect', 'stream', 'features', 'proceed', 'tls', 'negotiated')
+
+
+class DictTimings:
+    """Timings as they were stored before, with an ``OrderedDict`` of phases for every object."""
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.marks: Dict[str, float] = collections.OrderedDict()
+
+    def copy(self) -> 'DictTimings':
+        timings = DictTimings(self.start)
+        timings.marks.update(self.marks)
+        return timings
+
+    def mark(self, phase: str, timestamp: float) -> None:
+        self.marks[phase] = timestamp
+
+
+class DictSRVRecord:
+    def __init__(self, service: str, proto: str, domain: str, ttl: int, priority: int, weight: int, port: int,
+                 target: str, timings: DictTimings) -> None:
+        self.service = service
+        self.proto = proto
+        self.domain = domain
+        self.ttl = ttl
+        self.priority = priority
+        self.weight = weight
+        self.port = port
+        self.target = target
+        self.timings = timings
+
+
+class DictXMPPTarget:
+    def __init__(self, srv: DictSRVRecord, ip: str, timings: DictTimings) -> None:
+        self.srv = srv
+        self.ip = ip_address(ip)
+        self.timings = timings
+
+
+class DictTLSCipherTestResult:
+    def __init__(self, target: DictXMPPTarget, success: bool, starttls_required: STARTTLS,
+                 context: ssl.SSLContext, tls_version: TLS_VERSION, cipher: Optional[str],
+                 negotiated_cipher: Optional[str], timings: DictTimings, error: Optional[str] = None,
+                 resumed: Optional[bool] = None, certificate=None) -> None:
+        self.target = target
+        self.success = success
+        self.timings = timings
+        self.starttls_required = starttls_required
+        self.error = error
+        self.certificate = certificate
+        self.context = context
+        self.tls_version = tls_version
+        self.resumed = resumed
+        self.cipher = cipher
+        self.negotiated_cipher = negotiated_cipher
+
+
+def create_dict_results(domains: int, providers: int, ciphers: List[str]) -> List[DictTLSCipherTestResult]:
+    results = []
+    now = time.monotonic()
+    for i in range(domains):
+        provider = i % providers
+        domain = 'd%s.example.com' % i
+        host = 'xmpp.provider%s.example.net' % provider
+
+        for service in SERVICES:
+            timings = DictTimings(now)
+            timings.mark('srv', now + 0.01)
+            srv = DictSRVRecord(service=service, proto='tcp', domain=domain, ttl=3600, priority=0, weight=0,
+                                port=5222, target=''.join(host), timings=timings)
+
+            for ip in ('192.0.2.%s' % provider, '2001:db8::%x' % provider):
+                target_timings = timings.copy()
+                target_timings.mark('a', now + 0.02)
+                target = DictXMPPTarget(srv, ip, timings=target_timings)
+
+                for cipher in ciphers:
+                    probe_timings = target.timings.copy()
+                    for j, phase in enumerate(PROBE_PHASES):
+                        probe_timings.mark(phase, now + 0.03 + j / 100)
+                    # the negotiated cipher is a new string for every handshake
+                    results.append(DictTLSCipherTestResult(
+                        target, True, context=TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, cipher),
+                        tls_version=TLS_VERSION.TLSv1_2, cipher=cipher, negotiated_cipher=''.join(cipher),
+                        starttls_required=STARTTLS.required, timings=probe_timings))
+    return results
+
+
+def create_results(domains: int, providers: int, ciphers: List[str]) -> List[TLSCipherTestResult]:
+    results = []
+    now = time.monotonic()
+    for i in range(domains):
+        provider = i % providers
+        # strings are built at runtime, just like strings parsed from DNS answers
+        domain = 'd%s.example.com' % i
+        host = 'xmpp.provider%s.example.net' % provider
+
+        for service in SERVICES:
+            timings = Timings(now)
+            timings.mark('srv', now + 0.01)
+            srv = SRVRecord(service=''.join(service), proto='tcp', domain=domain, ttl=3600, priority=0,
+                            weight=0, port=5222, target=''.join(host), timings=timings)
+
+            for ip in ('192.0.2.%s' % provider, '2001:db8::%x' % provider):
+                target_timings = timings.copy()
+                target_timings.mark('a', now + 0.02)
+                target = XMPPTarget(srv, ip, timings=target_timings)
+
+                for cipher in ciphers:
+                    probe_timings = target.timings.copy()
+                    for j, phase in enumerate(PROBE_PHASES):
+                        probe_timings.mark(phase, now + 0.03 + j / 100)
+                    results.append(TLSCipherTestResult(
+                        target, True, tls_version=TLS_VERSION.TLSv1_2, cipher=cipher,
+                        negotiated_cipher=cipher, starttls_required=STARTTLS.required, timings=probe_timings,
+                        resumed=None))
+    return results
+
+
+VARIANTS: Dict[str, Callable[[int, int, List[str]], List]] = collections.OrderedDict([
+    ('dict', create_dict_results),
+    ('slots', create_results),
+])
+
+
+def measure(variant: str, domains: int, providers: int, ciphers: List[str]) -> Dict:
+    # contexts are cached by the library, create them before measuring
+    for cipher in ciphers:
+        TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, cipher)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = VARIANTS[variant](domains, providers, ciphers)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return {
+        'variant': variant,
+        'domains': domains,
+        'providers': providers,
+        'results': len(results),
+        'MiB': round(size / 1024 / 1024, 1),
+        'bytes/result': round(size / len(results)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-d', '--domains', default='100,1000', metavar='N[,N...]',
+                        help="Comma-separated list of numbers of domains (default: %(default)s).")
+    parser.add_argument('-p', '--providers', type=int, default=10, metavar='N',
+                        help="Number of providers hosting the domains (default: %(default)s).")
+    parser.add_argument('--ciphers', type=int, default=30, metavar='N',
+                        help="Number of ciphers tested for every target (default: %(default)s).")
+    parser.add_argument('--json', action='store_true', default=False,
+                        help="Print results as JSON instead of a table.")
+    args = parser.parse_args()
+
+    ciphers = list(get_cipher_names(TLS_VERSION.TLSv1_2)[:args.ciphers])
+    results = [measure(v, int(d), args.providers, ciphers) for d in args.domains.split(',') for v in VARIANTS]
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(tabulate(results, headers='keys'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Measure throughput, latency and memory usage of tests against local DNS and XMPP stand-ins.
+
+The stand-in servers run in a separate process, so that they do not compete with the tests for the event
+loop. Every test is run for a number of synthetic domains at each concurrency level. The self-signed
+certificate of the XMPP server is trusted via ``SSL_CERT_FILE``, so TLS handshakes succeed.
+"""
+
+import argparse
+import asyncio
+import collections
+import io
+import json
+import multiprocessing
+import os
+import resource
+import ssl
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+from tabulate import tabulate  # type: ignore
+
+from xmpp_test.base import Test
+from xmpp_test.base import XMPPTargetTest
+from xmpp_test.bulk import BulkScan
+from xmpp_test.bulk import BulkWriter
+from xmpp_test.dns import resolver
+from xmpp_test.scheduler import Scheduler
+from xmpp_test.tests.dns import DNSTest
+from xmpp_test.tests.socket import SocketTest
+from xmpp_test.tests.xmpp import BasicConnectTest
+from xmpp_test.tests.xmpp import TLSCipherTest
+from xmpp_test.tests.xmpp import TLSVersionTest
+from xmpp_test.types import Timeouts
+
+from .dns_server import Zone
+from .dns_server import start_server as start_dns_server
+from .xmpp_server import Behaviour
+from .xmpp_server import XMPPServer
+from .xmpp_server import create_certificate
+
+TESTS = {
+    'dns': DNSTest,
+    'socket': SocketTest,
+    'basic': BasicConnectTest,
+    'tls_version': TLSVersionTest,
+    'tls_cipher': TLSCipherTest,
+}
+
+
+# Tests that should not have any failed results if the XMPP server does not inject failures
+EXPECT_SUCCESS = ('dns', 'socket', 'basic')
+
+
+def run_servers(connection, cert: str, key: str, behaviour: Behaviour, max_version: Optional[str],
+                ciphers: Optional[str]) -> None:
+    """Run the stand-in servers until the process is terminated, sends the ports to `connection`."""
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    server = XMPPServer(cert, key, behaviour=behaviour, ciphers=ciphers,
+                        maximum_version=max_version and ssl.TLSVersion[max_version])
+    starttls_port, tls_port = loop.run_until_complete(server.start(['127.0.0.1', '::1']))
+
+    zone = Zone(starttls_port=starttls_port, tls_port=tls_port)
+    transport, protocol = loop.run_until_complete(start_dns_server(zone))
+
+    connection.send(transport.get_extra_info('sockname')[1])
+    loop.run_forever()
+
+
+def timed(cls: type, latencies: List[float]) -> type:
+    """Get a subclass of the test class `cls` that records the duration of every probe in `latencies`.
+
+    For tests that do not connect to targets, the duration of the whole test is recorded instead.
+    """
+
+    if issubclass(cls, XMPPTargetTest):
+        class TimedTargetTest(cls):  # type: ignore
+            async def target_test(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await super().target_test(*args, **kwargs)
+                finally:
+                    latencies.append(time.perf_counter() - start)
+        return TimedTargetTest
+
+    class TimedTest(cls):  # type: ignore
+        async def iter(self, *args, **kwargs):
+            start = time.perf_counter()
+            async for result in super().iter(*args, **kwargs):
+                yield result
+            latencies.append(time.perf_counter() - start)
+    return TimedTest
+
+
+class StatsWriter(BulkWriter):
+    """A writer that only counts results and the errors of failed results."""
+
+    def __init__(self) -> None:
+        super().__init__(io.StringIO())
+        self.results = 0
+        self.failed = 0
+        self.errors: collections.Counter = collections.Counter()
+
+    def write_result(self, domain, result) -> None:
+        self.results += 1
+        data = result.as_dict()
+        if not data.get('success', True):
+            self.failed += 1
+            self.errors[data.get('error')] += 1
+
+
+def percentile(values: Sequence[float], percent: float) -> Optional[float]:
+    """Get the given percentile of `values`.
+
+    >>> percentile([3, 1, 2, 4], 50)
+    2
+    >>> percentile([], 99) is None
+    True
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[index]
+
+
+def get_rss() -> float:
+    """Get the resident set size of this process in MiB."""
+
+    try:
+        with open('/proc/self/statm') as stream:
+            return int(stream.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:  # not on Linux, use the peak RSS instead
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def benchmark(name: str, domains: int, concurrency: int, timeouts: Timeouts,
+                    expect_success: bool = False) -> Dict:
+    """Run the test `name` for `domains` domains.
+
+    With `expect_success`, ``SystemExit`` is raised if any result failed, as the numbers would not measure
+    successful connections.
+    """
+    latencies: List[float] = []
+    cls = timed(TESTS[name], latencies)
+    scheduler = Scheduler(limit=concurrency, host_limit=concurrency)  # all targets are on the same host
+
+    def get_test(domain: str) -> Test:
+        if issubclass(cls, XMPPTargetTest):
+            return cls(domain, scheduler=scheduler, timeouts=timeouts)
+        return cls(domain)
+
+    # unique domains, so that the DNS cache does not hide the cost of resolving them. Domains are directly
+    # below the zone, so that they match the wildcard certificate of the XMPP server.
+    run_id = uuid.uuid4().hex[:8]
+    names = ['d%s-%s.bench.test' % (i, run_id) for i in range(domains)]
+
+    writer = StatsWriter()
+    scan = BulkScan(get_test, concurrency=concurrency)
+    start = time.perf_counter()
+    await scan.run(names, writer)
+    duration = time.perf_counter() - start
+
+    if expect_success and writer.failed:
+        errors = ', '.join('%s (%s)' % (e, c) for e, c in writer.errors.most_common(3))
+        raise SystemExit('%s with concurrency %s: %s of %s results failed: %s' % (
+            name, concurrency, writer.failed, writer.results, errors))
+
+    p50 = percentile(latencies, 50)
+    p99 = percentile(latencies, 99)
+    return {
+        'test': name,
+        'concurrency': concurrency,
+        'domains': domains,
+        'results': writer.results,
+        'failed': writer.failed,
+        'probes': len(latencies),
+        'seconds': round(duration, 3),
+        'probes/s': round(len(latencies) / duration, 1),
+        'p50 (ms)': None if p50 is None else round(p50 * 1000, 2),
+        'p99 (ms)': None if p99 is None else round(p99 * 1000, 2),
+        'RSS (MiB)': round(get_rss(), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-t', '--test', action='append', choices=list(TESTS),
+                        help="Test to run, may be given multiple times (default: all tests).")
+    parser.add_argument('-c', '--concurrency', default='1,16,64', metavar='N[,N...]',
+                        help="Comma-separated list of concurrency levels (default: %(default)s).")
+    parser.add_argument('-d', '--domains', type=int, default=20, metavar='N',
+                        help="Number of domains to test at every level (default: %(default)s).")
+    parser.add_argument('--timeout', type=float, default=5, metavar='SECONDS',
+                        help="Deadline for every phase of a connection (default: %(default)s).")
+    parser.add_argument('--latency', type=float, default=0, metavar='SECONDS',
+                        help="Delay before every response of the XMPP server (default: %(default)s).")
+    parser.add_argument('--hang', type=float, default=0, metavar='RATIO',
+                        help="Fraction of connections that never get stream features (default: %(default)s).")
+    parser.add_argument('--reset', type=float, default=0, metavar='RATIO',
+                        help="Fraction of connections that are reset (default: %(default)s).")
+    parser.add_argument('--max-version', choices=[v.name for v in ssl.TLSVersion],
+                        help="Highest TLS version the XMPP server accepts.")
+    parser.add_argument('--ciphers', help="OpenSSL cipher string of the XMPP server for TLS 1.2 and lower.")
+    parser.add_argument('--json', action='store_true', default=False,
+                        help="Print results as JSON instead of a table.")
+    args = parser.parse_args()
+
+    behaviour = Behaviour(latency=args.latency, hang=args.hang, reset=args.reset)
+    # Without injected failures, all connections of some tests must succeed
+    baseline = not args.hang and not args.reset and args.max_version is None and args.ciphers is None
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = create_certificate(directory)
+        os.environ['SSL_CERT_FILE'] = cert  # used by ssl.create_default_context()
+
+        parent, child = multiprocessing.Pipe()
+        servers = multiprocessing.Process(target=run_servers, args=(
+            child, cert, key, behaviour, args.max_version, args.ciphers), daemon=True)
+        servers.start()
+
+        try:
+            resolver.configure(nameservers=['127.0.0.1'], port=parent.recv())
+            timeouts = Timeouts(connect=args.timeout, tls=args.timeout, features=args.timeout)
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+
+            results = []
+            for name in args.test or list(TESTS):
+                expect_success = baseline and name in EXPECT_SUCCESS
+                for concurrency in [int(c) for c in args.concurrency.split(',')]:
+                    result = loop.run_until_complete(
+                        benchmark(name, args.domains, concurrency, timeouts, expect_success))
+                    print('%s with concurrency %s: %s probes/s' % (name, concurrency, result['probes/s']),
+                          file=sys.stderr)
+                    results.append(result)
+        finally:
+            servers.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(tabulate(results, headers='keys'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A minimal XMPP server that negotiates streams up to STARTTLS and never authenticates anybody.
+
+It listens on one port for STARTTLS and on another port for XEP-0368 (direct TLS) connections. Latency,
+connections that hang and connections that are reset can be injected to simulate real-world servers.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import ssl
+import struct
+import subprocess
+import tempfile
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+STREAM_HEADER = (
+    "<?xml version='1.0'?><stream:stream xmlns='%s' xmlns:stream='http://etherx.jabber.org/streams' "
+    "id='%s' from='%s' version='1.0'>")
+FEATURES_STARTTLS = (
+    "<stream:features><starttls xmlns='urn:ietf:params:xml:ns:xmpp-tls'><required/></starttls>"
+    "</stream:features>")
+FEATURES = (
+    "<stream:features><mechanisms xmlns='urn:ietf:params:xml:ns:xmpp-sasl'><mechanism>PLAIN</mechanism>"
+    "</mechanisms></stream:features>")
+PROCEED = "<proceed xmlns='urn:ietf:params:xml:ns:xmpp-tls'/>"
+
+
+def create_certificate(directory: str, common_name: str = 'bench.test') -> Tuple[str, str]:
+    """Create a self-signed certificate with the ``openssl`` command, returns the paths of cert and key."""
+
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                    '-subj', '/CN=%s' % common_name, '-addext', 'subjectAltName=DNS:*.%s' % common_name,
+                    '-keyout', key, '-out', cert], check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+class Behaviour:
+    """Configures how the server behaves.
+
+    Parameters
+    ----------
+
+    latency : float, optional
+        Delay (in seconds) before every response of the server.
+    hang : float, optional
+        Probability that the server never sends stream features on a connection.
+    reset : float, optional
+        Probability that the server resets a connection right after it is opened.
+    """
+
+    def __init__(self, latency: float = 0, hang: float = 0, reset: float = 0) -> None:
+        self.latency = latency
+        self.hang = hang
+        self.reset = reset
+
+
+class XMPPServer:
+    """Serve XMPP streams on a STARTTLS and a direct TLS port.
+
+    Parameters
+    ----------
+
+    cert : str
+        Path to the certificate (in PEM format).
+    key : str
+        Path to the private key of the certificate.
+    behaviour : Behaviour, optional
+        Latency and failures to inject.
+    minimum_version : ssl.TLSVersion, optional
+        Lowest TLS version the server accepts.
+    maximum_version : ssl.TLSVersion, optional
+        Highest TLS version the server accepts.
+    ciphers : str, optional
+        OpenSSL cipher string for TLS 1.2 and lower.
+    """
+
+    def __init__(self, cert: str, key: str, behaviour: Optional[Behaviour] = None,
+                 minimum_version: Optional[ssl.TLSVersion] = None,
+                 maximum_version: Optional[ssl.TLSVersion] = None, ciphers: Optional[str] = None) -> None:
+        self.behaviour = behaviour or Behaviour()
+        self.connections = 0
+        self.servers: List[asyncio.AbstractServer] = []
+        self.buffers: Dict[asyncio.StreamReader, bytes] = {}
+
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(cert, key)
+        if minimum_version is not None:
+            self.ssl_context.minimum_version = minimum_version
+        if maximum_version is not None:
+            self.ssl_context.maximum_version = maximum_version
+        if ciphers is not None:
+            self.ssl_context.set_ciphers(ciphers)
+
+    async def send(self, writer: asyncio.StreamWriter, data: str) -> None:
+        if self.behaviour.latency > 0:
+            await asyncio.sleep(self.behaviour.latency)
+        writer.write(data.encode('utf-8'))
+        await writer.drain()
+
+    async def read_until(self, reader: asyncio.StreamReader, token: bytes) -> bool:
+        """Read until `token` was received, returns ``False`` if the client is gone.
+
+        Data received after `token` is kept for the next call, since clients may pipeline requests.
+        """
+
+        buffer = self.buffers.get(reader, b'')
+        while token not in buffer:
+            data = await reader.read(4096)
+            if not data:
+                return False
+            buffer += data
+        self.buffers[reader] = buffer.split(token, 1)[1]
+        return True
+
+    async def stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, tls: bool) -> bool:
+        """Read a stream header and send stream features, returns ``False`` if the client is gone."""
+
+        if not await self.read_until(reader, b'<stream:stream'):
+            return False
+
+        namespace = 'jabber:client'
+        await self.send(writer, STREAM_HEADER % (namespace, os.urandom(8).hex(), 'bench.test'))
+        await self.send(writer, FEATURES if tls else FEATURES_STARTTLS)
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                     tls: bool = False) -> None:
+        self.connections += 1
+        behaviour = self.behaviour
+        try:
+            if behaviour.reset and random.random() < behaviour.reset:
+                # SO_LINGER with a timeout of 0 makes close() send a RST
+                sock = writer.get_extra_info('socket')
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                writer.transport.abort()
+                return
+            if behaviour.hang and random.random() < behaviour.hang:
+                await reader.read()  # until the client gives up
+                return
+
+            if not await self.stream(reader, writer, tls):
+                return
+            if not tls:
+                if not await self.read_until(reader, b'starttls'):
+                    return
+                await self.send(writer, PROCEED)
+                self.buffers.pop(reader, None)  # data sent before the TLS handshake is discarded
+                await writer.start_tls(self.ssl_context)
+                if not await self.stream(reader, writer, True):
+                    return
+
+            await reader.read()  # wait for the client to close the connection
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            self.buffers.pop(reader, None)
+            writer.transport.abort()
+
+    async def handle_tls(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await self.handle(reader, writer, tls=True)
+
+    async def start(self, hosts: Sequence[str] = ('127.0.0.1', ), starttls_port: int = 0,
+                    tls_port: int = 0) -> Tuple[int, int]:
+        """Start listening on all `hosts`, returns the STARTTLS and the direct TLS port.
+
+        Pass ``0`` as port to use a random free port, all hosts use the same port.
+        """
+
+        for host in hosts:
+            starttls = await asyncio.start_server(self.handle, host, starttls_port, backlog=1024)
+            tls = await asyncio.start_server(self.handle_tls, host, tls_port, ssl=self.ssl_context,
+                                             backlog=1024)
+            self.servers += [starttls, tls]
+            starttls_port = starttls.sockets[0].getsockname()[1]
+            tls_port = tls.sockets[0].getsockname()[1]
+        return starttls_port, tls_port
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', action='append',
+                        help="Address to listen on, may be given multiple times (default: 127.0.0.1, ::1).")
+    parser.add_argument('--starttls-port', type=int, default=5222, metavar='PORT',
+                        help="Port for STARTTLS connections (default: %(default)s).")
+    parser.add_argument('--tls-port', type=int, default=5223, metavar='PORT',
+                        help="Port for direct TLS connections (default: %(default)s).")
+    parser.add_argument('--cert', help="Certificate to use (default: generate a self-signed certificate).")
+    parser.add_argument('--key', help="Private key for --cert.")
+    parser.add_argument('--min-version', choices=[v.name for v in ssl.TLSVersion],
+                        help="Lowest TLS version to accept.")
+    parser.add_argument('--max-version', choices=[v.name for v in ssl.TLSVersion],
+                        help="Highest TLS version to accept.")
+    parser.add_argument('--ciphers', help="OpenSSL cipher string for TLS 1.2 and lower.")
+    parser.add_argument('--latency', type=float, default=0, metavar='SECONDS',
+                        help="Delay before every response (default: %(default)s).")
+    parser.add_argument('--hang', type=float, default=0, metavar='RATIO',
+                        help="Fraction of connections that never get stream features (default: %(default)s).")
+    parser.add_argument('--reset', type=float, default=0, metavar='RATIO',
+                        help="Fraction of connections that are reset (default: %(default)s).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = args.cert, args.key
+        if cert is None:
+            cert, key = create_certificate(directory)
+
+        server = XMPPServer(
+            cert, key, behaviour=Behaviour(latency=args.latency, hang=args.hang, reset=args.reset),
+            minimum_version=args.min_version and ssl.TLSVersion[args.min_version],
+            maximum_version=args.max_version and ssl.TLSVersion[args.max_version], ciphers=args.ciphers)
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(server.start(args.host or ['127.0.0.1', '::1'], args.starttls_port,
+                                             args.tls_port))
+        loop.run_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@
 
 import subprocess
 import sys
+import unittest
 
 from setuptools import Command
 from setuptools import find_packages
@@ -24,7 +25,6 @@ long_description = ""
 
 install_requires = [
     'aiodns==1.1.1',
-    'slixmpp==1.4.0',
     'tabulate==0.8.2',
 ]
 
@@ -41,7 +41,11 @@ class BaseCommand(Command):
         pass
 
     def run_tests(self):
-        pass
+        suite = unittest.defaultTestLoader.discover('tests', pattern='test_%s*.py' % self.suite,
+                                                    top_level_dir='.')
+        result = unittest.TextTestRunner(verbosity=2).run(suite)
+        if not result.wasSuccessful():
+            sys.exit(1)
 
 
 class TestCommand(BaseCommand):
@@ -88,8 +92,11 @@ setup(
     author='Mathias Ertl',
     author_email='mati@er.tl',
     url='https://github.com/mathiasertl/xmpp-test',
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests']),
     install_requires=install_requires,
+    extras_require={
+        'certs': ['cryptography>=42'],
+    },
     cmdclass={
         'coverage': CoverageCommand,
         'test': TestCommand,
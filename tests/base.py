@@ -0,0 +1,72 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Helpers shared by the unit tests."""
+
+import asyncio
+import collections
+import unittest
+
+import aiodns
+
+from xmpp_test.dns import resolver
+
+Record = collections.namedtuple('Record', ['host', 'ttl'])
+SRVAnswer = collections.namedtuple('SRVAnswer', ['host', 'port', 'priority', 'weight', 'ttl'])
+
+NOT_FOUND = aiodns.error.DNSError(aiodns.error.ARES_ENOTFOUND, 'Domain name not found')
+
+
+def xmpp_answers(domain, host='xmpp.example.com', port=5222, ip4=('192.0.2.1', ), ip6=('2001:db8::1', )):
+    """Get the DNS answers for a domain with one ``_xmpp-client._tcp`` SRV record."""
+
+    return {
+        ('_xmpp-client._tcp.%s' % domain, 'SRV'): [SRVAnswer(host, port, 0, 0, 300)],
+        ('_xmpps-client._tcp.%s' % domain, 'SRV'): NOT_FOUND,
+        (host, 'A'): [Record(ip, 300) for ip in ip4] or NOT_FOUND,
+        (host, 'AAAA'): [Record(ip, 300) for ip in ip6] or NOT_FOUND,
+    }
+
+
+class StaticResolver:
+    """Stand-in for :py:class:`aiodns.DNSResolver` that answers from a dictionary and counts queries."""
+
+    def __init__(self, answers, delay=0):
+        self.answers = answers
+        self.delay = delay
+        self.queries = collections.Counter()
+
+    async def query(self, name, rrtype):
+        self.queries[(name, rrtype)] += 1
+        await asyncio.sleep(self.delay)
+        answer = self.answers.get((name, rrtype), NOT_FOUND)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class DNSTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test case that answers DNS queries of the shared resolver from ``dns_answers``."""
+
+    dns_answers: dict = {}
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.upstream = StaticResolver(dict(self.dns_answers))
+        resolver.cache.clear()
+        resolver._resolvers[asyncio.get_running_loop()] = self.upstream
+
+    async def asyncTearDown(self):
+        resolver._resolvers.pop(asyncio.get_running_loop(), None)
+        resolver.cache.clear()
+        await super().asyncTearDown()
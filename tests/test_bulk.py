@@ -0,0 +1,150 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from xmpp_test.base import ResultRecord
+from xmpp_test.base import Test
+from xmpp_test.bulk import BulkScan
+from xmpp_test.bulk import Checkpoint
+from xmpp_test.bulk import NDJSONWriter
+from xmpp_test.bulk import aio_read_domains
+
+
+class DomainTest(Test):
+    """Test that yields one result per domain and fails for domains listed in ``failing``."""
+
+    failing = set()
+    tested = []
+
+    async def iter(self, domain):
+        DomainTest.tested.append(domain)
+        await asyncio.sleep(0.01)
+        if domain in self.failing:
+            raise ValueError('broken domain')
+        yield ResultRecord({'domain': domain}, collections.OrderedDict([('status', 'working')]))
+
+
+def read_ndjson(path):
+    with open(path) as stream:
+        return [json.loads(line) for line in stream]
+
+
+class ReadDomainsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_stdin(self):
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(read_fd)
+        self.addCleanup(stream.close)
+
+        def write():
+            with os.fdopen(write_fd, 'w') as output:
+                output.write('example.com\n\n# comment\n')
+                output.flush()
+                time.sleep(0.2)  # the event loop must keep running while we wait for input
+                output.write('example.net\n')
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        self.addCleanup(thread.join)
+
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        domains = [d async for d in aio_read_domains(stream)]
+        ticker.cancel()
+
+        self.assertEqual(domains, ['example.com', 'example.net'])
+        self.assertGreater(ticks, 5)
+
+
+class BulkScanTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        DomainTest.tested = []
+        DomainTest.failing = set()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.checkpoint_path = os.path.join(self.tmpdir, 'checkpoint.txt')
+        self.output_path = os.path.join(self.tmpdir, 'results.ndjson')
+
+    async def scan(self, domains):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        with open(self.output_path, 'a') as stream:
+            try:
+                return await BulkScan(DomainTest, concurrency=2, checkpoint=checkpoint).run(
+                    domains, NDJSONWriter(stream))
+            finally:
+                checkpoint.close()
+
+    async def test_scan(self):
+        domains = ['a.example', 'b.example', 'a.example', 'c.example']
+        self.assertEqual(await self.scan(domains), (3, 0))
+        self.assertEqual(sorted(DomainTest.tested), ['a.example', 'b.example', 'c.example'])
+
+        lines = read_ndjson(self.output_path)
+        self.assertEqual(sorted(line['domain'] for line in lines), ['a.example', 'b.example', 'c.example'])
+        self.assertEqual({line['type'] for line in lines}, {'result'})
+
+    async def test_async_domains(self):
+        async def domains():
+            for domain in ['a.example', 'b.example', 'a.example']:
+                yield domain
+
+        self.assertEqual(await self.scan(domains()), (2, 0))
+
+    async def test_resume(self):
+        DomainTest.failing = {'b.example'}
+        self.assertEqual(await self.scan(['a.example', 'b.example', 'c.example']), (2, 1))
+        errors = [line for line in read_ndjson(self.output_path) if line['type'] == 'error']
+        self.assertEqual(errors, [{'type': 'error', 'domain': 'b.example',
+                                   'data': 'ValueError: broken domain'}])
+
+        # the failed domain is tested again when the scan is resumed, the others are skipped
+        DomainTest.tested = []
+        DomainTest.failing = set()
+        self.assertEqual(await self.scan(['a.example', 'b.example', 'c.example', 'd.example']), (2, 0))
+        self.assertEqual(sorted(DomainTest.tested), ['b.example', 'd.example'])
+
+        results = [line['domain'] for line in read_ndjson(self.output_path) if line['type'] == 'result']
+        self.assertEqual(sorted(results), ['a.example', 'b.example', 'c.example', 'd.example'])
+        with open(self.checkpoint_path) as stream:
+            done = stream.read().split()
+        self.assertEqual(sorted(done), ['a.example', 'b.example', 'c.example', 'd.example'])
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'checkpoint.txt')
+            checkpoint = Checkpoint(path)
+            checkpoint.add('example.com')
+            checkpoint.close()
+
+            checkpoint = Checkpoint(path)
+            self.assertIn('example.com', checkpoint)
+            self.assertNotIn('example.net', checkpoint)
+            checkpoint.close()
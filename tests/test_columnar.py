@@ -0,0 +1,137 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import collections
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from xmpp_test.base import ResultRecord
+from xmpp_test.columnar import ColumnarWriter
+from xmpp_test.columnar import Table
+from xmpp_test.types import STARTTLS
+
+
+def record(ip, protocol='TLSv1_2', **data):
+    """Get a record like the results of the ``tls_version`` test."""
+
+    json_data = collections.OrderedDict([
+        ('source', 'SRV'), ('target', 'xmpp.example.com'), ('ip', ip), ('port', 5222), ('success', True),
+        ('starttls', STARTTLS.required), ('error', None), ('certificate', None), ('protocol', protocol),
+        ('resumed', False), ('timings', {'srv': 1.5, 'connect': 12.25}),
+    ])
+    json_data.update(data)
+    return ResultRecord(json_data, {})
+
+
+class ColumnarWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, table):
+        with open(os.path.join(self.tmpdir, '%s.csv' % table), newline='') as stream:
+            return list(csv.DictReader(stream))
+
+    def read_schema(self):
+        with open(os.path.join(self.tmpdir, 'schema.json')) as stream:
+            return json.load(stream)
+
+    def write(self, *records, domain='example.com', test='tls_version'):
+        writer = ColumnarWriter(self.tmpdir, test=test, batch_size=2)
+        for result in records:
+            writer.write_result(domain, result)
+        writer.close()
+
+    def test_write(self):
+        self.write(record('192.0.2.1'), record('192.0.2.2', protocol='TLSv1_3'), record('192.0.2.1'))
+
+        targets = self.read('targets')
+        self.assertEqual([(t['target_id'], t['ip']) for t in targets],
+                         [('1', '192.0.2.1'), ('2', '192.0.2.2')])
+        results = self.read('results')
+        self.assertEqual([(r['result_id'], r['target_id']) for r in results],
+                         [('1', '1'), ('2', '2'), ('3', '1')])
+        self.assertEqual([r['starttls'] for r in results], [str(STARTTLS.required.value)] * 3)
+        self.assertEqual([r['protocol'] for r in results], ['0', '1', '0'])
+        self.assertEqual(len(self.read('timings')), 6)
+
+        schema = self.read_schema()
+        self.assertEqual(schema['test'], 'tls_version')
+        self.assertEqual([c['name'] for c in schema['tables']['targets']],
+                         ['target_id', 'domain', 'source', 'target', 'ip', 'port'])
+        protocol = [c for c in schema['tables']['results'] if c['name'] == 'protocol'][0]
+        self.assertEqual(protocol, {'name': 'protocol', 'type': 'string', 'dictionary': True})
+
+    def test_resume(self):
+        self.write(record('192.0.2.1'), record('192.0.2.2', protocol='TLSv1_3'))
+        self.write(record('192.0.2.3', protocol='TLSv1_3'), domain='example.net')
+
+        # ids continue and dictionary codes are reused
+        targets = self.read('targets')
+        self.assertEqual([(t['target_id'], t['domain']) for t in targets],
+                         [('1', 'example.com'), ('2', 'example.com'), ('3', 'example.net')])
+        results = self.read('results')
+        self.assertEqual([(r['result_id'], r['protocol']) for r in results],
+                         [('1', '0'), ('2', '1'), ('3', '1')])
+        self.assertEqual([(d['column'], d['code'], d['value']) for d in self.read('dictionaries')],
+                         [('protocol', '0', 'TLSv1_2'), ('phase', '0', 'srv'), ('phase', '1', 'connect'),
+                          ('protocol', '1', 'TLSv1_3')])
+
+        # types of columns fixed in the first run are kept
+        resumed = ColumnarWriter(self.tmpdir)
+        self.assertEqual(resumed.test, 'tls_version')
+        self.assertEqual(resumed.tables['results'].types['success'], 'bool')
+
+    def test_other_test(self):
+        self.write(record('192.0.2.1'))
+        with self.assertRaisesRegex(ValueError, r'contains results of the tls_version test'):
+            ColumnarWriter(self.tmpdir, test='tls_cipher')
+
+    def test_mismatched_value(self):
+        writer = ColumnarWriter(self.tmpdir, test='tls_version')
+        writer.write_result('example.com', record('192.0.2.1'))
+        writer.write_result('example.net', record('192.0.2.2', success='maybe'))
+        writer.write_result('example.org', record('192.0.2.3', resumed=None, cipher='AES'))
+        writer.write_result('example.com', record('192.0.2.4'))
+        writer.close()
+
+        # nothing of the mismatched results is written, ids have no gaps
+        self.assertEqual([t['ip'] for t in self.read('targets')], ['192.0.2.1', '192.0.2.4'])
+        self.assertEqual([(r['result_id'], r['target_id']) for r in self.read('results')],
+                         [('1', '1'), ('2', '2')])
+        self.assertEqual(len(self.read('timings')), 4)
+
+        errors = self.read('errors')
+        self.assertEqual([e['domain'] for e in errors], ['example.net', 'example.org'])
+        self.assertEqual(errors[0]['error'], 'Cannot write result for 192.0.2.2: Cannot store a string value '
+                                             'in a column of type bool.')
+        self.assertIn('has no column cipher', errors[1]['error'])
+
+
+class TableTestCase(unittest.TestCase):
+    def test_unknown_column(self):
+        table = Table(os.path.join(tempfile.gettempdir(), 'unused.csv'), types={'a': 'int'})
+        table.add({'a': 1, 'b': 'x'})
+        table.add({'a': 2})  # missing values are empty
+        with self.assertRaisesRegex(ValueError, r'^unused.csv has no column c, '):
+            table.add({'a': 3, 'c': 'y'})
+        self.assertEqual(table.rows, [[1, 'x'], [2, None]])
+
+        with self.assertRaisesRegex(TypeError, r'^Cannot store a string value in a column of type int\.$'):
+            table.check({'a': 'x'})
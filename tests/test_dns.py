@@ -0,0 +1,108 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import unittest
+
+import aiodns
+
+from xmpp_test.dns import DNSCache
+from xmpp_test.dns import Resolver
+
+from .base import Record
+from .base import StaticResolver
+
+
+class TestResolver(Resolver):
+    def __init__(self, upstream, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream = upstream
+
+    def get_resolver(self):
+        return self.upstream
+
+
+class DNSCacheTestCase(unittest.TestCase):
+    def test_ttl(self):
+        cache = DNSCache()
+        cache.set(('example.com', 'A'), [Record('192.0.2.1', 300), Record('192.0.2.2', 60)])
+        expires, answer = cache.get(('example.com', 'A'))
+        self.assertEqual(len(answer), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        cache.set(('example.net', 'A'), [Record('192.0.2.3', 0)])
+        self.assertIsNone(cache.get(('example.net', 'A')))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_max_ttl(self):
+        cache = DNSCache(max_ttl=0)
+        cache.set(('example.com', 'A'), [Record('192.0.2.1', 300)])
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        cache = DNSCache(max_size=2)
+        cache.set(('a.example.com', 'A'), [Record('192.0.2.1', 300)])
+        cache.set(('b.example.com', 'A'), [Record('192.0.2.2', 300)])
+        cache.get(('a.example.com', 'A'))  # a is now the most recently used answer
+        cache.set(('c.example.com', 'A'), [Record('192.0.2.3', 300)])
+
+        self.assertIsNotNone(cache.get(('a.example.com', 'A')))
+        self.assertIsNone(cache.get(('b.example.com', 'A')))
+        self.assertIsNotNone(cache.get(('c.example.com', 'A')))
+
+
+class ResolverTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_cache(self):
+        upstream = StaticResolver({('example.com', 'A'): [Record('192.0.2.1', 300)]})
+        resolver = TestResolver(upstream)
+
+        first = await resolver.query('example.com', 'A')
+        second = await resolver.query('EXAMPLE.com', 'a')
+        self.assertEqual(first, second)
+        self.assertEqual(upstream.queries[('example.com', 'A')], 1)
+
+    async def test_negative_answer(self):
+        error = aiodns.error.DNSError(aiodns.error.ARES_ENOTFOUND, 'Domain name not found')
+        upstream = StaticResolver({('example.com', 'SRV'): error})
+        resolver = TestResolver(upstream)
+
+        with self.assertRaises(aiodns.error.DNSError):
+            await resolver.query('example.com', 'SRV')
+        with self.assertRaises(aiodns.error.DNSError) as cm:
+            await resolver.query('example.com', 'SRV')
+
+        # the cached error is copied, so that tracebacks do not accumulate on it
+        self.assertIsNot(cm.exception, error)
+        self.assertEqual(cm.exception.args, error.args)
+        self.assertEqual(upstream.queries[('example.com', 'SRV')], 1)
+
+    async def test_coalescing(self):
+        upstream = StaticResolver({('example.com', 'A'): [Record('192.0.2.1', 300)]}, delay=0.05)
+        resolver = TestResolver(upstream)
+
+        answers = await asyncio.gather(*[resolver.query('example.com', 'A') for i in range(5)])
+        self.assertEqual(len(set(map(tuple, answers))), 1)
+        self.assertEqual(upstream.queries[('example.com', 'A')], 1)
+        self.assertEqual(resolver._pending, {})
+
+    async def test_cancelled_caller(self):
+        upstream = StaticResolver({('example.com', 'A'): [Record('192.0.2.1', 300)]}, delay=0.05)
+        resolver = TestResolver(upstream)
+
+        cancelled = asyncio.ensure_future(resolver.query('example.com', 'A'))
+        other = asyncio.ensure_future(resolver.query('example.com', 'A'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        self.assertEqual(await other, [Record('192.0.2.1', 300)])
+        self.assertEqual(upstream.queries[('example.com', 'A')], 1)
@@ -0,0 +1,103 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import unittest
+
+from xmpp_test.base import ResultRecord
+from xmpp_test.base import Test
+from xmpp_test.jobs import JOB_STATUS
+from xmpp_test.jobs import JobQueue
+from xmpp_test.jobs import QueueFull
+
+
+class SlowTest(Test):
+    """Test that yields one result after waiting for `delay` seconds."""
+
+    async def iter(self, delay=0, fail=False):
+        await asyncio.sleep(delay)
+        if fail:
+            raise ValueError('failed')
+        yield ResultRecord({'delay': delay}, collections.OrderedDict(delay=delay))
+
+
+class JobQueueTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.queue = JobQueue(workers=1, backlog=2)
+        self.queue.start()
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        await super().asyncTearDown()
+
+    async def wait(self, job):
+        while not job.is_finished:
+            await asyncio.sleep(0.01)
+
+    async def test_run(self):
+        job = self.queue.submit('slow', SlowTest(delay=0.01))
+        failed = self.queue.submit('slow', SlowTest(fail=True))
+        await self.wait(job)
+        await self.wait(failed)
+
+        self.assertEqual(job.status, JOB_STATUS.done)
+        self.assertEqual(job.as_dict()['data'], [{'delay': 0.01}])
+        self.assertEqual((failed.status, failed.error), (JOB_STATUS.failed, 'ValueError: failed'))
+        self.assertIs(self.queue.get(job.id), job)
+
+    async def test_backlog(self):
+        running = self.queue.submit('slow', SlowTest(delay=10))
+        await asyncio.sleep(0.01)
+        self.assertEqual(running.status, JOB_STATUS.running)
+
+        queued = [self.queue.submit('slow', SlowTest()) for i in range(2)]
+        self.assertEqual(self.queue.queued, 2)
+        with self.assertRaises(QueueFull):
+            self.queue.submit('slow', SlowTest())
+
+        # cancelled jobs no longer take up space in the backlog
+        self.queue.cancel(queued[0])
+        self.assertEqual(queued[0].status, JOB_STATUS.cancelled)
+        self.assertEqual(self.queue.queued, 1)
+        queued.append(self.queue.submit('slow', SlowTest()))
+
+        self.queue.cancel(running)
+        for job in queued[1:]:
+            await self.wait(job)
+            self.assertEqual(job.status, JOB_STATUS.done)
+        self.assertEqual(running.status, JOB_STATUS.cancelled)
+        self.assertEqual(self.queue.queued, 0)
+
+    async def test_expire(self):
+        self.queue.keep = 0.05
+        first = self.queue.submit('slow', SlowTest())
+        second = self.queue.submit('slow', SlowTest())
+        await self.wait(second)
+        await asyncio.sleep(0.05)
+
+        self.assertIsNone(self.queue.get(first.id))
+        self.assertNotIn(first.id, self.queue.jobs)
+        self.queue.expire()
+        self.assertEqual(self.queue.jobs, {})
+
+    async def test_stop(self):
+        running = self.queue.submit('slow', SlowTest(delay=10))
+        queued = self.queue.submit('slow', SlowTest())
+        await asyncio.sleep(0.01)
+        await self.queue.stop()
+
+        self.assertEqual(running.status, JOB_STATUS.cancelled)
+        self.assertEqual(queued.status, JOB_STATUS.cancelled)
+        self.assertEqual(self.queue.queued, 0)
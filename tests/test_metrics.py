@@ -0,0 +1,79 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import unittest
+from unittest import mock
+
+from xmpp_test.base import SRVRecord
+from xmpp_test.base import XMPPTarget
+from xmpp_test.happy_eyeballs import open_socket
+from xmpp_test.metrics import Exposition
+from xmpp_test.metrics import metrics
+from xmpp_test.tests.socket import SocketTest
+
+SRV = SRVRecord('xmpp-client', 'tcp', 'example.com', 60, 0, 0, 5222, 'xmpp.example.com')
+
+
+class ExpositionTestCase(unittest.TestCase):
+    def test_render(self):
+        exposition = Exposition()
+        exposition.counter('probes_total', 'Probes.', 2, {'test': 'basic'})
+        exposition.counter('probes_total', 'Probes.', 1, {'test': 'socket'})
+        self.assertEqual(exposition.render(), '\n'.join([
+            '# HELP xmpp_test_probes_total Probes.',
+            '# TYPE xmpp_test_probes_total counter',
+            'xmpp_test_probes_total{test="basic"} 2',
+            'xmpp_test_probes_total{test="socket"} 1',
+        ]) + '\n')
+
+
+class OpenConnectionsTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.connected = asyncio.Event()
+        self.error = None
+        loop = asyncio.get_running_loop()
+        patcher = mock.patch.object(loop, 'sock_connect', side_effect=self.sock_connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def sock_connect(self, sock, address):
+        """Stand-in for loop.sock_connect() that connects only once ``connected`` is set."""
+
+        await self.connected.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def assertCounted(self, coro):
+        task = asyncio.ensure_future(coro)
+        await asyncio.sleep(0.01)
+        self.assertEqual(metrics.open_connections, 1)
+
+        self.connected.set()
+        result = await task
+        self.assertEqual(metrics.open_connections, 0)
+        return result
+
+    async def test_open_socket(self):
+        sock = await self.assertCounted(open_socket(XMPPTarget(SRV, '192.0.2.1'), timeout=1))
+        sock.close()
+
+    async def test_socket_test(self):
+        result = await self.assertCounted(SocketTest('example.com').target_test(XMPPTarget(SRV, '192.0.2.1')))
+        self.assertTrue(result.success)
+
+    async def test_socket_test_failure(self):
+        self.error = ConnectionRefusedError(111, 'Connection refused')
+        result = await self.assertCounted(SocketTest('example.com').target_test(XMPPTarget(SRV, '192.0.2.1')))
+        self.assertFalse(result.success)
@@ -0,0 +1,83 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import unittest
+
+from xmpp_test.probe import StreamProbe
+from xmpp_test.metrics import metrics
+from xmpp_test.types import STARTTLS
+from xmpp_test.types import Timeouts
+
+FEATURES = (b"<stream:stream xmlns:stream='http://etherx.jabber.org/streams' xmlns='jabber:client' "
+            b"version='1.0'><stream:features/>")
+
+
+class ProbeTestCase(unittest.IsolatedAsyncioTestCase):
+    async def start_server(self, features=None):
+        """Start a server that sends `features` once it received something, or nothing at all."""
+
+        self.closed = asyncio.Event()
+
+        async def handle(reader, writer):
+            await reader.read(1)
+            if features is not None:
+                writer.write(features)
+            await reader.read()  # wait until the client closes the connection
+            self.closed.set()
+            writer.close()
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        return server.sockets[0].getsockname()[1]
+
+    async def test_success(self):
+        port = await self.start_server(FEATURES)
+        probe = StreamProbe('example.com')
+        self.assertTrue(await probe.run('127.0.0.1', port))
+        self.assertIsNone(probe.error)
+        self.assertEqual(probe.starttls_required, STARTTLS.no)
+        self.assertIn('features', probe.timings)
+        await asyncio.wait_for(self.closed.wait(), 1)
+
+    async def test_stuck_server(self):
+        # the server accepts the connection, but never opens the stream
+        port = await self.start_server()
+        probe = StreamProbe('example.com', timeouts=Timeouts(features=0.1))
+        task = asyncio.ensure_future(probe.run('127.0.0.1', port))
+        await asyncio.sleep(0.05)
+        self.assertEqual(metrics.open_connections, 1)
+
+        self.assertFalse(await asyncio.wait_for(task, 1))
+        self.assertEqual((probe.error, probe.phase), ('timeout', 'features'))
+        self.assertEqual(metrics.open_connections, 0)
+        await asyncio.wait_for(self.closed.wait(), 1)  # the connection was closed
+
+    async def test_timeout(self):
+        port = await self.start_server()
+        probe = StreamProbe('example.com')
+        self.assertFalse(await probe.run('127.0.0.1', port, timeout=0.1))
+        self.assertEqual(probe.error, 'timeout')
+        self.assertEqual(metrics.open_connections, 0)
+        await asyncio.wait_for(self.closed.wait(), 1)
+
+    async def test_cancel(self):
+        port = await self.start_server()
+        task = asyncio.ensure_future(StreamProbe('example.com').run('127.0.0.1', port))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(metrics.open_connections, 0)
+        await asyncio.wait_for(self.closed.wait(), 1)
@@ -0,0 +1,64 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+import unittest
+
+from xmpp_test.scheduler import Scheduler
+
+
+class SchedulerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def test_limit(self):
+        scheduler = Scheduler(limit=3, host_limit=2)
+        peak = {'global': 0, 'host': 0}
+        per_host = {}
+
+        async def connect(host):
+            async with scheduler.slot(host):
+                per_host[host] = per_host.get(host, 0) + 1
+                peak['global'] = max(peak['global'], scheduler.active)
+                peak['host'] = max(peak['host'], per_host[host])
+                await asyncio.sleep(0.01)
+                per_host[host] -= 1
+
+        await asyncio.gather(*[connect('192.0.2.%s' % (i % 2)) for i in range(12)])
+        self.assertEqual(peak, {'global': 3, 'host': 2})
+        self.assertEqual((scheduler.active, scheduler.waiting), (0, 0))
+        self.assertEqual(scheduler._hosts, {})
+
+    async def test_invalid_limit(self):
+        with self.assertRaises(ValueError):
+            Scheduler(limit=0)
+
+    async def test_host_delay(self):
+        scheduler = Scheduler(limit=1, host_delay=0.1)
+        starts = []
+
+        async def block():
+            async with scheduler.slot('192.0.2.1'):
+                await asyncio.sleep(0.3)
+
+        async def connect():
+            async with scheduler.slot('192.0.2.2'):
+                starts.append(time.monotonic())
+
+        blocker = asyncio.ensure_future(block())
+        await asyncio.sleep(0)  # let the blocker acquire the only global slot
+        await asyncio.gather(*[connect() for i in range(3)])
+        await blocker
+
+        # connections to the same host are paced even though they all waited for the global slot
+        self.assertEqual(len(starts), 3)
+        for first, second in zip(starts, starts[1:]):
+            self.assertGreaterEqual(second - first, 0.09)
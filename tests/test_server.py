@@ -0,0 +1,89 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import asyncio
+import unittest
+
+from xmpp_test.server import ResultCache
+
+
+class ResultCacheTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def run_test(self):
+        self.runs += 1
+        await self.release.wait()
+        return {'run': self.runs}
+
+    async def test_coalesce(self):
+        cache = ResultCache()
+        requests = [asyncio.ensure_future(cache.get_or_run('key', self.run_test)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        self.release.set()
+
+        self.assertEqual(await asyncio.gather(*requests), [{'run': 1}] * 3)
+        self.assertEqual(await cache.get_or_run('key', self.run_test), {'run': 1})  # from the cache
+        self.assertEqual((self.runs, cache.hits, cache.misses, len(cache)), (1, 3, 1, 1))
+
+        # a refresh runs the test again and updates the cache
+        self.assertEqual(await cache.get_or_run('key', self.run_test, refresh=True), {'run': 2})
+        self.assertEqual(await cache.get_or_run('key', self.run_test), {'run': 2})
+
+    async def test_no_ttl(self):
+        cache = ResultCache(ttl=0)
+        self.release.set()
+        await cache.get_or_run('key', self.run_test)
+        await cache.get_or_run('key', self.run_test)
+        self.assertEqual((self.runs, len(cache)), (2, 0))
+
+    async def test_expired(self):
+        cache = ResultCache(ttl=0.01)
+        self.release.set()
+        await cache.get_or_run('key', self.run_test)
+        await asyncio.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(await cache.get_or_run('key', self.run_test), {'run': 2})
+
+    async def test_evict(self):
+        cache = ResultCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')  # 'b' is now the least recently used entry
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    async def test_client_cancelled(self):
+        cache = ResultCache()
+        first = asyncio.ensure_future(cache.get_or_run('key', self.run_test))
+        second = asyncio.ensure_future(cache.get_or_run('key', self.run_test))
+        await asyncio.sleep(0.01)
+
+        # one client going away does not cancel the test for the other one
+        first.cancel()
+        await asyncio.sleep(0.01)
+        self.release.set()
+        self.assertEqual(await second, {'run': 1})
+        self.assertTrue(first.cancelled())
+
+    async def test_error(self):
+        async def fail():
+            self.runs += 1
+            raise ValueError('broken')
+
+        cache = ResultCache()
+        for _ in range(2):  # errors are not cached
+            with self.assertRaisesRegex(ValueError, r'^broken$'):
+                await cache.get_or_run('key', fail)
+        self.assertEqual((self.runs, len(cache)), (2, 0))
@@ -0,0 +1,78 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from xmpp_test.bulk import Checkpoint
+from xmpp_test.bulk import NDJSONWriter
+from xmpp_test.sharding import ShardedScan
+
+from .test_bulk import DomainTest
+from .test_bulk import read_ndjson
+
+CRASH_FILE = 'XMPP_TEST_CRASH_FILE'
+
+
+def get_test(domain, scheduler):
+    """Get a test in a worker process, the worker crashes once for ``crash.example``."""
+
+    crash_file = os.environ.get(CRASH_FILE)
+    if domain == 'crash.example' and crash_file and not os.path.exists(crash_file):
+        open(crash_file, 'w').close()
+        os._exit(1)
+    return DomainTest(domain)
+
+
+class ShardedScanTestCase(unittest.IsolatedAsyncioTestCase):
+    domains = ['a.example', 'b.example', 'crash.example', 'c.example', 'a.example', 'd.example', 'e.example']
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.checkpoint_path = os.path.join(self.tmpdir, 'checkpoint.txt')
+        self.output_path = os.path.join(self.tmpdir, 'results.ndjson')
+
+        os.environ[CRASH_FILE] = os.path.join(self.tmpdir, 'crashed')
+        self.addCleanup(os.environ.pop, CRASH_FILE)
+
+    async def scan(self, domains, **kwargs):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        with open(self.output_path, 'a') as stream:
+            try:
+                return await ShardedScan(get_test, checkpoint=checkpoint, processes=2, shard_size=2,
+                                         **kwargs).run(domains, NDJSONWriter(stream))
+            finally:
+                checkpoint.close()
+
+    async def test_scan(self):
+        self.assertEqual(await self.scan(self.domains, retries=2), (6, 0))
+        self.assertTrue(os.path.exists(os.environ[CRASH_FILE]))  # the crashed shard was retried
+
+        # shards are written in the order of the input
+        self.assertEqual([line['domain'] for line in read_ndjson(self.output_path)],
+                         ['a.example', 'b.example', 'crash.example', 'c.example', 'd.example', 'e.example'])
+
+        # all domains are skipped when the scan is resumed
+        self.assertEqual(await self.scan(self.domains + ['f.example']), (1, 0))
+        self.assertEqual(read_ndjson(self.output_path)[-1]['domain'], 'f.example')
+
+    async def test_no_retries(self):
+        self.assertEqual(await self.scan(['crash.example', 'a.example'], retries=0), (0, 2))
+        error = 'Worker failed: A process in the process pool was terminated abruptly while the future was ' \
+                'running or pending.'
+        self.assertEqual(read_ndjson(self.output_path), [
+            {'type': 'error', 'domain': domain, 'data': error} for domain in ['crash.example', 'a.example']
+        ])
@@ -0,0 +1,104 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import shutil
+import tempfile
+
+from xmpp_test.base import ResultRecord
+from xmpp_test.base import TestResult
+from xmpp_test.base import XMPPTargetTest
+from xmpp_test.bulk import CSVWriter
+from xmpp_test.dns import resolver
+from xmpp_test.store import ResultStore
+
+from .base import DNSTestCase
+from .base import xmpp_answers
+
+
+class CountingTest(XMPPTargetTest):
+    """Test that connects nowhere, but yields two results per target and counts how often it was run."""
+
+    probes = 0
+
+    async def get_tests(self, domain, target):
+        yield {'attempt': 1}
+        yield {'attempt': 2}
+
+    async def target_test(self, target, attempt):
+        CountingTest.probes += 1
+        return TestResult(target, attempt == 1)
+
+
+class ResultStoreTestCase(DNSTestCase):
+    dns_answers = xmpp_answers('example.com', ip4=('192.0.2.1', '192.0.2.2'))
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        CountingTest.probes = 0
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = ResultStore(os.path.join(self.tmpdir, 'results.db'))
+
+    async def asyncTearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+        await super().asyncTearDown()
+
+    async def test_replay(self):
+        results, tags = await CountingTest('example.com', store=self.store).aio_start()
+        self.assertEqual(CountingTest.probes, 6)
+        self.assertEqual(len(results), 6)
+
+        replayed, replayed_tags = await CountingTest('example.com', store=self.store, max_age=60).aio_start()
+        self.assertEqual(CountingTest.probes, 6)  # nothing was tested again
+        self.assertTrue(all(isinstance(r, ResultRecord) for r in replayed))
+        self.assertTrue(all(r.timestamp is not None for r in replayed))
+
+        # replayed results come in the same order as the original results
+        self.assertEqual([r.json() for r in replayed], [r.json() for r in results])
+        self.assertEqual([r.tabulate() for r in replayed], [r.tabulate() for r in results])
+        self.assertEqual(replayed_tags, tags)
+
+    async def test_max_age(self):
+        await CountingTest('example.com', store=self.store).aio_start()
+        await CountingTest('example.com', store=self.store, max_age=-1).aio_start()
+        self.assertEqual(CountingTest.probes, 12)
+
+    async def test_changed_target(self):
+        await CountingTest('example.com', store=self.store).aio_start()
+
+        # a new IP address is tested, the other targets are replayed
+        records = self.upstream.answers[('xmpp.example.com', 'A')]
+        self.upstream.answers[('xmpp.example.com', 'A')] = records + [records[0]._replace(host='192.0.2.3')]
+        resolver.cache.clear()
+        results, tags = await CountingTest('example.com', store=self.store, max_age=60).aio_start()
+        self.assertEqual(CountingTest.probes, 8)
+        self.assertEqual([type(r) for r in results].count(TestResult), 2)
+
+    async def test_replay_csv(self):
+        results, tags = await CountingTest('example.com', store=self.store).aio_start()
+        replayed, tags = await CountingTest('example.com', store=self.store, max_age=60).aio_start()
+
+        outputs = []
+        for data in [results, replayed, replayed]:  # records are written twice to test they are not modified
+            stream = io.StringIO()
+            writer = CSVWriter(stream)
+            for result in data:
+                writer.write_result('example.com', result)
+            outputs.append(stream.getvalue())
+
+        self.assertEqual(outputs[0].splitlines()[0], 'domain,source,target,ip,port,status')
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], outputs[0])
+        self.assertEqual(list(replayed[0].tabulate()), ['source', 'target', 'ip', 'port', 'status'])
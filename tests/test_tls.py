@@ -0,0 +1,101 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import shutil
+import ssl
+import tempfile
+import unittest
+
+from benchmarks.xmpp_server import XMPPServer
+from benchmarks.xmpp_server import create_certificate
+from xmpp_test import types
+from xmpp_test.tests.xmpp import TLSCipherTest
+from xmpp_test.tls import session_cache
+from xmpp_test.types import TLS_VERSION
+
+from .base import DNSTestCase
+from .base import xmpp_answers
+
+SERVER_CIPHERS = ['ECDHE-RSA-AES256-GCM-SHA384', 'ECDHE-RSA-AES128-GCM-SHA256']
+
+
+class GetContextTestCase(unittest.TestCase):
+    def test_cache(self):
+        ctx = TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES128-SHA')
+        self.assertIs(TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES128-SHA'), ctx)
+        with self.assertRaises(TypeError):
+            ctx.options = 0
+
+    def test_uncached(self):
+        cached = TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES256-SHA')
+        size = len(types._CONTEXT_CACHE)
+
+        ctx = TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES256-SHA', cache=False)
+        self.assertIsNot(ctx, cached)
+        self.assertEqual(len(types._CONTEXT_CACHE), size)
+        self.assertIs(TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES256-SHA'), cached)
+        with self.assertRaises(TypeError):
+            ctx.set_ciphers('ALL')
+
+
+class CipherEnumerationTestCase(DNSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.cert, cls.key = create_certificate(cls.tmpdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+        super().tearDownClass()
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        server = XMPPServer(self.cert, self.key, maximum_version=ssl.TLSVersion.TLSv1_2,
+                            ciphers=':'.join(SERVER_CIPHERS))
+        port, tls_port = await server.start()
+        for s in server.servers:
+            self.addCleanup(s.close)
+
+        self.upstream.answers = xmpp_answers('example.com', port=port, ip4=('127.0.0.1', ), ip6=())
+        types._CONTEXT_CACHE.clear()
+        session_cache.clear()
+
+    async def enumerate(self, **kwargs):
+        test = TLSCipherTest('example.com', enumerate_ciphers=True, ipv6=False, **kwargs)
+        results, tags = await test.aio_start()
+        return [r for r in results if r.tls_version == TLS_VERSION.TLSv1_2]
+
+    def assertEnumerated(self, results):
+        accepted = sorted([(r.preference, r.cipher) for r in results if r.success])
+        self.assertEqual(accepted, list(enumerate(SERVER_CIPHERS, 1)))
+        self.assertTrue(all(r.error is not None for r in results if not r.success))
+
+        # only contexts for the full cipher list of each TLS version are cached
+        for tls_version, ciphers, verify_mode, context_class in types._CONTEXT_CACHE:
+            if tls_version == TLS_VERSION.TLSv1_2:
+                self.assertTrue(set(SERVER_CIPHERS) <= set(ciphers.split(':')))
+
+    async def test_enumerate(self):
+        self.assertEnumerated(await self.enumerate())
+
+    async def test_enumerate_reuse(self):
+        self.assertEnumerated(await self.enumerate(reuse=True))
+        self.assertLessEqual(len(session_cache), len(TLS_VERSION))
+
+        # the session of the first handshake is resumed the next time
+        results = await self.enumerate(reuse=True)
+        self.assertEnumerated(results)
+        self.assertTrue(any(r.resumed for r in results))
@@ -13,19 +13,48 @@
 
 import asyncio
 import collections
+import functools
+import sys
 from ipaddress import IPv4Address
 from ipaddress import IPv6Address
 from ipaddress import ip_address
+from typing import TYPE_CHECKING
 from typing import AsyncGenerator
 from typing import Generator
 from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import aiodns
 
 from .constants import SRV_TYPE
 from .constants import Check
+from .dns import resolver
+from .metrics import current_target
+from .metrics import current_test
+from .metrics import metrics
+from .scheduler import Scheduler
+from .tags import Tag
 from .tags import tag
+from .timings import Timings
+from .timings import format_timings
+from .timings import histograms
+from .types import Timeouts
+from .utils import merge
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .store import ResultStore
+
+
+@functools.lru_cache(maxsize=4096)
+def get_ip_address(address: str) -> Union[IPv4Address, IPv6Address]:
+    """Get the IP address object for `address`, the same address always returns the same object.
+
+    >>> get_ip_address('127.0.0.1') is get_ip_address('127.0.0.1')
+    True
+    """
+    return ip_address(address)
 
 
 class SRVRecord:
@@ -50,7 +79,14 @@ class SRVRecord:
         TCP  or UDP port on which this service can be found.
     target : str
         The target domain for this service (e.g. ``"xmpp.example.com"``).
+    timings : Timings, optional
+        When the SRV query was started and completed.
+
+    Strings are interned, as many records of a large scan have the same service, protocol and target.
     """
+
+    __slots__ = ('service', 'proto', 'domain', 'ttl', 'priority', 'weight', 'port', 'target', 'timings')
+
     service: str
     proto: str
     domain: str
@@ -59,17 +95,19 @@ class SRVRecord:
     weight: int
     port: int
     target: str
+    timings: Timings
 
     def __init__(self, service: str, proto: str, domain: str, ttl: int, priority: int, weight: int, port: int,
-                 target: str) -> None:
-        self.service = service
-        self.proto = proto
-        self.domain = domain
+                 target: str, timings: Optional[Timings] = None) -> None:
+        self.service = sys.intern(service)
+        self.proto = sys.intern(proto)
+        self.domain = sys.intern(domain)
         self.ttl = ttl
         self.priority = priority
         self.weight = weight
         self.port = port
-        self.target = target
+        self.target = sys.intern(target)
+        self.timings = Timings() if timings is None else timings
 
     @property
     def source(self) -> str:
@@ -95,18 +133,21 @@ class SRVRecord:
             The Domain to test.
         """
         proto = 'tcp'
-        resolver = aiodns.DNSResolver()
         query = '_%s._%s.%s' % (service.value, proto, domain)
+        timings = Timings()
         try:
             results = await resolver.query(query, 'SRV')
         except aiodns.error.DNSError as e:
             tag.error(0, 'No SRV record "%s" for domain %s' % (query, domain), 'dns')
             return []
+        finally:
+            timings.mark('srv')
+            histograms.observe_timings(timings, ['srv'])
 
         return [cls(
             service=service.value, proto=proto, domain=domain,
             ttl=r.ttl, priority=r.priority, weight=r.weight,
-            port=r.port, target=r.host
+            port=r.port, target=r.host, timings=timings
         ) for r in results]
 
     @property
@@ -115,12 +156,26 @@ class SRVRecord:
 
 
 class XMPPTarget:
+    """An IP address that an SRV record resolved to.
+
+    ``timings`` contains the timings of the SRV record and, if the target was resolved by
+    :py:meth:`from_srv_record`, of the A or AAAA query. Targets with the same IP address share the same
+    address object (see :py:func:`get_ip_address`).
+    """
+
+    __slots__ = ('srv', 'ip', 'timings')
+
     srv: SRVRecord
     ip: Union[IPv4Address, IPv6Address]
+    timings: Timings
 
-    def __init__(self, srv: SRVRecord, ip: str) -> None:
+    def __init__(self, srv: SRVRecord, ip: str, timings: Optional[Timings] = None) -> None:
         self.srv = srv
-        self.ip = ip_address(ip)
+        self.ip = get_ip_address(ip)
+        self.timings = srv.timings if timings is None else timings
+
+    def __str__(self) -> str:
+        return '%s -> %s' % (self.srv, self.ip)
 
     @property
     def is_ip4(self) -> bool:
@@ -138,6 +193,16 @@ class XMPPTarget:
 
         return self.srv.is_xmpps
 
+    @property
+    def sort_key(self) -> tuple:
+        """A key to sort targets in a stable order.
+
+        Targets are sorted by SRV service, by priority and weight of the SRV record and by IP address, with
+        IPv4 addresses first.
+        """
+        srv = self.srv
+        return (srv.service, srv.priority, -srv.weight, srv.target, srv.port, self.ip.version, self.ip)
+
     @classmethod
     async def from_srv_record(cls, srv_record: SRVRecord, ip4: bool = True,
                               ip6: bool = True) -> AsyncGenerator['XMPPTarget', None]:
@@ -146,42 +211,56 @@ class XMPPTarget:
         if not ip4 and not ip6:
             raise ValueError("Both IPv4 and IPv6 resolution are disabled.")
 
-        resolver = aiodns.DNSResolver()
-        has_ip4 = False
-        has_ip6 = False
+        found = set()
 
-        if ip4:
+        async def lookup(rrtype: str) -> AsyncGenerator['XMPPTarget', None]:
+            timings = srv_record.timings.copy()
+            phase = rrtype.lower()
             try:
-                ip4_records = await resolver.query(srv_record.target, 'A')
-                for result in ip4_records:
-                    yield cls(srv_record, result.host)
-                has_ip4 = True
+                records = await resolver.query(srv_record.target, rrtype)
             except aiodns.error.DNSError:
-                pass
+                return
+            finally:
+                timings.mark(phase)
+                histograms.observe_timings(timings, [phase])
+
+            found.add(rrtype)
+            for result in records:
+                yield cls(srv_record, result.host, timings=timings)
 
+        # A and AAAA records are queried concurrently, targets are yielded in the order they arrive
+        lookups = []
+        if ip4:
+            lookups.append(lookup('A'))
         if ip6:
-            try:
-                ip6_records = await resolver.query(srv_record.target, 'AAAA')
-                for result in ip6_records:
-                    yield cls(srv_record, result.host)
-                has_ip6 = True
-            except aiodns.error.DNSError:
-                pass
+            lookups.append(lookup('AAAA'))
 
-        if not has_ip4 and not has_ip6:
+        async for target in merge(lookups):
+            yield target
+
+        if not found:
             tag.error(2, 'SRV-Record %s has no A/AAAA records.' % srv_record.source, 'dns')
-        if ip4 and not has_ip4:
-            tag.warning(3, 'No IPv6 records for %s' % srv_record.target, 'dns')
-        if ip6 and not has_ip6:
+        if ip4 and 'A' not in found:
+            tag.warning(3, 'No IPv4 records for %s' % srv_record.target, 'dns')
+        if ip6 and 'AAAA' not in found:
             tag.warning(4, 'No IPv6 records for %s' % srv_record.target, 'dns')
 
     @classmethod
     async def from_domain(cls, domain, typ: Check = Check.CLIENT,
                           ipv4: bool = True, ipv6: bool = True, xmpps: bool = True):
-        for srv_service in get_srv_services(typ, xmpps=xmpps):
-            for srv_record in await SRVRecord.srv_records(srv_service, domain):
-                async for target in cls.from_srv_record(srv_record, ip4=ipv4, ip6=ipv6):
-                    yield target
+        """Resolve all XMPP targets for a domain in an asynchronous generator.
+
+        All SRV records are queried concurrently, and the A/AAAA records of every SRV record are queried as
+        soon as the SRV record is known. Targets are yielded in the order in which the answers arrive.
+        """
+
+        async def srv_targets(srv_service: SRV_TYPE) -> AsyncGenerator['XMPPTarget', None]:
+            srv_records = await SRVRecord.srv_records(srv_service, domain)
+            async for target in merge(cls.from_srv_record(r, ip4=ipv4, ip6=ipv6) for r in srv_records):
+                yield target
+
+        async for target in merge(srv_targets(s) for s in get_srv_services(typ, xmpps=xmpps)):
+            yield target
 
 
 def get_srv_services(typ: Check, xmpps: bool = True) -> Generator[SRV_TYPE, None, None]:
@@ -210,45 +289,253 @@ def get_srv_services(typ: Check, xmpps: bool = True) -> Generator[SRV_TYPE, None
 
 
 class Test:
-    def __init__(self, *args, **kwargs):
+    """Base class for all tests.
+
+    Parameters
+    ----------
+
+    store : ResultStore, optional
+        If given, results and tags of this test are saved in this store.
+    """
+
+    store: Optional['ResultStore']
+
+    def __init__(self, *args, store: Optional['ResultStore'] = None, **kwargs):
         self.loop = asyncio.get_event_loop()
+        self.store = store
 
         self.args = args
         self.kwargs = kwargs
 
+    @property
+    def domain(self) -> Optional[str]:
+        """The domain tested by this test, if any."""
+
+        if self.args:
+            return self.args[0]
+        return self.kwargs.get('domain')
+
     def test(self, *args, **kwargs):  # equivalent to start
-        data = self.loop.run_until_complete(self.run(*args, **kwargs))
-        tags = tag.pop_all()
-        return data, tags
+        token = tag.collect()
+        try:
+            data = self.loop.run_until_complete(self.run(*args, **kwargs))
+            return data, tag.pop_all()
+        finally:
+            tag.reset(token)
 
     def start(self):
         loop = asyncio.get_event_loop()
-        data = loop.run_until_complete(self.run(*self.args, **self.kwargs))
-        tags = tag.pop_all()
-        return data, tags
+        return loop.run_until_complete(self.aio_start())
 
     async def aio_start(self):
-        data = await self.run(*self.args, **self.kwargs)
-        tags = tag.pop_all()
+        """Run this test and return all results and tags.
+
+        Unlike :py:meth:`aio_iter`, results are returned in a stable order (see :py:meth:`sort_key`).
+        """
+        data = []
+        tags = []
+        async for result, new_tags in self.aio_iter():
+            if result is not None:
+                data.append(result)
+            tags += new_tags
+        data.sort(key=self.sort_key)
         return data, tags
 
+    def sort_key(self, result) -> tuple:
+        """Get the key that :py:meth:`aio_start` sorts `result` by.
+
+        The default implementation keeps the order in which results were yielded.
+        """
+        return ()
+
+    async def aio_iter(self) -> AsyncGenerator[Tuple[Optional['TestResult'], List[Tag]], None]:
+        """Run this test and yield ``(result, tags)`` tuples as soon as each result is available.
+
+        ``tags`` are the tags raised since the previous result. If tags are raised after the last result (or
+        if there are no results at all), a final tuple with ``None`` as result is yielded.
+
+        Tags are collected separately for every call, so tests can safely run concurrently. Callers that stop
+        iterating early should call ``aclose()`` on the generator, so that pending connections are cancelled
+        right away.
+        """
+
+        name = self.__class__.__name__
+        token = tag.collect()
+        test_token = current_test.set(name)
+        metrics.test_started(name)
+        all_tags: List[Tag] = []
+        try:
+            async for result in self.iter(*self.args, **self.kwargs):
+                tags = tag.pop_all()
+                all_tags += tags
+                yield result, tags
+
+            tags = tag.pop_all()
+            all_tags += tags
+            if self.store is not None and self.domain is not None:
+                self.store.put_tags(name, self.domain, all_tags)
+            if tags:
+                yield None, tags
+        finally:
+            metrics.test_finished(name)
+            try:
+                current_test.reset(test_token)
+                tag.reset(token)
+            except ValueError:  # the generator was closed from another context (e.g. garbage collected)
+                pass
+
+    async def iter(self, *args, **kwargs):
+        """Yield results of this test as they become available.
+
+        The default implementation yields the results returned by :py:meth:`run`, subclasses should implement
+        this method if they can produce results incrementally.
+        """
+
+        for result in await self.run(*args, **kwargs):
+            yield result
+
     async def run(self, *args, **kwargs):
         """To be implemented."""
         pass
 
 
 class XMPPTargetTest(Test):
+    """Base class for tests that connect to every XMPP target of a domain.
+
+    Parameters
+    ----------
+
+    scheduler : Scheduler, optional
+        The scheduler limiting concurrent connections. If not given, a scheduler with default limits is used
+        for this test alone.
+    timeouts : Timeouts, optional
+        Deadlines for the individual phases of a connection.
+    max_age : float, optional
+        Reuse results from ``store`` that are younger than `max_age` seconds instead of testing the target
+        again. Targets are always tested again if their DNS records changed.
+
+    Tests that support Happy Eyeballs mode set ``supports_happy_eyeballs`` and implement :py:meth:`race_test`,
+    passing ``happy_eyeballs=True`` to any other test raises ``ValueError``.
+    """
+
+    supports_happy_eyeballs = False
+
+    scheduler: Scheduler
+    timeouts: Timeouts
+    max_age: Optional[float]
+
+    def __init__(self, *args, scheduler: Optional[Scheduler] = None, timeouts: Timeouts = Timeouts(),
+                 max_age: Optional[float] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if kwargs.get('happy_eyeballs') is True and not self.supports_happy_eyeballs:
+            raise ValueError('%s does not support Happy Eyeballs mode.' % self.__class__.__name__)
+        if scheduler is None:
+            scheduler = Scheduler()
+        self.scheduler = scheduler
+        self.timeouts = timeouts
+        self.max_age = max_age
+
     async def get_tests(self, domain, target):
         yield {}
 
-    async def run(self, domain: str, typ: Check = Check.CLIENT,
-                  ipv4: bool = True, ipv6: bool = True, xmpps: bool = True, **kwargs) -> tuple:
+    async def probe(self, target: XMPPTarget, **kwargs):
+        """Run a single test for `target` once the scheduler allows it."""
+
+        token = current_target.set(str(target))
+        try:
+            async with self.scheduler.slot(str(target.ip)):
+                return await self.target_test(target, **kwargs)
+        finally:
+            current_target.reset(token)
+
+    async def target_iter(self, target: XMPPTarget, **kwargs):
+        """Yield the results of testing `target` with the given parameters.
+
+        The default implementation runs a single :py:meth:`probe`.
+        """
+
+        yield await self.probe(target, **kwargs)
+
+    async def stored_target_iter(self, target: XMPPTarget, **kwargs):
+        """Like :py:meth:`target_iter`, but reuses and saves results if this test has a ``store``."""
+
+        if self.store is None:
+            async for result in self.target_iter(target, **kwargs):
+                yield result
+            return
+
+        test_name = self.__class__.__name__
+        if self.max_age is not None:
+            stored = self.store.get(test_name, target, kwargs, max_age=self.max_age)
+            if stored is not None:
+                for result in stored:
+                    yield result
+                return
+
+        results = []
+        async for result in self.target_iter(target, **kwargs):
+            results.append(result)
+            yield result
+        self.store.put(test_name, target, kwargs, results)
 
-        futures = []
-        async for target in XMPPTarget.from_domain(domain, typ, ipv4, ipv6, xmpps):
-            async for test_kwargs in self.get_tests(domain, target, **kwargs):
-                futures.append(asyncio.ensure_future(self.target_test(target, **test_kwargs)))
-        return await asyncio.gather(*futures)
+    async def race_test(self, targets: List[XMPPTarget]):
+        """Test the targets of one SRV record by connecting to them like a real client would.
+
+        Tests that support Happy Eyeballs mode (see :py:mod:`xmpp_test.happy_eyeballs`) implement this
+        method and return a single result. It is only called if ``supports_happy_eyeballs`` is set.
+        """
+        raise NotImplementedError('%s does not support Happy Eyeballs mode.' % self.__class__.__name__)
+
+    async def race_iter(self, srv_record: SRVRecord, ipv4: bool = True, ipv6: bool = True):
+        targets = [t async for t in XMPPTarget.from_srv_record(srv_record, ip4=ipv4, ip6=ipv6)]
+        if targets:
+            token = current_target.set(str(srv_record))
+            try:
+                result = await self.race_test(targets)
+            finally:
+                current_target.reset(token)
+            yield result
+
+    async def iter(self, domain: str, typ: Check = Check.CLIENT,
+                   ipv4: bool = True, ipv6: bool = True, xmpps: bool = True, happy_eyeballs: bool = False,
+                   **kwargs):
+
+        if happy_eyeballs is True:
+            # Only one result per SRV record, see race_test()
+            async def srv_races(srv_service: SRV_TYPE):
+                srv_records = await SRVRecord.srv_records(srv_service, domain)
+                async for result in merge(self.race_iter(r, ipv4, ipv6) for r in srv_records):
+                    yield result
+
+            async for result in merge(srv_races(s) for s in get_srv_services(typ, xmpps=xmpps)):
+                yield result
+            return
+
+        async def positioned(index, results):
+            # remember the position of every result, see sort_key()
+            position = 0
+            async for result in results:
+                result.position = (index, position)
+                position += 1
+                yield result
+
+        async def target_tests():
+            async for target in XMPPTarget.from_domain(domain, typ, ipv4, ipv6, xmpps):
+                index = 0
+                async for test_kwargs in self.get_tests(domain, target, **kwargs):
+                    yield positioned(index, self.stored_target_iter(target, **test_kwargs))
+                    index += 1
+
+        # tests for a target start as soon as the target is resolved
+        async for result in merge(target_tests()):
+            yield result
+
+    async def run(self, *args, **kwargs) -> list:
+        return [r async for r in self.iter(*args, **kwargs)]
+
+    def sort_key(self, result: 'TestResult') -> tuple:
+        """Sort results by target, and results of the same target in the order of :py:meth:`get_tests`."""
+        return result.target.sort_key + result.position
 
 
 class TestResult:
@@ -260,19 +547,33 @@ class TestResult:
     Parameters
     ----------
 
-    srv : SRVRecord
-    ip : str
+    target : XMPPTarget
+    success : bool
+    timings : Timings, optional
+        When the phases of the test were completed, the timings of `target` if not given.
+
+    ``position`` is set by :py:meth:`XMPPTargetTest.iter` to the position of the result among the results of
+    the same target, see :py:meth:`XMPPTargetTest.sort_key`.
+
+    Large scans hold many results, so results (including subclasses) use ``__slots__`` and should only
+    reference shared objects (like the target) or small values. Subclasses must define ``__slots__`` too.
     """
 
+    __slots__ = ('target', 'success', 'timings', 'position')
+
     target: XMPPTarget
     success: bool
+    timings: Timings
+    position: Tuple[int, ...]
 
-    def __init__(self, target: XMPPTarget, success: bool) -> None:
+    def __init__(self, target: XMPPTarget, success: bool, timings: Optional[Timings] = None) -> None:
         self.target = target
         self.success = success
+        self.timings = target.timings if timings is None else timings
+        self.position = ()
 
     def __str__(self) -> str:
-        return '%s -> %s' % (self.srv, self.ip)
+        return '%s -> %s' % (self.target.srv, self.target.ip)
 
     def __repr__(self) -> str:
         return '<%s: %s>' % (self.__class__.__name__, self)
@@ -286,10 +587,61 @@ class TestResult:
             ('success', self.success),
         ])
 
-    def tabulate(self):
+    def tabulate(self, timings: bool = False):
         d = self.as_dict()
         d['status'] = 'working' if d.pop('success') else 'failed'
+        if timings:
+            d['timings'] = format_timings(self.timings.as_dict())
         return d
 
     def json(self):
-        return self.as_dict()
+        d = self.as_dict()
+        d['timings'] = self.timings.as_dict()
+        return d
+
+
+class ResultRecord:
+    """A snapshot of the data of a :py:class:`TestResult`.
+
+    Results may reference objects that cannot be pickled or stored (e.g. an ``SSLContext``), records only keep
+    the data that is used for output. Records are used to send results to other processes and to replay
+    results from a :py:class:`~xmpp_test.store.ResultStore`.
+
+    Parameters
+    ----------
+
+    json : dict
+        The data returned by :py:meth:`TestResult.json`.
+    tabulate : dict
+        The data returned by :py:meth:`TestResult.tabulate`.
+    timestamp : float, optional
+        When the result was originally created (as UNIX timestamp), if the record was replayed from a store.
+    target : XMPPTarget, optional
+        The target of the result, used to sort records like results (see :py:meth:`XMPPTargetTest.sort_key`).
+    """
+
+    __slots__ = ('_json', '_tabulate', 'timestamp', 'target', 'position')
+
+    def __init__(self, json: dict, tabulate: dict, timestamp: Optional[float] = None,
+                 target: Optional[XMPPTarget] = None) -> None:
+        self._json = json
+        self._tabulate = tabulate
+        self.timestamp = timestamp
+        self.target = target
+        self.position: Tuple[int, ...] = ()
+
+    @classmethod
+    def from_result(cls, result: TestResult) -> 'ResultRecord':
+        tabulated = result.tabulate() if hasattr(result, 'tabulate') else result.as_dict()
+        return cls(result.json(), tabulated, target=result.target)
+
+    def as_dict(self) -> dict:
+        return self._tabulate
+
+    def json(self) -> dict:
+        return self._json
+
+    def tabulate(self, timings: bool = False) -> dict:
+        if timings:
+            return collections.OrderedDict(self._tabulate, timings=format_timings(self._json.get('timings')))
+        return self._tabulate
@@ -0,0 +1,295 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Run a test for many domains in a single event loop."""
+
+import asyncio
+import collections
+import csv
+import json
+import os
+from typing import AsyncIterable
+from typing import AsyncIterator
+from typing import Callable
+from typing import IO
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+from .base import Test
+from .base import TestResult
+from .tags import Tag
+from .utils import merge
+
+_RESULT = 0
+_ERROR = 1
+_DONE = 2
+
+Domains = Union[Iterable[str], AsyncIterable[str]]
+
+
+def read_domains(stream: IO[str]) -> Iterator[str]:
+    """Read domains from `stream`, one per line. Empty lines and lines starting with ``#`` are skipped.
+
+    >>> import io
+    >>> list(read_domains(io.StringIO('example.com\\n\\n# comment\\n  example.net  \\n')))
+    ['example.com', 'example.net']
+    """
+
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+async def aio_read_domains(stream: IO[str]) -> AsyncIterator[str]:
+    """Like :py:func:`read_domains`, but lines are read in a thread.
+
+    Use this for streams that may block for a long time (e.g. stdin), so that waiting for the next domain does
+    not stall tests that are already running in the event loop.
+    """
+
+    loop = asyncio.get_event_loop()
+    while True:
+        line = await loop.run_in_executor(None, stream.readline)
+        if not line:
+            return
+        for domain in read_domains([line]):
+            yield domain
+
+
+class Checkpoint:
+    """A file recording domains that were completely tested, so that an interrupted scan can be resumed.
+
+    Domains are appended one per line as soon as all their results are written, so the file stays valid even
+    if the process is killed.
+
+    Parameters
+    ----------
+
+    path : str
+        Path to the checkpoint file. It is created if it does not exist.
+    """
+
+    path: str
+    domains: Set[str]
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.domains = set()
+
+        if os.path.exists(path):
+            with open(path) as stream:
+                self.domains.update(read_domains(stream))
+
+        self._stream = open(path, 'a')
+
+    def __contains__(self, domain: str) -> bool:
+        return domain in self.domains
+
+    def add(self, domain: str) -> None:
+        self.domains.add(domain)
+        self._stream.write('%s\n' % domain)
+        self._stream.flush()
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class BulkWriter:
+    """Base class for writers of bulk results."""
+
+    def __init__(self, stream: IO[str]) -> None:
+        self.stream = stream
+
+    def write_result(self, domain: str, result: TestResult) -> None:
+        pass
+
+    def write_tag(self, domain: str, tag: Tag) -> None:
+        pass
+
+    def write_error(self, domain: str, error: str) -> None:
+        pass
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def close(self) -> None:
+        """Called when all results are written."""
+
+        self.flush()
+
+
+class NDJSONWriter(BulkWriter):
+    """Write results, tags and errors as newline-delimited JSON.
+
+    Every line is an object with the ``type`` (``"result"``, ``"tag"`` or ``"error"``), the ``domain`` and the
+    ``data`` of the result or tag (or the error message).
+    """
+
+    def write(self, typ: str, domain: str, data) -> None:
+        self.stream.write('%s\n' % json.dumps({'type': typ, 'domain': domain, 'data': data}))
+
+    def write_result(self, domain: str, result: TestResult) -> None:
+        self.write('result', domain, result.json())
+
+    def write_tag(self, domain: str, tag: Tag) -> None:
+        self.write('tag', domain, tag.as_dict())
+
+    def write_error(self, domain: str, error: str) -> None:
+        self.write('error', domain, error)
+
+
+class CSVWriter(BulkWriter):
+    """Write results as CSV rows with an additional ``domain`` column.
+
+    The columns are taken from the first result. The header is only written if the stream is empty, so that
+    a resumed scan can append to the output of the previous run.
+    """
+
+    def __init__(self, stream: IO[str]) -> None:
+        super().__init__(stream)
+        self._writer: Optional[csv.DictWriter] = None
+
+    def write_result(self, domain: str, result: TestResult) -> None:
+        data = result.tabulate() if hasattr(result, 'tabulate') else result.as_dict()
+        row = collections.OrderedDict(domain=domain)  # a new dict, as records return their data as is
+        row.update(data)
+
+        if self._writer is None:
+            self._writer = csv.DictWriter(self.stream, delimiter=',', fieldnames=row.keys(),
+                                          extrasaction='ignore')
+            if not self.stream.seekable() or self.stream.tell() == 0:
+                self._writer.writeheader()
+        self._writer.writerow(row)
+
+
+class BulkScan:
+    """Run a test for many domains in a single event loop.
+
+    At most `concurrency` domains are tested at the same time. Use a shared
+    :py:class:`~xmpp_test.scheduler.Scheduler` in the tests returned by `get_test` to also limit the total
+    number of connections.
+
+    If the test for a domain raises an exception, an error is written for that domain and the scan
+    continues. Such domains are not added to the checkpoint, so they are tested again when the scan is
+    resumed.
+
+    Parameters
+    ----------
+
+    get_test : callable
+        A function that receives a domain and returns the test to run for it.
+    concurrency : int, optional
+        Maximum number of domains that are tested concurrently.
+    checkpoint : Checkpoint, optional
+        Domains in the checkpoint are skipped, and domains are added to it once they are completely tested.
+    """
+
+    get_test: Callable[[str], Test]
+    concurrency: int
+    checkpoint: Optional[Checkpoint]
+
+    tested: int
+    """Number of domains that were completely tested."""
+    failed: int
+    """Number of domains where the test raised an exception."""
+
+    def __init__(self, get_test: Callable[[str], Test], concurrency: int = 16,
+                 checkpoint: Optional[Checkpoint] = None) -> None:
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1.")
+
+        self.get_test = get_test
+        self.concurrency = concurrency
+        self.checkpoint = checkpoint
+        self.tested = 0
+        self.failed = 0
+
+    async def domain_iter(self, domain: str, semaphore: asyncio.Semaphore) -> AsyncIterator[Tuple]:
+        results = self.get_test(domain).aio_iter()
+        try:
+            async for result, tags in results:
+                yield _RESULT, domain, result, tags
+        except Exception as e:
+            yield _ERROR, domain, '%s: %s' % (type(e).__name__, e), []
+        else:
+            yield _DONE, domain, None, []
+        finally:
+            await results.aclose()
+            semaphore.release()
+
+    async def filter_domains(self, domains: Domains) -> AsyncIterator[str]:
+        """Skip duplicate domains and domains that are already in the checkpoint.
+
+        `domains` may also be an asynchronous iterable (see :py:func:`aio_read_domains`).
+        """
+
+        async def all_domains():
+            if isinstance(domains, AsyncIterable):
+                async for domain in domains:
+                    yield domain
+            else:
+                for domain in domains:
+                    yield domain
+
+        seen: Set[str] = set()
+        async for domain in all_domains():
+            if domain in seen or (self.checkpoint is not None and domain in self.checkpoint):
+                continue
+            seen.add(domain)
+            yield domain
+
+    async def iter(self, domains: Domains) -> AsyncIterator[Tuple]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def sources():
+            async for domain in self.filter_domains(domains):
+                # the next domain is only started once a slot is free, so `domains` is read lazily
+                await semaphore.acquire()
+                yield self.domain_iter(domain, semaphore)
+
+        async for item in merge(sources()):
+            yield item
+
+    def handle(self, item: Tuple, writer: BulkWriter) -> None:
+        """Write an item yielded by :py:meth:`iter` and update the checkpoint if a domain is done."""
+
+        kind, domain, result, tags = item
+        if kind == _RESULT:
+            if result is not None:
+                writer.write_result(domain, result)
+            for tag in tags:
+                writer.write_tag(domain, tag)
+        elif kind == _ERROR:
+            self.failed += 1
+            writer.write_error(domain, result)
+            writer.flush()
+        else:
+            self.tested += 1
+            writer.flush()  # results must be written before the domain is recorded in the checkpoint
+            if self.checkpoint is not None:
+                self.checkpoint.add(domain)
+
+    async def run(self, domains: Domains, writer: BulkWriter) -> Tuple[int, int]:
+        """Test all `domains` and write results as they become available.
+
+        Returns a tuple with the number of domains that were tested and the number of domains that failed.
+        """
+
+        async for item in self.iter(domains):
+            self.handle(item, writer)
+        return self.tested, self.failed
@@ -0,0 +1,412 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Analyze the certificate chains presented by servers.
+
+Every TLS probe captures the chain of the server, but a chain is parsed only once per process: chains and
+certificates are cached by their SHA-256 fingerprint, so all probes of a server (e.g. one for every cipher)
+share the same :py:class:`CertificateChain`.
+
+Parsing certificates requires the optional `cryptography <https://cryptography.io>`_ library. Without it,
+only fingerprints and the length of the chain are reported.
+"""
+
+import collections
+import hashlib
+import ssl
+from datetime import datetime
+from datetime import timezone
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives.asymmetric import dsa
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric import ed448
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import ExtensionOID
+    from cryptography.x509.oid import NameOID
+    from cryptography.x509.oid import ObjectIdentifier
+except ImportError:  # pragma: no cover
+    x509 = None
+
+if x509 is not None:
+    # otherName types for XMPP identities, see RFC 6120, section 13.7.1.4 and RFC 4985
+    OID_XMPP_ADDR = ObjectIdentifier('1.3.6.1.5.5.7.8.5')
+    OID_SRV_NAME = ObjectIdentifier('1.3.6.1.5.5.7.8.7')
+
+# Subjects of the CAs in the system trust store, loaded on first use, see get_trust_store()
+_TRUST_STORE: Optional[Dict[bytes, List['Certificate']]] = None
+
+
+def fingerprint(der: bytes) -> str:
+    """Get the SHA-256 fingerprint of a DER-encoded certificate.
+
+    >>> fingerprint(b'')[:16]
+    'e3b0c44298fc1c14'
+    """
+    return hashlib.sha256(der).hexdigest()
+
+
+def decode_der_string(value: bytes) -> Optional[str]:
+    """Decode a DER-encoded UTF8String or IA5String, as used in XmppAddr and SRVName identities.
+
+    >>> decode_der_string(b'\\x0c\\x0bexample.com')
+    'example.com'
+    >>> decode_der_string(b'\\x02\\x01\\x00') is None
+    True
+    """
+    if len(value) < 2 or value[0] not in (0x0c, 0x16):
+        return None
+
+    length, offset = value[1], 2
+    if length & 0x80:  # long form, the lower bits are the number of length bytes
+        count = length & 0x7f
+        length, offset = int.from_bytes(value[2:2 + count], 'big'), 2 + count
+    try:
+        return value[offset:offset + length].decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def name_matches(pattern: str, name: str) -> bool:
+    """Match a DNS name against a name from a certificate, which may have a wildcard as left-most label.
+
+    >>> name_matches('*.example.com', 'xmpp.example.com')
+    True
+    >>> name_matches('*.example.com', 'example.com')
+    False
+    >>> name_matches('Example.COM.', 'example.com')
+    True
+    """
+    pattern = pattern.lower().rstrip('.')
+    name = name.lower().rstrip('.')
+    if pattern.startswith('*.'):
+        label, _sep, rest = name.partition('.')
+        return bool(label) and rest == pattern[2:]
+    return pattern == name
+
+
+def to_idna(domain: str) -> str:
+    """Convert `domain` to the ASCII form used in certificates."""
+
+    try:
+        return domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        return domain
+
+
+def get_peer_chain(ssl_object: ssl.SSLObject) -> List[bytes]:
+    """Get the DER-encoded certificates sent by the server, starting with the server certificate."""
+
+    if hasattr(ssl_object, 'get_unverified_chain'):  # Python 3.13 or later
+        chain = ssl_object.get_unverified_chain()
+        if chain:
+            return chain
+
+    der = ssl_object.getpeercert(binary_form=True)
+    return [] if der is None else [der]
+
+
+def format_certificate(data: Optional[dict]) -> str:
+    """Format the data returned by :py:meth:`CertificateChain.as_dict` for a table.
+
+    >>> format_certificate({'key_type': 'RSA', 'key_size': 2048, 'not_after': '2030-01-01T00:00:00+00:00',
+    ...                     'expired': False, 'domain_match': True, 'chain_complete': False})
+    'RSA 2048, expires 2030-01-01, name ok, chain incomplete'
+    >>> format_certificate(None)
+    ''
+    """
+    if not data:
+        return ''
+
+    parts = []
+    if data.get('key_type'):
+        parts.append(' '.join(str(v) for v in (data['key_type'], data.get('key_size')) if v is not None))
+    if data.get('not_after'):
+        parts.append('%s %s' % ('expired' if data.get('expired') else 'expires', data['not_after'][:10]))
+    if data.get('domain_match') is not None:
+        parts.append('name ok' if data['domain_match'] else 'name mismatch')
+    if data.get('chain_complete') is not None:
+        parts.append('chain ok' if data['chain_complete'] else 'chain incomplete')
+    return ', '.join(parts) or data.get('fingerprint', '')[:16]
+
+
+class Certificate:
+    """A parsed certificate.
+
+    All attributes except for ``fingerprint`` are ``None`` if the ``cryptography`` library is not installed.
+    """
+
+    fingerprint: str
+    subject: Optional[str]
+    issuer: Optional[str]
+    not_before: Optional[datetime]
+    not_after: Optional[datetime]
+    key_type: Optional[str]
+    key_size: Optional[int]
+    dns_names: Tuple[str, ...]
+    xmpp_addrs: Tuple[str, ...]
+    srv_names: Tuple[str, ...]
+
+    def __init__(self, der: bytes, fingerprint: str) -> None:
+        self.fingerprint = fingerprint
+        self.subject = self.issuer = None
+        self.not_before = self.not_after = None
+        self.key_type = self.key_size = None
+        self.dns_names = self.xmpp_addrs = self.srv_names = ()
+        self._cert = None
+
+        if x509 is None:
+            return
+
+        try:
+            self._cert = cert = x509.load_der_x509_certificate(der)
+        except ValueError:
+            return
+
+        self.subject = self.get_name(cert.subject)
+        self.issuer = self.get_name(cert.issuer)
+        self.not_before = cert.not_valid_before_utc
+        self.not_after = cert.not_valid_after_utc
+        self.key_type, self.key_size = self.get_key(cert)
+
+        try:
+            names = cert.extensions.get_extension_for_oid(ExtensionOID.SUBJECT_ALTERNATIVE_NAME).value
+        except (x509.ExtensionNotFound, ValueError):
+            return
+
+        self.dns_names = tuple(names.get_values_for_type(x509.DNSName))
+        others = names.get_values_for_type(x509.OtherName)
+        self.xmpp_addrs = tuple(filter(None, [decode_der_string(o.value) for o in others
+                                              if o.type_id == OID_XMPP_ADDR]))
+        self.srv_names = tuple(filter(None, [decode_der_string(o.value) for o in others
+                                             if o.type_id == OID_SRV_NAME]))
+
+    @staticmethod
+    def get_name(name: 'x509.Name') -> str:
+        common_names = name.get_attributes_for_oid(NameOID.COMMON_NAME)
+        if common_names:
+            return str(common_names[0].value)
+        return name.rfc4514_string()
+
+    @staticmethod
+    def get_key(cert: 'x509.Certificate') -> Tuple[Optional[str], Optional[int]]:
+        try:
+            key = cert.public_key()
+        except (ValueError, TypeError):  # unsupported key type
+            return None, None
+
+        if isinstance(key, rsa.RSAPublicKey):
+            return 'RSA', key.key_size
+        elif isinstance(key, ec.EllipticCurvePublicKey):
+            return 'EC', key.key_size
+        elif isinstance(key, ed25519.Ed25519PublicKey):
+            return 'Ed25519', 256
+        elif isinstance(key, ed448.Ed448PublicKey):
+            return 'Ed448', 448
+        elif isinstance(key, dsa.DSAPublicKey):
+            return 'DSA', key.key_size
+        return type(key).__name__, None
+
+    @property
+    def self_signed(self) -> bool:
+        return self._cert is not None and self._cert.issuer == self._cert.subject and self.issued_by(self)
+
+    def issued_by(self, issuer: 'Certificate') -> bool:
+        """Whether this certificate is signed by the key of `issuer`."""
+
+        if self._cert is None or issuer._cert is None:
+            return False
+        try:
+            self._cert.verify_directly_issued_by(issuer._cert)
+            return True
+        except Exception:  # InvalidSignature, ValueError or TypeError, depending on what does not match
+            return False
+
+    def matches(self, domain: str, service: Optional[str] = None) -> bool:
+        """Whether the certificate is valid for the XMPP `domain`, see RFC 6120, section 13.7.2.1.
+
+        The reference identity is always the XMPP domain and never the target of the SRV record, as that
+        would require a DNSSEC-signed SRV record (RFC 7673), which is not checked. This is also true for
+        direct TLS (XEP-0368) connections, so the only difference is the name of the `service` accepted in
+        SRVName identities (e.g. ``"xmpps-client"``).
+        """
+
+        domain = to_idna(domain)
+        if any(name_matches(n, domain) for n in self.dns_names):
+            return True
+        if any(a.lower() == domain.lower() for a in self.xmpp_addrs):
+            return True
+
+        if service is not None:
+            services = {service, service.replace('xmpps-', 'xmpp-')}
+            for srv_name in self.srv_names:
+                srv_service, _sep, srv_domain = srv_name.partition('.')
+                if srv_service.lstrip('_') in services and name_matches(srv_domain, domain):
+                    return True
+        return False
+
+
+def get_trust_store() -> Dict[bytes, List[Certificate]]:
+    """Get the CAs of the system trust store by their DER-encoded subject, loaded only once per process.
+
+    Note that CAs from a ``capath`` directory are not included, as OpenSSL loads them only on demand.
+    """
+
+    global _TRUST_STORE
+    if _TRUST_STORE is None:
+        _TRUST_STORE = {}
+        if x509 is not None:
+            for der in ssl.create_default_context().get_ca_certs(binary_form=True):
+                cert = Certificate(der, fingerprint(der))
+                if cert._cert is not None:
+                    _TRUST_STORE.setdefault(cert._cert.subject.public_bytes(), []).append(cert)
+    return _TRUST_STORE
+
+
+class CertificateChain:
+    """The chain of certificates sent by a server, starting with the server certificate.
+
+    ``complete`` tells if the chain can be followed from the server certificate to a self-signed certificate
+    or a CA in the system trust store. It is ``None`` if this cannot be determined, e.g. if the
+    ``cryptography`` library is not installed.
+    """
+
+    certificates: Tuple[Certificate, ...]
+    complete: Optional[bool]
+
+    def __init__(self, certificates: Sequence[Certificate]) -> None:
+        self.certificates = tuple(certificates)
+        self.complete = self.is_complete()
+        self._matches: Dict[Tuple[str, Optional[str]], bool] = {}
+
+    @property
+    def certificate(self) -> Certificate:
+        return self.certificates[0]
+
+    def is_complete(self) -> Optional[bool]:
+        if x509 is None or any(c._cert is None for c in self.certificates):
+            return None
+
+        for cert, issuer in zip(self.certificates, self.certificates[1:]):
+            if not cert.issued_by(issuer):
+                return False
+
+        last = self.certificates[-1]
+        if last.self_signed:
+            return True
+
+        trust_store = get_trust_store()
+        if not trust_store:
+            return None
+        return any(last.issued_by(ca) for ca in trust_store.get(last._cert.issuer.public_bytes(), []))
+
+    def matches(self, domain: str, service: Optional[str] = None) -> bool:
+        """Cached version of :py:meth:`Certificate.matches` for the server certificate."""
+
+        key = (domain, service)
+        match = self._matches.get(key)
+        if match is None:
+            match = self._matches[key] = self.certificate.matches(domain, service)
+        return match
+
+    def as_dict(self, domain: str, service: Optional[str] = None) -> dict:
+        cert = self.certificate
+        not_after = cert.not_after
+        return collections.OrderedDict([
+            ('fingerprint', cert.fingerprint),
+            ('subject', cert.subject),
+            ('issuer', cert.issuer),
+            ('not_after', None if not_after is None else not_after.isoformat()),
+            ('expired', None if not_after is None else not_after <= datetime.now(timezone.utc)),
+            ('domain_match', None if x509 is None else self.matches(domain, service)),
+            ('key_type', cert.key_type),
+            ('key_size', cert.key_size),
+            ('chain_length', len(self.certificates)),
+            ('chain_complete', self.complete),
+        ])
+
+
+class CertificateCache:
+    """An LRU cache of parsed certificates and chains, keyed by SHA-256 fingerprints.
+
+    Parameters
+    ----------
+
+    max_size : int, optional
+        Maximum number of certificates and of chains held in the cache.
+    """
+
+    max_size: int
+
+    def __init__(self, max_size: int = 4096) -> None:
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self._certificates: collections.OrderedDict = collections.OrderedDict()
+        self._chains: collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._certificates)
+
+    def _set(self, data: collections.OrderedDict, key, value) -> None:
+        if self.max_size <= 0:
+            return
+        data[key] = value
+        while len(data) > self.max_size:
+            data.popitem(last=False)
+
+    def get_certificate(self, der: bytes, fp: Optional[str] = None) -> Certificate:
+        if fp is None:
+            fp = fingerprint(der)
+
+        cert = self._certificates.get(fp)
+        if cert is None:
+            cert = Certificate(der, fp)
+            self._set(self._certificates, fp, cert)
+        else:
+            self._certificates.move_to_end(fp)
+        return cert
+
+    def get_chain(self, chain: Sequence[bytes]) -> Optional[CertificateChain]:
+        """Get the parsed chain for a list of DER-encoded certificates, ``None`` if the list is empty."""
+
+        if not chain:
+            return None
+
+        fingerprints = tuple(fingerprint(der) for der in chain)
+        parsed = self._chains.get(fingerprints)
+        if parsed is not None:
+            self._chains.move_to_end(fingerprints)
+            self.hits += 1
+            return parsed
+
+        self.misses += 1
+        parsed = CertificateChain([self.get_certificate(der, fp) for der, fp in zip(chain, fingerprints)])
+        self._set(self._chains, fingerprints, parsed)
+        return parsed
+
+    def clear(self) -> None:
+        self._certificates.clear()
+        self._chains.clear()
+
+
+certificate_cache = CertificateCache()
+"""Certificates of all probes in this process."""
@@ -0,0 +1,447 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Write bulk results as a set of typed, dictionary-encoded CSV tables for analytics.
+
+The output is a directory with one CSV file per table:
+
+* ``targets``: One row per target (``target_id``, ``domain``, ``source``, ``target``, ``ip``, ``port``).
+* ``results``: One row per result (``result_id``, ``target_id`` and the data of the result).
+* ``timings``: One row per phase of a result (``result_id``, ``target_id``, ``phase``, ``ms``).
+* ``certificates``: One row per certificate and domain (``domain``, ``fingerprint``, ...), results reference
+  it in their ``certificate`` column.
+* ``tags`` and ``errors``: Tags and errors of every domain.
+* ``dictionaries``: Values of dictionary-encoded columns (``table``, ``column``, ``code``, ``value``).
+
+Columns with few distinct values (e.g. the TLS version and cipher of results, the phase of timings or the
+level of tags) are dictionary-encoded: they contain integer codes that are resolved in the ``dictionaries``
+table. Free-text columns (e.g. error messages) are written as plain strings. ``schema.json`` names the test
+that the results are from and lists the columns and types of every table. The columns of a table are fixed
+by its first row, and the type of a column is fixed by its first value (or declared up front). Columns without
+any values yet have the type ``null``. Rows are buffered and written in batches, and every new run appends to
+existing tables.
+
+Results of different tests have different columns, so every test needs its own directory. A result whose
+values do not match the existing columns is reported as an error of its domain instead.
+"""
+
+import collections
+import csv
+import json
+import os
+from enum import Enum
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .base import TestResult
+from .bulk import BulkWriter
+from .tags import Tag
+
+
+def get_type(value: Any) -> Optional[str]:
+    """Get the column type for `value`, ``None`` for ``None``.
+
+    >>> get_type(True), get_type(3), get_type(0.5), get_type('a'), get_type(None)
+    ('bool', 'int', 'float', 'string', None)
+    """
+    if value is None:
+        return None
+    elif isinstance(value, bool):
+        return 'bool'
+    elif isinstance(value, int):
+        return 'int'
+    elif isinstance(value, float):
+        return 'float'
+    return 'string'
+
+
+def convert(value: Any, typ: str) -> Any:
+    """Convert `value` to a value of the column type `typ`.
+
+    >>> convert(3, 'float'), convert(3, 'string'), convert(None, 'int')
+    (3.0, '3', None)
+    >>> convert('3', 'int')
+    Traceback (most recent call last):
+        ...
+    TypeError: Cannot store a string value in a column of type int.
+    """
+    value_type = get_type(value)
+    if value_type is None or value_type == typ:
+        return value
+    elif typ == 'float' and value_type == 'int':
+        return float(value)
+    elif typ == 'string':
+        return str(value)
+    raise TypeError('Cannot store a %s value in a column of type %s.' % (value_type, typ))
+
+
+def format_value(value: Any) -> Any:
+    """Format a value for CSV, booleans are written as ``true``/``false`` and ``None`` as empty string."""
+
+    if value is None:
+        return ''
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def read_rows(path: str) -> Iterator[List[str]]:
+    if not os.path.exists(path):
+        return
+    with open(path, newline='') as stream:
+        yield from csv.reader(stream)
+
+
+class _LRUDict(collections.OrderedDict):
+    def __init__(self, max_size: int) -> None:
+        super().__init__()
+        self.max_size = max_size
+
+    def get_recent(self, key) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.move_to_end(key)
+        return value
+
+    def add(self, key, value) -> None:
+        self[key] = value
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+class Table:
+    """A CSV file that rows are appended to in batches.
+
+    The columns are taken from the first row (or the header of an existing file). Adding a row with a key
+    that is not a column raises ``ValueError``.
+
+    Parameters
+    ----------
+
+    path : str
+        Path to the CSV file.
+    dictionary : tuple of str, optional
+        Columns that are dictionary-encoded. Only columns with few distinct values should be encoded, as all
+        values are kept in memory.
+    types : dict, optional
+        Types of columns known up front. The type of any other column is fixed by its first value that is not
+        ``None``.
+    """
+
+    path: str
+    dictionary: Tuple[str, ...]
+    columns: Optional[List[str]]
+    types: Dict[str, Optional[str]]
+
+    def __init__(self, path: str, dictionary: Tuple[str, ...] = (),
+                 types: Optional[Dict[str, str]] = None) -> None:
+        self.path = path
+        self.dictionary = dictionary
+        self.columns = next(read_rows(path), None)
+        self.types = dict(types or {})
+        for column in dictionary:  # columns contain codes of string values
+            self.types[column] = 'string'
+        self.rows: List[List[Any]] = []
+        self._stream = None
+        self._writer = None
+
+    def check(self, row: Dict[str, Any]) -> None:
+        """Check if `row` can be added without modifying anything.
+
+        Raises ``ValueError`` if the row has keys that are not a column and ``TypeError`` if a value cannot be
+        converted to the type of its column. Dictionary-encoded columns are not checked.
+        """
+
+        self.check_columns(row)
+        for column, value in row.items():
+            typ = self.types.get(column)
+            if typ is not None and not self.is_encoded(column):
+                convert(value, typ)
+
+    def check_columns(self, row: Dict[str, Any]) -> None:
+        if self.columns is None:
+            return
+
+        unknown = [c for c in row if c not in self.columns]
+        if unknown:
+            raise ValueError('%s has no column %s, write results of different tests to different '
+                             'directories.' % (os.path.basename(self.path), ', '.join(unknown)))
+
+    def add(self, row: Dict[str, Any]) -> None:
+        if self.columns is None:
+            self.columns = list(row)
+        self.check_columns(row)
+        self.rows.append([row.get(c) for c in self.columns])
+
+    def is_encoded(self, column: str) -> bool:
+        return column in self.dictionary
+
+    def convert(self, column: str, value: Any) -> Any:
+        """Convert `value` to the type of `column`, fixing the type if this is the first value."""
+
+        typ = self.types.get(column)
+        if typ is None:
+            self.types[column] = get_type(value)
+            return value
+        return convert(value, typ)
+
+    def write(self) -> None:
+        """Write all buffered rows."""
+
+        if not self.rows:
+            return
+
+        if self._writer is None:
+            exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            self._stream = open(self.path, 'a', newline='')
+            self._writer = csv.writer(self._stream)
+            if not exists:
+                self._writer.writerow(self.columns)
+
+        self._writer.writerows([[format_value(v) for v in row] for row in self.rows])
+        self.rows = []
+
+    def flush(self) -> None:
+        self.write()
+        if self._stream is not None:
+            self._stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = self._writer = None
+
+    def schema(self) -> List[dict]:
+        return [{'name': c, 'type': self.types.get(c), 'dictionary': self.is_encoded(c)}
+                for c in self.columns or []]
+
+
+TARGET_TYPES = {'target_id': 'int', 'domain': 'string', 'source': 'string', 'target': 'string',
+                'ip': 'string', 'port': 'int'}
+RESULT_TYPES = {'result_id': 'int', 'target_id': 'int', 'success': 'bool', 'starttls': 'int',
+                'error': 'string', 'certificate': 'string', 'resumed': 'bool', 'preference': 'int',
+                'connect_time': 'float'}
+TIMING_TYPES = {'result_id': 'int', 'target_id': 'int', 'ms': 'float'}
+TAG_TYPES = {'domain': 'string', 'id': 'int', 'message': 'string'}
+DICTIONARY_TYPES = {'table': 'string', 'column': 'string', 'code': 'int', 'value': 'string'}
+
+
+class ColumnarWriter(BulkWriter):
+    """Write results, tags and errors to typed, dictionary-encoded CSV tables in `path`.
+
+    See the module documentation for a description of the tables. Every table keeps up to `batch_size` rows
+    in memory, all buffered rows are written when the writer is flushed (i.e. when a domain is done).
+
+    Parameters
+    ----------
+
+    path : str
+        The directory to write the tables to, created if it does not exist.
+    test : str, optional
+        The name of the test that results are from. Writing to a directory with results of a different test
+        raises ``ValueError``.
+    batch_size : int, optional
+        Maximum number of rows buffered in every table.
+    cache_size : int, optional
+        Maximum number of targets and certificates remembered to avoid duplicate rows.
+    """
+
+    path: str
+    test: Optional[str]
+    batch_size: int
+
+    def __init__(self, path: str, test: Optional[str] = None, batch_size: int = 1000,
+                 cache_size: int = 65536) -> None:
+        super().__init__(None)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.test = test
+        self.batch_size = batch_size
+
+        self.tables = collections.OrderedDict([
+            ('targets', Table(self.get_path('targets'), types=TARGET_TYPES)),
+            ('results', Table(self.get_path('results'), dictionary=('protocol', 'cipher'),
+                              types=RESULT_TYPES)),
+            ('timings', Table(self.get_path('timings'), dictionary=('phase', ), types=TIMING_TYPES)),
+            ('certificates', Table(self.get_path('certificates'), types={'domain': 'string'})),
+            ('tags', Table(self.get_path('tags'), dictionary=('level', 'group'), types=TAG_TYPES)),
+            ('errors', Table(self.get_path('errors'), types={'domain': 'string', 'error': 'string'})),
+            ('dictionaries', Table(self.get_path('dictionaries'), types=DICTIONARY_TYPES)),
+        ])
+        self._targets = _LRUDict(cache_size)
+        self._certificates = _LRUDict(cache_size)
+        self._codes: Dict[Tuple[str, str], Dict[str, int]] = collections.defaultdict(dict)
+        self._schema = None
+        self.load()
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.path, '%s.csv' % name)
+
+    def load(self) -> None:
+        """Load the state of tables written by a previous run, so that this run can append to them."""
+
+        schema_path = os.path.join(self.path, 'schema.json')
+        if os.path.exists(schema_path):
+            with open(schema_path) as stream:
+                schema = json.load(stream)
+
+            if self.test is None:
+                self.test = schema['test']
+            elif schema['test'] is not None and schema['test'] != self.test:
+                raise ValueError('%s contains results of the %s test, write results of different tests to '
+                                 'different directories.' % (self.path, schema['test']))
+
+            for name, columns in schema['tables'].items():
+                types = self.tables[name].types
+                for column in columns:
+                    if types.get(column['name']) is None:
+                        types[column['name']] = column['type']
+
+        rows = read_rows(self.get_path('dictionaries'))
+        next(rows, None)  # skip the header
+        for table, column, code, value in rows:
+            self._codes[(table, column)][value] = int(code)
+
+        self._next_target_id = max((int(r[0]) for r in self.iter_ids('targets')), default=0) + 1
+        self._next_result_id = max((int(r[0]) for r in self.iter_ids('results')), default=0) + 1
+
+    def iter_ids(self, table: str) -> Iterator[List[str]]:
+        rows = read_rows(self.get_path(table))
+        next(rows, None)  # skip the header
+        return (r for r in rows if r)
+
+    def encode(self, table: str, column: str, value: str) -> int:
+        codes = self._codes[(table, column)]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.add('dictionaries', {'table': table, 'column': column, 'code': code, 'value': value})
+        return code
+
+    def check(self, rows: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Check that all ``(table, row)`` tuples can be added, see :py:meth:`Table.check`."""
+
+        for name, row in rows:
+            for column, value in row.items():
+                if isinstance(value, Enum):  # e.g. STARTTLS, written as their value like in JSON output
+                    row[column] = value.value
+            self.tables[name].check(row)
+
+    def add(self, name: str, row: Dict[str, Any]) -> None:
+        table = self.tables[name]
+        for column, value in row.items():
+            if isinstance(value, Enum):
+                value = row[column] = value.value
+
+            if value is not None and table.is_encoded(column):
+                row[column] = self.encode(name, column, str(value))
+            else:
+                row[column] = table.convert(column, value)
+
+        table.add(row)
+        if len(table.rows) >= self.batch_size:
+            self.write_dictionaries()
+            table.write()
+
+    def write_dictionaries(self) -> None:
+        # codes must be known before any row using them is read
+        self.tables['dictionaries'].write()
+
+    def write_result(self, domain: str, result: TestResult) -> None:
+        """Write a result.
+
+        If the result has a column that its table does not have or a value does not match the type of its
+        column, nothing is written and an error is written for the domain instead.
+        """
+
+        data = collections.OrderedDict(result.json())  # records return their own data
+        timings = data.pop('timings', None) or {}
+        rows = []  # all rows are checked before any of them is added
+
+        target_key = (domain, data.pop('source'), data.pop('target'), data.pop('ip'), data.pop('port'))
+        target_id = self._targets.get_recent(target_key)
+        new_target = target_id is None
+        if new_target:
+            target_id = self._next_target_id
+            rows.append(('targets', collections.OrderedDict(
+                zip(('target_id', 'domain', 'source', 'target', 'ip', 'port'), (target_id, ) + target_key))))
+        result_id = self._next_result_id
+
+        certificate_key = None
+        certificate = data.get('certificate')
+        if certificate is not None:
+            data['certificate'] = certificate['fingerprint']
+            certificate_key = (domain, certificate['fingerprint'])
+            if self._certificates.get_recent(certificate_key) is None:
+                rows.append(('certificates', collections.OrderedDict(domain=domain, **certificate)))
+
+        row = collections.OrderedDict([('result_id', result_id), ('target_id', target_id)])
+        row.update(data)
+        rows.append(('results', row))
+        for phase, ms in timings.items():
+            rows.append(('timings', collections.OrderedDict([
+                ('result_id', result_id), ('target_id', target_id), ('phase', phase), ('ms', ms),
+            ])))
+
+        try:
+            self.check(rows)
+        except (TypeError, ValueError) as e:
+            self.write_error(domain, 'Cannot write result for %s: %s' % (target_key[3], e))
+            return
+
+        if new_target:
+            self._next_target_id += 1
+            self._targets.add(target_key, target_id)
+        self._next_result_id += 1
+        if certificate_key is not None:
+            self._certificates.add(certificate_key, True)
+        for name, row in rows:
+            self.add(name, row)
+
+    def write_tag(self, domain: str, tag: Tag) -> None:
+        row = collections.OrderedDict(domain=domain)
+        row.update(tag.as_dict())
+        self.add('tags', row)
+
+    def write_error(self, domain: str, error: str) -> None:
+        self.add('errors', collections.OrderedDict([('domain', domain), ('error', error)]))
+
+    def write_schema(self) -> None:
+        schema = collections.OrderedDict([
+            ('test', self.test),
+            ('tables', collections.OrderedDict((n, t.schema()) for n, t in self.tables.items() if t.columns)),
+        ])
+        if schema == self._schema:
+            return
+
+        path = os.path.join(self.path, 'schema.json')
+        with open('%s.tmp' % path, 'w') as stream:
+            json.dump(schema, stream, indent=4)
+        os.replace('%s.tmp' % path, path)
+        self._schema = schema
+
+    def flush(self) -> None:
+        self.write_dictionaries()
+        for table in self.tables.values():
+            table.flush()
+        self.write_schema()
+
+    def close(self) -> None:
+        self.flush()
+        for table in self.tables.values():
+            table.close()
@@ -0,0 +1,211 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A caching DNS resolver shared by all tests."""
+
+import asyncio
+import collections
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import aiodns
+
+CacheKey = Tuple[str, str]
+
+# Errors that mean "this name/type has no records" and are thus safe to cache.
+NEGATIVE_ERRORS = (
+    aiodns.error.ARES_ENOTFOUND,
+    aiodns.error.ARES_ENODATA,
+)
+
+
+class DNSCache:
+    """An LRU cache for DNS answers, keyed by ``(name, rrtype)``.
+
+    Positive answers are cached for the smallest TTL of all records in the answer, negative answers
+    (NXDOMAIN or no data) are cached for ``negative_ttl`` seconds.
+
+    Parameters
+    ----------
+
+    max_size : int, optional
+        Maximum number of answers held in the cache. The least recently used answer is evicted first.
+    negative_ttl : int, optional
+        How long to cache NXDOMAIN/no-data answers, in seconds.
+    min_ttl : int, optional
+        Lower bound for the TTL of positive answers, in seconds.
+    max_ttl : int, optional
+        Upper bound for the TTL of positive answers, in seconds.
+    """
+
+    max_size: int
+    negative_ttl: int
+    min_ttl: int
+    max_ttl: int
+
+    def __init__(self, max_size: int = 4096, negative_ttl: int = 60, min_ttl: int = 0,
+                 max_ttl: int = 3600) -> None:
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self._data: collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: CacheKey) -> Optional[Tuple[float, Any]]:
+        """Get the cached ``(expires, answer)`` tuple for `key` or ``None`` if there is no valid entry.
+
+        ``answer`` is either the list of records or the :py:class:`aiodns.error.DNSError` for a negative
+        answer.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: CacheKey, answer: Any) -> None:
+        """Add an answer to the cache, `answer` is either a list of records or a DNSError."""
+
+        if isinstance(answer, aiodns.error.DNSError):
+            ttl = self.negative_ttl
+        else:
+            ttl = min([r.ttl for r in answer], default=self.min_ttl)
+            ttl = max(self.min_ttl, min(ttl, self.max_ttl))
+
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, answer)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class Resolver:
+    """A DNS resolver caching answers in a :py:class:`DNSCache`.
+
+    Concurrent identical queries are coalesced into a single query to the upstream resolver.
+
+    Parameters
+    ----------
+
+    cache : DNSCache, optional
+        The cache to use, a new cache with default parameters is created if not given.
+    nameservers : list of str, optional
+        Nameservers to use, the default is to use the system configuration.
+    port : int, optional
+        The port that nameservers listen on, the default is ``53``.
+    """
+
+    cache: DNSCache
+    nameservers: Optional[Sequence[str]]
+    port: Optional[int]
+
+    def __init__(self, cache: Optional[DNSCache] = None, nameservers: Optional[Sequence[str]] = None,
+                 port: Optional[int] = None) -> None:
+        if cache is None:
+            cache = DNSCache()
+
+        self.cache = cache
+        self.nameservers = nameservers
+        self.port = port
+        self._resolvers: Dict[asyncio.AbstractEventLoop, aiodns.DNSResolver] = {}
+        self._pending: Dict[CacheKey, asyncio.Future] = {}
+
+    def get_resolver(self) -> aiodns.DNSResolver:
+        """Get the (uncached) resolver for the current event loop."""
+
+        loop = asyncio.get_event_loop()
+        resolver = self._resolvers.get(loop)
+        if resolver is None:
+            # discard resolvers of event loops that are no longer used
+            self._resolvers = {k: v for k, v in self._resolvers.items() if not k.is_closed()}
+            kwargs = {}
+            if self.port is not None:
+                kwargs = {'udp_port': self.port, 'tcp_port': self.port}
+            resolver = self._resolvers[loop] = aiodns.DNSResolver(nameservers=self.nameservers, loop=loop,
+                                                                  **kwargs)
+        return resolver
+
+    def configure(self, nameservers: Optional[Sequence[str]] = None, port: Optional[int] = None) -> None:
+        """Use different nameservers from now on."""
+
+        self.nameservers = nameservers
+        self.port = port
+        self._resolvers = {}
+
+    async def query(self, name: str, rrtype: str) -> List[Any]:
+        """Query DNS records, using the cache if possible.
+
+        This function behaves like :py:meth:`aiodns.DNSResolver.query`, it raises
+        :py:class:`aiodns.error.DNSError` if the query fails.
+        """
+
+        key = (name.lower(), rrtype.upper())
+        entry = self.cache.get(key)
+        if entry is not None:
+            answer = entry[1]
+            if isinstance(answer, aiodns.error.DNSError):
+                # raise a copy so that tracebacks don't accumulate on the cached instance
+                raise aiodns.error.DNSError(*answer.args)
+            return answer
+
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._query(key))
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._query_done(key, f))
+
+        # shield the shared query, so that one cancelled caller does not cancel it for everybody else
+        return await asyncio.shield(future)
+
+    def _query_done(self, key: CacheKey, future: asyncio.Future) -> None:
+        self._pending.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # mark the exception as retrieved even if all callers went away
+
+    async def _query(self, key: CacheKey) -> List[Any]:
+        try:
+            answer = await self.get_resolver().query(*key)
+        except aiodns.error.DNSError as e:
+            if e.args and e.args[0] in NEGATIVE_ERRORS:
+                self.cache.set(key, e)
+            raise
+
+        self.cache.set(key, answer)
+        return answer
+
+
+resolver = Resolver()
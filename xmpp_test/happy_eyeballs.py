@@ -0,0 +1,107 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Connect to the targets of an SRV record like a real client would, using Happy Eyeballs (RFC 8305)."""
+
+import asyncio
+import itertools
+import socket
+import time
+from typing import Awaitable
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .base import XMPPTarget
+from .metrics import metrics
+
+CONNECTION_ATTEMPT_DELAY = 0.25
+"""Delay between starting two connection attempts, as recommended in RFC 8305, section 5."""
+
+
+def sort_targets(targets: List[XMPPTarget]) -> List[XMPPTarget]:
+    """Sort targets for connection attempts by interleaving address families, starting with IPv6.
+
+    >>> from .base import SRVRecord
+    >>> srv = SRVRecord('xmpp-client', 'tcp', 'example.com', 60, 0, 0, 5222, 'xmpp.example.com')
+    >>> targets = [XMPPTarget(srv, ip) for ip in ['192.0.2.1', '192.0.2.2', '2001:db8::1']]
+    >>> [str(t.ip) for t in sort_targets(targets)]
+    ['2001:db8::1', '192.0.2.1', '192.0.2.2']
+    """
+
+    ip6 = [t for t in targets if t.is_ip6]
+    ip4 = [t for t in targets if t.is_ip4]
+    interleaved = itertools.chain.from_iterable(itertools.zip_longest(ip6, ip4))
+    return [t for t in interleaved if t is not None]
+
+
+async def open_socket(target: XMPPTarget, timeout: float) -> socket.socket:
+    """Open a non-blocking TCP socket to the given target."""
+
+    family = socket.AF_INET6 if target.is_ip6 else socket.AF_INET
+    sock = socket.socket(family=family, type=socket.SOCK_STREAM)
+    sock.setblocking(False)
+
+    loop = asyncio.get_event_loop()
+    try:
+        with metrics.connection():  # callers count the connection while they use it (see StreamProbe.run)
+            await asyncio.wait_for(loop.sock_connect(sock, (str(target.ip), target.srv.port)), timeout)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def race(targets: List[XMPPTarget], connect: Callable[[XMPPTarget], Awaitable[socket.socket]],
+               delay: float = CONNECTION_ATTEMPT_DELAY
+               ) -> Tuple[Optional[XMPPTarget], Optional[socket.socket], Optional[float]]:
+    """Race connection attempts to `targets` and return the first connection that succeeds.
+
+    Targets are tried in the order returned by :py:func:`sort_targets`. A new attempt is started `delay`
+    seconds after the previous one, or as soon as the previous attempt fails. Once a connection succeeds, all
+    other attempts are cancelled.
+
+    Returns a tuple of the winning target, its socket and the time it took to connect (in seconds), or
+    ``(None, None, None)`` if all attempts failed.
+    """
+
+    start = time.monotonic()
+    remaining = sort_targets(targets)
+    attempts = {}
+
+    try:
+        while remaining or attempts:
+            if remaining:
+                target = remaining.pop(0)
+                attempts[asyncio.ensure_future(connect(target))] = target
+
+            done, _pending = await asyncio.wait(list(attempts), timeout=delay if remaining else None,
+                                                return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                target = attempts.pop(attempt)
+                if not attempt.cancelled() and attempt.exception() is None:
+                    return target, attempt.result(), time.monotonic() - start
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+        if attempts:
+            await asyncio.wait(list(attempts))
+
+        # Attempts that completed at the same time as the winner still hold an open socket
+        for attempt in attempts:
+            if not attempt.cancelled() and attempt.exception() is None:
+                attempt.result().close()
+
+    return None, None, None
@@ -0,0 +1,218 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Run tests in the background with a bounded number of workers."""
+
+import asyncio
+import collections
+import enum
+import time
+import uuid
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .base import Test
+
+
+class JOB_STATUS(enum.Enum):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+    cancelled = 'cancelled'
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the backlog is full."""
+
+    pass
+
+
+class Job:
+    """A test running in the background.
+
+    Results and tags are added as soon as they are available, so a client polling the job sees partial
+    results while the test is running.
+    """
+
+    id: str
+    name: str
+    test: Test
+    status: JOB_STATUS
+
+    def __init__(self, name: str, test: Test) -> None:
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.test = test
+        self.status = JOB_STATUS.queued
+        self.data: List[dict] = []
+        self.tags: List[dict] = []
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Future] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_STATUS.done, JOB_STATUS.failed, JOB_STATUS.cancelled)
+
+    def finish(self, status: JOB_STATUS, error: Optional[str] = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        self.test = None  # the test is no longer needed and may hold on to a lot of memory
+
+    async def run(self) -> None:
+        self.status = JOB_STATUS.running
+        async for result, tags in self.test.aio_iter():
+            if result is not None:
+                self.data.append(result.json())
+            self.tags += [t.as_dict() for t in tags]
+
+    def as_dict(self) -> dict:
+        return collections.OrderedDict([
+            ('id', self.id),
+            ('test', self.name),
+            ('status', self.status.value),
+            ('created', self.created),
+            ('finished', self.finished),
+            ('error', self.error),
+            ('data', self.data),
+            ('tags', self.tags),
+        ])
+
+
+class JobQueue:
+    """Run jobs with a bounded number of workers.
+
+    At most `workers` jobs run at the same time, and at most `backlog` jobs wait for a free worker.
+    Submitting a job while the backlog is full raises :py:class:`QueueFull`, cancelled jobs are removed from
+    the backlog right away. Finished jobs are kept for `keep` seconds so that clients can fetch the results.
+
+    Parameters
+    ----------
+
+    workers : int, optional
+        Maximum number of jobs running at the same time.
+    backlog : int, optional
+        Maximum number of jobs waiting to be started.
+    keep : float, optional
+        How long finished jobs are kept, in seconds.
+    """
+
+    workers: int
+    backlog: int
+    keep: float
+
+    def __init__(self, workers: int = 4, backlog: int = 64, keep: float = 3600) -> None:
+        if workers < 1:
+            raise ValueError("Number of workers must be at least 1.")
+
+        self.workers = workers
+        self.backlog = backlog
+        self.keep = keep
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Deque[Job] = collections.deque()
+        self._queued = asyncio.Event()  # set when a job is added to the queue
+        self._workers: List[asyncio.Future] = []
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def start(self) -> None:
+        """Start the worker tasks in the current event loop."""
+
+        self._queued = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self.worker()) for i in range(self.workers)]
+        self._workers.append(asyncio.ensure_future(self.expire_periodically()))  # stopped like the workers
+
+    async def stop(self) -> None:
+        """Cancel all jobs and stop the worker tasks."""
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        self._queue.clear()
+        for job in self.jobs.values():
+            if not job.is_finished:
+                job.finish(JOB_STATUS.cancelled)
+
+    def is_expired(self, job: Job, now: float) -> bool:
+        return job.finished is not None and job.finished + self.keep <= now
+
+    def expire(self) -> None:
+        """Remove finished jobs that are older than ``keep`` seconds."""
+
+        now = time.time()
+        self.jobs = {k: v for k, v in self.jobs.items() if not self.is_expired(v, now)}
+
+    async def expire_periodically(self) -> None:
+        """Expire jobs even if no new jobs are submitted."""
+
+        while True:
+            await asyncio.sleep(min(max(self.keep, 1), 60))
+            self.expire()
+
+    def submit(self, name: str, test: Test) -> Job:
+        self.expire()
+        if len(self._queue) >= self.backlog:
+            raise QueueFull('Too many queued jobs.')
+
+        job = Job(name, test)
+        self._queue.append(job)
+        self._queued.set()
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is not None and self.is_expired(job, time.time()):
+            del self.jobs[job_id]
+            return None
+        return job
+
+    def cancel(self, job: Job) -> None:
+        if job.task is not None:
+            job.task.cancel()  # the worker marks the job as cancelled
+        elif not job.is_finished:  # still queued
+            self._queue.remove(job)
+            job.finish(JOB_STATUS.cancelled)
+
+    async def worker(self) -> None:
+        while True:
+            while not self._queue:
+                self._queued.clear()
+                await self._queued.wait()
+            job = self._queue.popleft()
+
+            job.task = asyncio.ensure_future(job.run())
+            try:
+                await asyncio.wait([job.task])  # unlike awaiting the task, this does not cancel it
+            except asyncio.CancelledError:  # the queue is stopped
+                job.task.cancel()
+                job.finish(JOB_STATUS.cancelled)
+                raise
+
+            if job.task.cancelled():
+                job.finish(JOB_STATUS.cancelled)
+            elif job.task.exception() is not None:
+                e = job.task.exception()
+                job.finish(JOB_STATUS.failed, '%s: %s' % (type(e).__name__, e))
+            else:
+                job.finish(JOB_STATUS.done)
+            job.task = None
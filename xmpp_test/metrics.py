@@ -0,0 +1,213 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Collect metrics of running tests and render them in the Prometheus text format.
+
+This module does not depend on ``prometheus_client``, it only implements the small part of the text
+exposition format that is needed here.
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+from typing import Dict
+from typing import Iterator
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from .timings import Histogram
+
+PREFIX = 'xmpp_test_'
+
+current_test: contextvars.ContextVar = contextvars.ContextVar('current_test', default=None)
+"""Name of the test running in the current context, set by :py:meth:`xmpp_test.base.Test.aio_iter`."""
+
+current_target: contextvars.ContextVar = contextvars.ContextVar('current_target', default=None)
+"""The target (or SRV record) that the test running in the current context connects to."""
+
+
+def format_value(value: float) -> str:
+    """Format a sample value.
+
+    >>> format_value(3), format_value(0.25), format_value(float('inf'))
+    ('3', '0.25', '+Inf')
+    """
+
+    if value == float('inf'):
+        return '+Inf'
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels: Optional[Dict[str, str]]) -> str:
+    """Format labels of a sample.
+
+    >>> format_labels({'test': 'basic', 'outcome': 'say "hi"'})
+    '{test="basic",outcome="say \\\\"hi\\\\""}'
+    >>> format_labels(None)
+    ''
+    """
+
+    if not labels:
+        return ''
+
+    def escape(value: str) -> str:
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in labels.items())
+
+
+class Exposition:
+    """Collect metric families and render them in the Prometheus text format (version 0.0.4).
+
+    >>> e = Exposition()
+    >>> e.gauge('open_connections', 'Open connections.', 3)
+    >>> print(e.render(), end='')
+    # HELP xmpp_test_open_connections Open connections.
+    # TYPE xmpp_test_open_connections gauge
+    xmpp_test_open_connections 3
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix: str = PREFIX) -> None:
+        self.prefix = prefix
+        self.families: Dict[str, Tuple[str, str, list]] = collections.OrderedDict()
+
+    def add(self, typ: str, name: str, help: str,
+            samples: Iterable[Tuple[str, Optional[dict], float]]) -> None:
+        """Add samples ``(suffix, labels, value)`` to the family `name`."""
+
+        name = self.prefix + name
+        if name not in self.families:
+            self.families[name] = (typ, help, [])
+        self.families[name][2].extend((name + suffix, labels, value) for suffix, labels, value in samples)
+
+    def counter(self, name: str, help: str, value: float, labels: Optional[dict] = None) -> None:
+        self.add('counter', name, help, [('', labels, value)])
+
+    def gauge(self, name: str, help: str, value: float, labels: Optional[dict] = None) -> None:
+        self.add('gauge', name, help, [('', labels, value)])
+
+    def histogram(self, name: str, help: str, histogram: Histogram, labels: Optional[dict] = None) -> None:
+        labels = labels or {}
+        samples = [('_bucket', dict(labels, le=format_value(float(bound))), count)
+                   for bound, count in zip(histogram.buckets, histogram.counts)]
+        samples += [
+            ('_bucket', dict(labels, le='+Inf'), histogram.count),
+            ('_sum', labels, histogram.sum),
+            ('_count', labels, histogram.count),
+        ]
+        self.add('histogram', name, help, samples)
+
+    def render(self) -> str:
+        lines = []
+        for name, (typ, help, samples) in self.families.items():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, typ))
+            for sample, labels, value in samples:
+                lines.append('%s%s %s' % (sample, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Counters for tests and probes in this process."""
+
+    def __init__(self) -> None:
+        self.running: Dict[str, int] = collections.Counter()
+        self.tests: Dict[str, int] = collections.Counter()
+        self.probes: Dict[Tuple[str, str], int] = collections.Counter()
+        self.open_connections = 0
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[None]:
+        """Count a connection to an XMPP target as open while the block is executed.
+
+        Every test that opens connections (sockets or streams) must use this, so that the number of open
+        connections is accurate.
+        """
+
+        self.open_connections += 1
+        try:
+            yield
+        finally:
+            self.open_connections -= 1
+
+    def test_started(self, test: str) -> None:
+        self.running[test] += 1
+        self.tests[test] += 1
+
+    def test_finished(self, test: str) -> None:
+        self.running[test] -= 1
+
+    def probe_done(self, outcome: str) -> None:
+        """Count a finished connection of the test running in the current context."""
+
+        self.probes[(current_test.get() or 'unknown', outcome)] += 1
+
+    def collect(self, exposition: Exposition) -> None:
+        exposition.add('gauge', 'tests_running', 'Tests that are currently running.', [
+            ('', {'test': test}, count) for test, count in sorted(self.running.items())])
+        exposition.add('counter', 'tests_total', 'Tests that were started.', [
+            ('', {'test': test}, count) for test, count in sorted(self.tests.items())])
+        exposition.add('counter', 'probes_total', 'Connections to XMPP targets, by outcome.', [
+            ('', {'test': test, 'outcome': outcome}, count)
+            for (test, outcome), count in sorted(self.probes.items())])
+
+
+metrics = Metrics()
+"""Counters of all tests in this process."""
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up from a sleep of `interval` seconds.
+
+    If callbacks block the event loop, every other task (e.g. all concurrent probes) is delayed by the same
+    amount, so a high lag inflates all timings.
+
+    Parameters
+    ----------
+
+    interval : float, optional
+        How often to measure the lag, in seconds.
+    """
+
+    interval: float
+
+    def __init__(self, interval: float = 0.5) -> None:
+        self.interval = interval
+        self.lag = 0.0
+        self.histogram = Histogram()
+        self._task: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        """Start measuring in the current event loop."""
+
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.histogram.observe(self.lag)
@@ -0,0 +1,329 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A minimal XMPP stream prober that only negotiates the stream up to (and including) STARTTLS."""
+
+import asyncio
+import socket
+import ssl
+import sys
+from typing import Optional
+from xml.etree import ElementTree as ET
+
+from .certs import CertificateChain
+from .certs import certificate_cache
+from .certs import get_peer_chain
+from .metrics import metrics
+from .timings import Timings
+from .timings import histograms
+from .tls import offer_session
+from .types import STARTTLS
+from .types import Timeouts
+
+STREAM_NS = 'http://etherx.jabber.org/streams'
+TLS_NS = 'urn:ietf:params:xml:ns:xmpp-tls'
+CLIENT_NS = 'jabber:client'
+SERVER_NS = 'jabber:server'
+
+STREAM_HEADER = "<stream:stream to='%s' xmlns:stream='%s' xmlns='%s' xml:lang='en' version='1.0'>"
+STARTTLS_REQUEST = "<starttls xmlns='%s'/>" % TLS_NS
+
+PROBE_PHASES = ('connect', 'stream', 'features', 'proceed', 'tls', 'negotiated')
+"""Phases that are added to :py:data:`~xmpp_test.timings.histograms` when a probe is done."""
+
+
+class StreamError(Exception):
+    """Raised when the stream cannot be negotiated."""
+
+    pass
+
+
+def describe_error(exc: BaseException) -> str:
+    """Get a short description of an exception raised while probing."""
+
+    if isinstance(exc, asyncio.TimeoutError):
+        return 'timeout'
+    elif isinstance(exc, ssl.SSLError):
+        return 'TLS error: %s' % (exc.reason or exc)
+    elif isinstance(exc, OSError) and exc.strerror:
+        return exc.strerror
+    return str(exc) or type(exc).__name__
+
+
+def classify_error(exc: BaseException) -> str:
+    """Get the outcome of a probe that failed with `exc`, used as label in metrics."""
+
+    if isinstance(exc, asyncio.TimeoutError):
+        return 'timeout'
+    elif isinstance(exc, ssl.SSLError):
+        return 'tls_error'
+    elif isinstance(exc, OSError):
+        return 'connection_error'
+    return 'stream_error'
+
+
+class StreamProbe(asyncio.Protocol):
+    """Open an XMPP stream, read the stream features and negotiate STARTTLS if the server offers it.
+
+    This is all that tests need from an XMPP client, so there is no need for a full XMPP library: Stream
+    features are parsed with an incremental XML parser and the connection is upgraded to TLS with
+    :py:meth:`asyncio.loop.start_tls`.
+
+    Parameters
+    ----------
+
+    host : str
+        The XMPP domain, used in the stream header and for SNI.
+    ssl_context : SSLContext, optional
+        The context used for TLS connections. If not given, a default context is used.
+    use_ssl : bool, optional
+        Use XEP-0368 style direct TLS instead of STARTTLS.
+    default_ns : str, optional
+        The default namespace of the stream, ``"jabber:client"`` by default.
+    timeouts : Timeouts, optional
+        Deadlines for the individual phases of the connection.
+    timings : Timings, optional
+        Timings to add the phases of this probe to, e.g. a copy of the timings of the target.
+    session : SSLSession, optional
+        A TLS session to resume. Sessions are only offered if `ssl_context` is a
+        :py:class:`~xmpp_test.tls.SessionContext`.
+    pipeline : bool, optional
+        Send the STARTTLS request right after the stream header instead of waiting for the stream features.
+        This saves a round trip, but should only be used if the server is known to offer STARTTLS.
+    negotiate_tls : bool, optional
+        Set to ``False`` to stop after the first stream features, e.g. to only find out if the server offers
+        STARTTLS.
+
+    After the probe, ``session`` is the TLS session of the connection and ``session_reused`` tells if the
+    offered session was resumed (it is ``None`` if no session was offered). ``certificate`` is the certificate
+    chain of the server (see :py:mod:`xmpp_test.certs`) if a TLS handshake was completed.
+    """
+
+    host: str
+    ssl_context: Optional[ssl.SSLContext]
+    use_ssl: bool
+    default_ns: str
+
+    timeouts: Timeouts
+    timings: Timings
+
+    success: bool
+    error: Optional[str]
+    phase: str
+    starttls: Optional[bool]
+    tls_version: Optional[str]
+    cipher: Optional[str]
+    session: Optional[ssl.SSLSession]
+    session_reused: Optional[bool]
+    certificate: Optional[CertificateChain]
+
+    def __init__(self, host: str, ssl_context: Optional[ssl.SSLContext] = None, use_ssl: bool = False,
+                 default_ns: str = CLIENT_NS, timeouts: Timeouts = Timeouts(),
+                 timings: Optional[Timings] = None, session: Optional[ssl.SSLSession] = None,
+                 pipeline: bool = False, negotiate_tls: bool = True) -> None:
+        self.host = host
+        self.ssl_context = ssl_context
+        self.use_ssl = use_ssl
+        self.default_ns = default_ns
+        self.timeouts = timeouts
+        self.timings = Timings() if timings is None else timings
+        self.session = session
+        self.pipeline = pipeline
+        self.negotiate_tls = negotiate_tls
+        self.session_reused = None
+
+        self.success = False
+        self.error = None  # description of the error if the probe failed
+        self.phase = 'connect'  # the phase the probe is currently in
+        self.starttls = None  # None if not offered, otherwise if it is required
+        self.tls_version = None
+        self.cipher = None
+        self.certificate = None
+
+        self.transport: Optional[asyncio.Transport] = None
+        self._parser: Optional[ET.XMLPullParser] = None
+        self._depth = 0
+        self._elements: asyncio.Queue = asyncio.Queue()
+
+    def get_ssl_context(self) -> ssl.SSLContext:
+        if self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        return self.ssl_context
+
+    # asyncio.Protocol methods
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore
+
+    def data_received(self, data: bytes) -> None:
+        if self._parser is None:
+            return
+
+        try:
+            self._parser.feed(data)
+            for event, elem in self._parser.read_events():
+                if event == 'start':
+                    if self._depth == 0 and 'stream' not in self.timings:
+                        self.timings.mark('stream')
+                    self._depth += 1
+                    continue
+
+                self._depth -= 1
+                if self._depth == 1:  # a direct child of <stream:stream/> is complete
+                    self._elements.put_nowait(elem)
+                elif self._depth == 0:
+                    self._elements.put_nowait(StreamError('Stream closed by server.'))
+        except ET.ParseError as e:
+            self._elements.put_nowait(StreamError('Invalid XML: %s' % e))
+
+    def eof_received(self) -> Optional[bool]:
+        self._elements.put_nowait(StreamError('Connection closed by server.'))
+        return None
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._elements.put_nowait(StreamError('Connection lost: %s' % (exc or 'closed')))
+
+    # stream handling
+    def open_stream(self) -> None:
+        """Send a (new) stream header and reset the parser."""
+
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._depth = 0
+        self._elements = asyncio.Queue()
+        self.transport.write((STREAM_HEADER % (self.host, STREAM_NS, self.default_ns)).encode('utf-8'))
+
+    async def read_element(self, tag: str) -> ET.Element:
+        elem = await self._elements.get()
+        if isinstance(elem, Exception):
+            raise elem
+        if elem.tag == '{%s}error' % STREAM_NS:
+            raise StreamError('Stream error: %s' % ', '.join(e.tag.split('}')[-1] for e in elem))
+        if elem.tag != tag:
+            raise StreamError('Unexpected element: %s' % elem.tag)
+        return elem
+
+    async def start_tls(self) -> None:
+        loop = asyncio.get_event_loop()
+        with offer_session(self.session):
+            self.transport = await asyncio.wait_for(loop.start_tls(
+                self.transport, self, self.get_ssl_context(), server_hostname=self.host
+            ), self.timeouts.tls)
+        self.timings.mark('tls')
+
+        ssl_object = self.transport.get_extra_info('ssl_object')
+        if ssl_object is not None:
+            self.certificate = certificate_cache.get_chain(get_peer_chain(ssl_object))
+
+    async def negotiate(self, address: str, port: int, sock: Optional[socket.socket] = None) -> None:
+        loop = asyncio.get_event_loop()
+        timeouts = self.timeouts
+
+        if sock is None:
+            await asyncio.wait_for(loop.create_connection(lambda: self, host=address, port=port),
+                                   timeouts.connect)
+        else:
+            await loop.create_connection(lambda: self, sock=sock)
+        if 'connect' not in self.timings:  # a connected socket may come with its own timings
+            self.timings.mark('connect')
+
+        if self.use_ssl:
+            # The TLS handshake is started separately, so that it is timed separately from the TCP connection
+            self.phase = 'tls'
+            await self.start_tls()
+
+        self.phase = 'features'
+        self.open_stream()
+        pipeline = self.pipeline and self.negotiate_tls and not self.use_ssl
+        if pipeline:
+            self.transport.write(STARTTLS_REQUEST.encode('utf-8'))
+        features = await asyncio.wait_for(self.read_element('{%s}features' % STREAM_NS), timeouts.features)
+        self.timings.mark('features')
+        starttls = features.find('{%s}starttls' % TLS_NS)
+        if starttls is not None and not self.use_ssl:
+            self.starttls = starttls.find('{%s}required' % TLS_NS) is not None
+
+        if self.starttls is not None and self.negotiate_tls:
+            self.phase = 'starttls'
+            if not pipeline:
+                self.transport.write(STARTTLS_REQUEST.encode('utf-8'))
+            await asyncio.wait_for(self.read_element('{%s}proceed' % TLS_NS), timeouts.features)
+            self.timings.mark('proceed')
+
+            self.phase = 'tls'
+            self._parser = None  # discard anything received until the stream is restarted
+            await self.start_tls()
+
+            self.phase = 'features'
+            self.open_stream()
+            await asyncio.wait_for(self.read_element('{%s}features' % STREAM_NS), timeouts.features)
+
+        ssl_object = self.transport.get_extra_info('ssl_object')
+        if ssl_object is not None:
+            # interned, as results of many probes keep these strings
+            self.tls_version = sys.intern(ssl_object.version())
+            self.cipher = sys.intern(ssl_object.cipher()[0])
+            if self.session is not None:
+                self.session_reused = ssl_object.session_reused
+            self.session = ssl_object.session  # read after the stream features, so TLSv1.3 tickets are there
+        self.phase = 'done'
+        self.timings.mark('negotiated')
+        self.success = True
+
+    async def run(self, address: str, port: int, timeout: Optional[float] = None,
+                  sock: Optional[socket.socket] = None) -> bool:
+        """Connect to `address` and `port` and negotiate the stream, returns ``True`` on success.
+
+        If `sock` is given, it must be a socket that is already connected to `address` and `port`.
+
+        Every phase of the connection has its own deadline (see ``timeouts``), `timeout` is an optional
+        deadline for the whole probe. If any deadline is hit, ``error`` is set to ``"timeout"`` and ``phase``
+        tells which phase timed out. The connection is always closed when this method returns.
+
+        The phases of the connection are recorded in ``timings``.
+        """
+
+        if 'start' not in self.timings:
+            self.timings.mark('start')
+
+        outcome = 'aborted'  # e.g. if the test was cancelled
+        try:
+            with metrics.connection():
+                if timeout is None:
+                    await self.negotiate(address, port, sock=sock)
+                else:
+                    await asyncio.wait_for(self.negotiate(address, port, sock=sock), timeout)
+            outcome = 'success'
+        except (OSError, asyncio.TimeoutError, StreamError) as e:
+            self.error = describe_error(e)
+            outcome = classify_error(e)
+        finally:
+            histograms.observe_timings(self.timings, PROBE_PHASES)
+            metrics.probe_done(outcome)
+            if self.transport is not None:
+                self.transport.abort()
+            elif sock is not None:
+                sock.close()
+        return self.success
+
+    @property
+    def starttls_required(self) -> STARTTLS:
+        if not self.success:
+            return STARTTLS.unknown
+        elif self.use_ssl:
+            return STARTTLS.not_applicable
+        elif self.starttls is None:
+            return STARTTLS.no
+        elif self.starttls is False:
+            return STARTTLS.optional
+        elif self.starttls is True:
+            return STARTTLS.required
+        return STARTTLS.unknown
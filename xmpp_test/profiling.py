@@ -0,0 +1,168 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Opt-in profiling of the event loop.
+
+A callback that runs for a long time blocks the event loop and thus delays every other probe that is running
+at the same time. :py:class:`SlowCallbackMonitor` times every callback run by the event loop and reports
+callbacks that take longer than a threshold, together with the test and the target they belong to.
+"""
+
+import asyncio
+import cProfile
+import collections
+import logging
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .metrics import LoopLagMonitor
+from .metrics import current_target
+from .metrics import current_test
+
+log = logging.getLogger(__name__)
+
+
+class SlowCallbackMonitor:
+    """Report event loop callbacks that run longer than `threshold` seconds.
+
+    :py:meth:`install` wraps :py:meth:`asyncio.Handle._run <asyncio.Handle>`, so it applies to all event loops
+    in this process. A callback runs in the context it was scheduled in (e.g. the context of a task), so the
+    test and target it belongs to are read from the context of the handle.
+
+    Parameters
+    ----------
+
+    threshold : float, optional
+        Callbacks running longer than this many seconds are reported.
+    """
+
+    threshold: float
+
+    def __init__(self, threshold: float = 0.05) -> None:
+        self.threshold = threshold
+        self.slow: Dict[Tuple[str, str], List[float]] = {}  # (test, target) -> [count, total, max]
+        self._original = None
+
+    def install(self) -> None:
+        if self._original is not None:
+            return
+
+        original = self._original = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                duration = time.perf_counter() - start
+                if duration >= monitor.threshold:
+                    monitor.report(handle, duration)
+
+        asyncio.events.Handle._run = _run  # type: ignore
+
+    def uninstall(self) -> None:
+        if self._original is not None:
+            asyncio.events.Handle._run = self._original  # type: ignore
+            self._original = None
+
+    def report(self, handle: asyncio.Handle, duration: float) -> None:
+        context = getattr(handle, '_context', None)
+        test = target = None
+        if context is not None:
+            test = context.get(current_test)
+            target = context.get(current_target)
+        test = test or '-'
+        target = target or '-'
+
+        stats = self.slow.setdefault((test, target), [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+
+        log.warning('Callback blocked the event loop for %.1f ms (test: %s, target: %s): %r',
+                    duration * 1000, test, target, handle)
+
+    def summary(self) -> List[dict]:
+        """Get statistics of slow callbacks for every test and target, the most expensive first."""
+
+        rows = sorted(self.slow.items(), key=lambda item: item[1][1], reverse=True)
+        return [collections.OrderedDict([
+            ('test', test),
+            ('target', target),
+            ('count', count),
+            ('total (ms)', round(total * 1000, 1)),
+            ('max (ms)', round(maximum * 1000, 1)),
+        ]) for (test, target), (count, total, maximum) in rows]
+
+
+class Profiler:
+    """Profile the event loop while tests are running.
+
+    Measures the event loop lag, reports slow callbacks (see :py:class:`SlowCallbackMonitor`) and optionally
+    writes a :py:mod:`cProfile` profile to `profile` (use :py:mod:`pstats` or e.g. ``snakeviz`` to view it).
+
+    Parameters
+    ----------
+
+    slow_callback : float, optional
+        Threshold for slow callbacks, in seconds.
+    lag_interval : float, optional
+        How often to measure the event loop lag, in seconds.
+    profile : str, optional
+        Path to write a cProfile profile to.
+    """
+
+    profile: Optional[str]
+
+    def __init__(self, slow_callback: float = 0.05, lag_interval: float = 0.1,
+                 profile: Optional[str] = None) -> None:
+        self.monitor = SlowCallbackMonitor(slow_callback)
+        self.loop_lag = LoopLagMonitor(lag_interval)
+        self.profile = profile
+        self._profile: Optional[cProfile.Profile] = None
+
+    def start(self) -> None:
+        """Start profiling, the event loop lag is measured in the current event loop."""
+
+        self.monitor.install()
+        self.loop_lag.start()
+        if self.profile is not None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    async def stop(self) -> None:
+        """Stop profiling and write the profile."""
+
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.profile)
+            self._profile = None
+        await self.loop_lag.stop()
+        self.monitor.uninstall()
+
+    def lag_summary(self) -> dict:
+        histogram = self.loop_lag.histogram
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value * 1000, 1)
+
+        return collections.OrderedDict([
+            ('samples', histogram.count),
+            ('mean lag (ms)', ms(histogram.sum / histogram.count if histogram.count else None)),
+            ('p50 lag (ms)', ms(histogram.quantile(.5))),
+            ('p99 lag (ms)', ms(histogram.quantile(.99))),
+        ])
@@ -0,0 +1,107 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Limit the number of concurrent connections of tests."""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from typing import Dict
+
+
+class _Host:
+    def __init__(self, limit: int) -> None:
+        self.semaphore = asyncio.Semaphore(limit)
+        self.next_start = 0.0
+        self.users = 0
+
+
+class Scheduler:
+    """Limit the number of concurrent connections globally and per host.
+
+    A scheduler can be shared by multiple tests (e.g. all tests started by the HTTP server), in which case the
+    limits apply to all of them.
+
+    Parameters
+    ----------
+
+    limit : int, optional
+        Maximum number of concurrent connections.
+    host_limit : int, optional
+        Maximum number of concurrent connections to a single host.
+    host_delay : float, optional
+        Minimum delay in seconds between starting two connections to the same host. The default (``0``)
+        disables pacing.
+    """
+
+    limit: int
+    host_limit: int
+    host_delay: float
+
+    def __init__(self, limit: int = 64, host_limit: int = 8, host_delay: float = 0.0) -> None:
+        if limit < 1 or host_limit < 1:
+            raise ValueError("Concurrency limits must be at least 1.")
+
+        self.limit = limit
+        self.host_limit = host_limit
+        self.host_delay = host_delay
+
+        self._semaphore = asyncio.Semaphore(limit)
+        self._hosts: Dict[str, _Host] = {}
+        self.active = 0
+
+    @property
+    def waiting(self) -> int:
+        """Number of connections waiting for a slot."""
+
+        return sum(h.users for h in self._hosts.values()) - self.active
+
+    @asynccontextmanager
+    async def slot(self, host: str) -> AsyncIterator[None]:
+        """Asynchronous context manager that waits until a connection to `host` may be opened.
+
+        >>> async def probe(scheduler):
+        ...     async with scheduler.slot('192.0.2.1'):
+        ...         return scheduler.active
+        >>> asyncio.get_event_loop().run_until_complete(probe(Scheduler()))
+        1
+        """
+
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _Host(self.host_limit)
+        state.users += 1
+
+        try:
+            # acquire the per-host slot first, so that waiting for a busy host does not block a global slot
+            async with state.semaphore:
+                async with self._semaphore:
+                    # pace only once the global slot is acquired, otherwise connections that waited for it
+                    # would all start at the same time
+                    if self.host_delay > 0:
+                        now = time.monotonic()
+                        start = max(now, state.next_start)
+                        state.next_start = start + self.host_delay
+                        if start > now:
+                            await asyncio.sleep(start - now)
+
+                    self.active += 1
+                    try:
+                        yield
+                    finally:
+                        self.active -= 1
+        finally:
+            state.users -= 1
+            if state.users == 0 and state.next_start <= time.monotonic():
+                del self._hosts[host]
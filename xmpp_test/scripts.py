@@ -12,31 +12,177 @@
 # <http://www.gnu.org/licenses/>.
 
 import argparse
+import asyncio
 import csv
+import functools
 import json
+import logging
 import sys
+from typing import Optional
 
 from tabulate import tabulate  # type: ignore
 
+from .bulk import BulkScan
+from .bulk import CSVWriter
+from .bulk import Checkpoint
+from .bulk import NDJSONWriter
+from .bulk import aio_read_domains
+from .bulk import read_domains
+from .columnar import ColumnarWriter
 from .constants import Check
+from .profiling import Profiler
+from .scheduler import Scheduler
 from .server import run_server
+from .sharding import ShardedScan
+from .store import ResultStore
 from .tests.dns import DNSTest
 from .tests.socket import SocketTest
 from .tests.xmpp import BasicConnectTest
 from .tests.xmpp import TLSCipherTest
 from .tests.xmpp import TLSVersionTest
 from .tests.tls import TLSSupportedTest
+from .timings import histograms
 from .types import TLS_VERSION
 
 
+@functools.lru_cache(maxsize=None)
+def get_store(path: str) -> ResultStore:
+    """Get the result store at `path`, opened once per process."""
+    return ResultStore(path)
+
+
+def get_test(args: argparse.Namespace, domain: str, scheduler: Scheduler):
+    store = None if args.store is None else get_store(args.store)
+    if args.command == 'dns':
+        return DNSTest(domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps, store=store)
+
+    kwargs = {'scheduler': scheduler, 'store': store, 'max_age': args.max_age if args.incremental else None}
+    if args.command == 'socket':
+        return SocketTest(domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps,
+                          happy_eyeballs=args.happy_eyeballs, **kwargs)
+    elif args.command == 'basic':
+        return BasicConnectTest(domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps,
+                                happy_eyeballs=args.happy_eyeballs, **kwargs)
+    elif args.command == 'tls_version':
+        exclude_protocols = [getattr(TLS_VERSION, p) for p in args.exclude_protocol or []]
+        return TLSVersionTest(domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps,
+                              exclude=exclude_protocols, reuse=args.reuse, **kwargs)
+    elif args.command == 'tls_cipher':
+        return TLSCipherTest(domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps,
+                             enumerate_ciphers=args.enumerate, reuse=args.reuse, **kwargs)
+
+
+def get_profiler(args: argparse.Namespace):
+    """Get a :py:class:`~xmpp_test.profiling.Profiler` if profiling was requested, otherwise ``None``."""
+
+    if not args.profile_loop and args.profile is None:
+        return None
+
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    return Profiler(slow_callback=args.slow_callback, profile=args.profile)
+
+
+def print_profile(profiler: Profiler) -> None:
+    print('Event loop lag:', file=sys.stderr)
+    print(tabulate([profiler.lag_summary()], headers='keys'), file=sys.stderr)
+    slow = profiler.monitor.summary()
+    if slow:
+        print('Slow callbacks:', file=sys.stderr)
+        print(tabulate(slow, headers='keys'), file=sys.stderr)
+    if profiler.profile is not None:
+        print('Profile written to %s.' % profiler.profile, file=sys.stderr)
+
+
+def bulk(args: argparse.Namespace, scheduler: Scheduler, columnar: Optional[ColumnarWriter] = None) -> None:
+    """Run the test selected by `args` for all domains read from ``args.domains``.
+
+    `columnar` is the writer to use for columnar output.
+    """
+
+    if args.domains == '-':
+        domain_stream = sys.stdin
+        domains = aio_read_domains(domain_stream)  # waiting for input must not block tests
+    else:
+        domain_stream = open(args.domains)
+        domains = read_domains(domain_stream)
+    checkpoint = None if args.checkpoint is None else Checkpoint(args.checkpoint)
+
+    output = None
+    if args.format == 'columnar':
+        writer = columnar
+    else:
+        output = sys.stdout if args.output is None else open(args.output, 'a')
+        writer = CSVWriter(output) if args.format == 'csv' else NDJSONWriter(output)
+    if args.processes > 1:
+        scheduler_options = {
+            'limit': max(1, args.concurrency // args.processes),
+            'host_limit': args.host_concurrency,
+            'host_delay': args.host_delay,
+        }
+        scan = ShardedScan(functools.partial(get_test, args), concurrency=args.domain_concurrency,
+                           checkpoint=checkpoint, processes=args.processes, shard_size=args.shard_size,
+                           scheduler_options=scheduler_options)
+    else:
+        scan = BulkScan(lambda domain: get_test(args, domain, scheduler),
+                        concurrency=args.domain_concurrency, checkpoint=checkpoint)
+
+    loop = asyncio.get_event_loop()
+    profiler = get_profiler(args)
+    if profiler is not None:
+        profiler.start()
+    try:
+        tested, failed = loop.run_until_complete(scan.run(domains, writer))
+    finally:
+        if profiler is not None:
+            loop.run_until_complete(profiler.stop())
+        if checkpoint is not None:
+            checkpoint.close()
+        writer.close()
+        if output is not None and output is not sys.stdout:
+            output.close()
+        if domain_stream is not sys.stdin:
+            domain_stream.close()
+
+    print('Tested %s domains, %s failed.' % (tested, failed), file=sys.stderr)
+    if args.timings:
+        print(tabulate(histograms.summary(), headers='keys'), file=sys.stderr)
+    if profiler is not None:
+        print_profile(profiler)
+
+
 def test() -> None:
     domain_parser = argparse.ArgumentParser(add_help=False)
-    domain_parser.add_argument('domain', help="The domain to test.")
+    domain_parser.add_argument('domain', nargs='?', help="The domain to test.")
+    bulk_group = domain_parser.add_argument_group(
+        'Bulk mode', 'Test many domains in one run. Results are written as newline-delimited JSON (the '
+        'default), CSV or CSV tables (see --format) as soon as they are available.')
+    bulk_group.add_argument('--domains', metavar='FILE',
+                            help='Test all domains in FILE (one per line, "-" for stdin) instead of DOMAIN.')
+    bulk_group.add_argument('--domain-concurrency', type=int, default=16, metavar='N',
+                            help="Maximum number of domains tested concurrently (default: %(default)s).")
+    bulk_group.add_argument('--checkpoint', metavar='FILE',
+                            help="Skip domains listed in FILE and add domains to it once they are tested. "
+                            "Use this to resume an interrupted run.")
+    bulk_group.add_argument('-o', '--output', metavar='FILE',
+                            help="Append results to FILE instead of writing them to stdout. With "
+                            "--format=columnar, FILE is the directory for the tables.")
+    bulk_group.add_argument('--processes', type=int, default=1, metavar='N',
+                            help="Spread domains over N worker processes (default: %(default)s). "
+                            "--domain-concurrency applies to every process, --concurrency is split evenly.")
+    bulk_group.add_argument('--shard-size', type=int, default=32, metavar='N',
+                            help="Number of domains handed to a worker process at once "
+                            "(default: %(default)s).")
 
     protocol_parser = argparse.ArgumentParser(add_help=False)
     # TODO: add include option
     protocol_parser.add_argument('--exclude-protocol', action='append')  # TODO: choices, help
 
+    reuse_parser = argparse.ArgumentParser(add_help=False)
+    reuse_parser.add_argument(
+        '--reuse', action='store_true', default=False,
+        help="Share TLS contexts between probes, resume TLS sessions and fetch the stream features only once "
+        "per target. Results show if a session was resumed.")
+
     parser = argparse.ArgumentParser()
     typ_group = parser.add_mutually_exclusive_group()
     typ_group.add_argument('-c', '--client', dest='typ', default=Check.CLIENT,
@@ -51,60 +197,146 @@ def test() -> None:
                         help="Do not test IPv4 connections.")
     parser.add_argument('--no-ipv6', dest='ipv6', default=True, action='store_false',
                         help="Do not test IPv6 connections.")
-    parser.add_argument('-f', '--format', default='table', choices=['table', 'json', 'csv'],
-                        help="Output format to use (default: %(default)s).")
+    parser.add_argument('--concurrency', type=int, default=64, metavar='N',
+                        help="Maximum number of concurrent connections (default: %(default)s).")
+    parser.add_argument('--host-concurrency', type=int, default=8, metavar='N',
+                        help="Maximum number of concurrent connections per IP (default: %(default)s).")
+    parser.add_argument('--host-delay', type=float, default=0, metavar='SECONDS',
+                        help="Minimum delay between two connections to the same IP (default: %(default)s).")
+    parser.add_argument('--store', metavar='FILE',
+                        help="Save results in the SQLite database FILE.")
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help="Only test targets that are not in --store, whose DNS records changed or whose "
+                        "results are older than --max-age.")
+    parser.add_argument('--max-age', type=float, default=86400, metavar='SECONDS',
+                        help="Maximum age of stored results in incremental mode (default: %(default)s).")
+    parser.add_argument('-f', '--format', choices=['table', 'json', 'csv', 'columnar'],
+                        help="Output format to use (default: table, json in bulk mode). columnar writes "
+                        "typed, dictionary-encoded CSV tables for results, targets, timings and tags to the "
+                        "directory given with --output.")
+    parser.add_argument('--timings', action='store_true', default=False,
+                        help="Show the time spent in every phase of a test and a summary of all tests (on "
+                        "stderr in bulk mode). JSON output always includes timings of every result.")
+
+    profile_group = parser.add_argument_group(
+        'Profiling', 'Find out what blocks the event loop. Results are printed to stderr when the test is '
+        'done. With --processes, only the parent process is profiled.')
+    profile_group.add_argument('--profile-loop', action='store_true', default=False,
+                               help="Measure the event loop lag and report callbacks that block the event "
+                               "loop.")
+    profile_group.add_argument('--slow-callback', type=float, default=0.05, metavar='SECONDS',
+                               help="Report callbacks that block the event loop for longer than this "
+                               "(default: %(default)s).")
+    profile_group.add_argument('--profile', metavar='FILE',
+                               help="Write a cProfile profile to FILE, view it with e.g. "
+                               "\"python -m pstats FILE\". Implies --profile-loop.")
 
     subparsers = parser.add_subparsers(help='Commands', dest='command')
 
     subparsers.add_parser('dns', parents=[domain_parser], help='Test DNS records for this domain.')
-    subparsers.add_parser('socket', parents=[domain_parser], help='Simple TCP socket connection test.')
-    subparsers.add_parser('basic', parents=[domain_parser], help='Basic XMPP connection test.')
-    subparsers.add_parser('tls_version', parents=[domain_parser, protocol_parser],
+    happy_eyeballs_parser = argparse.ArgumentParser(add_help=False)
+    happy_eyeballs_parser.add_argument(
+        '--happy-eyeballs', action='store_true', default=False,
+        help="Race connections to all addresses of an SRV record like a real client would (RFC 8305).")
+
+    subparsers.add_parser('socket', parents=[domain_parser, happy_eyeballs_parser],
+                          help='Simple TCP socket connection test.')
+    subparsers.add_parser('basic', parents=[domain_parser, happy_eyeballs_parser],
+                          help='Basic XMPP connection test.')
+    subparsers.add_parser('tls_version', parents=[domain_parser, protocol_parser, reuse_parser],
                           help='Test TLS protocol version support.')
-    subparsers.add_parser('tls_cipher', parents=[domain_parser], help='Test TLS cipher support.')
+    cipher_parser = subparsers.add_parser('tls_cipher', parents=[domain_parser, reuse_parser],
+                                          help='Test TLS cipher support.')
+    cipher_parser.add_argument(
+        '--enumerate', action='store_true', default=False,
+        help="Enumerate ciphers accepted by the server instead of testing every cipher individually.")
     server_parser = subparsers.add_parser('http-server', help='Start HTTP server serving tests.')
     server_parser.add_argument(
         '--host', action='append',
         help='Host interfaces to listen on, defaults to "0.0.0.0". Can be given multiple times.')
     server_parser.add_argument('--port')
+    server_parser.add_argument('--dns-cache-size', type=int, metavar='N',
+                               help='Maximum number of DNS answers to cache (default: 4096).')
+    server_parser.add_argument('--cache-ttl', type=float, default=300, metavar='SECONDS',
+                               help='How long to cache test results, 0 disables caching '
+                               '(default: %(default)s).')
+    server_parser.add_argument('--cache-size', type=int, default=256, metavar='N',
+                               help='Maximum number of cached test results (default: %(default)s).')
+    server_parser.add_argument('--job-workers', type=int, default=4, metavar='N',
+                               help='Maximum number of background jobs running at once '
+                               '(default: %(default)s).')
+    server_parser.add_argument('--job-backlog', type=int, default=64, metavar='N',
+                               help='Maximum number of background jobs waiting to be started, further jobs '
+                               'are rejected (default: %(default)s).')
 
     info_parser = subparsers.add_parser('info',
                                         help='Print info on what TLS/SSL versions and ciphers are supported.')
     info_parser.add_argument('what', choices=['version', 'cipher'])
 
     args = parser.parse_args()
+    scheduler = Scheduler(limit=args.concurrency, host_limit=args.host_concurrency,
+                          host_delay=args.host_delay)
+    columnar = None
 
-    if args.command == 'dns':
-        test = DNSTest(args.domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps)
-    elif args.command == 'socket':
-        test = SocketTest(args.domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps)
-    elif args.command == 'basic':
-        test = BasicConnectTest(args.domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps)
-    elif args.command == 'tls_version':
-        exclude_protocols = [getattr(TLS_VERSION, p) for p in args.exclude_protocol]
-        test = TLSVersionTest(args.domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps,
-                              exclude=exclude_protocols)
-    elif args.command == 'tls_cipher':
-        test = TLSCipherTest(args.domain, typ=args.typ, ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps)
+    if args.command in ('dns', 'socket', 'basic', 'tls_version', 'tls_cipher'):
+        if (args.domain is None) == (args.domains is None):
+            parser.error('Give either a domain or --domains.')
+        if args.incremental and args.store is None:
+            parser.error('--incremental requires --store.')
+        if args.domains is not None and args.format == 'table':
+            parser.error('Bulk mode only supports json, csv and columnar output.')
+
+        if args.format == 'columnar':
+            if args.output is None:
+                parser.error('--format=columnar requires --output.')
+            name = args.command
+            if getattr(args, 'happy_eyeballs', False):  # results of races have different columns
+                name += ' --happy-eyeballs'
+            try:
+                columnar = ColumnarWriter(args.output, test=name)
+            except ValueError as e:  # the directory contains results of another test
+                parser.error(str(e))
+
+        if args.domains is not None:
+            bulk(args, scheduler, columnar)
+            return
+
+        test = get_test(args, args.domain, scheduler)
 
     elif args.command == 'info':
         test = TLSSupportedTest(what=args.what)
 
     # commands that don't start a test
     elif args.command == 'http-server':
-        run_server(ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps, host=args.host, port=args.port)
+        run_server(ipv4=args.ipv4, ipv6=args.ipv6, xmpps=args.xmpps, host=args.host, port=args.port,
+                   dns_cache_size=args.dns_cache_size, concurrency=args.concurrency,
+                   host_concurrency=args.host_concurrency, host_delay=args.host_delay,
+                   cache_ttl=args.cache_ttl, cache_size=args.cache_size, job_workers=args.job_workers,
+                   job_backlog=args.job_backlog, profiler=get_profiler(args))
         return
 
-    data, tags = test.start()
+    profiler = get_profiler(args)
+    if profiler is not None:
+        profiler.start()
+    try:
+        data, tags = test.start()
+    finally:
+        if profiler is not None:
+            asyncio.get_event_loop().run_until_complete(profiler.stop())
+            print_profile(profiler)
+
+    def tabulated(result):
+        if not hasattr(result, 'tabulate'):
+            return result.as_dict()
+        elif args.timings:
+            return result.tabulate(timings=True)
+        return result.tabulate()
 
-    if args.format == 'table':
+    if args.format in (None, 'table'):
         print('###########')
         print('# RESULTS #')
         print('###########')
-        print(tabulate([
-            d.tabulate() if hasattr(d, 'tabulate') else d.as_dict()
-            for d in data
-        ], headers='keys'))
+        print(tabulate([tabulated(d) for d in data], headers='keys'))
 
         if tags:
             if data:  # we might not have any data to display, and a newline is ugly then
@@ -114,16 +346,34 @@ def test() -> None:
             print('########')
             print(tabulate([t.as_dict() for t in tags], headers='keys'))
 
+        if args.timings and histograms.histograms:
+            print('')
+            print('###########')
+            print('# Timings #')
+            print('###########')
+            print(tabulate(histograms.summary(), headers='keys'))
+
     elif args.format == 'csv':
-        data = [d.tabulate() if hasattr(d, 'tabulate') else d.as_dict() for d in data]
+        data = [tabulated(d) for d in data]
         if data:
             writer = csv.DictWriter(sys.stdout, delimiter=',', fieldnames=data[0].keys())
             writer.writeheader()
             for d in data:
                 writer.writerow(d)
 
+    elif args.format == 'columnar':
+        writer = columnar
+        for result in data:
+            writer.write_result(args.domain, result)
+        for t in tags:
+            writer.write_tag(args.domain, t)
+        writer.close()
+
     elif args.format == 'json':
-        print(json.dumps({
+        output = {
             'data': [d.json() for d in data],
             'tags': [t.as_dict() for t in tags],
-        }, indent=4))
+        }
+        if args.timings:
+            output['timings'] = histograms.as_dict()
+        print(json.dumps(output, indent=4))
@@ -11,33 +11,168 @@
 # You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import asyncio
+import collections
 import json
+import time
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
 
 from aiohttp import web
 
+from .certs import certificate_cache
 from .constants import Check
+from .dns import resolver
+from .jobs import JobQueue
+from .jobs import QueueFull
+from .metrics import Exposition
+from .metrics import LoopLagMonitor
+from .metrics import metrics
+from .profiling import Profiler
+from .scheduler import Scheduler
 from .tests.dns import DNSTest
 from .tests.socket import SocketTest
 from .tests.tls import TLSSupportedTest
 from .tests.xmpp import BasicConnectTest
 from .tests.xmpp import TLSCipherTest
 from .tests.xmpp import TLSVersionTest
+from .timings import histograms
+
+
+class ResultCache:
+    """An LRU cache for responses of the test API that also coalesces identical concurrent requests.
+
+    While a test is running, identical requests wait for the running test instead of starting a new one.
+    Finished responses are cached for `ttl` seconds.
+
+    Parameters
+    ----------
+
+    ttl : float, optional
+        How long to cache responses, in seconds. ``0`` disables caching, but requests are still coalesced.
+    max_size : int, optional
+        Maximum number of cached responses. The least recently used response is evicted first.
+    """
+
+    ttl: float
+    max_size: int
+
+    def __init__(self, ttl: float = 300, max_size: int = 256) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self._data: collections.OrderedDict = collections.OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get the cached response for `key`, or ``None`` if there is no valid entry."""
+
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, response: Any) -> None:
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + self.ttl, response)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def get_or_run(self, key: Hashable, run: Callable[[], Awaitable[Any]],
+                         refresh: bool = False) -> Any:
+        """Get the response for `key` from the cache or from a running test, or call `run` to create it.
+
+        If `refresh` is ``True``, the cache is bypassed, but a test that is already running is still joined,
+        since its result is fresh anyway.
+        """
+
+        if not refresh:
+            response = self.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+
+        future = self._pending.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._run(key, run))
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._run_done(key, f))
+        else:
+            self.hits += 1
+
+        # shield the shared test, so that one client going away does not cancel it for everybody else
+        return await asyncio.shield(future)
+
+    async def _run(self, key: Hashable, run: Callable[[], Awaitable[Any]]) -> Any:
+        response = await run()
+        self.set(key, response)
+        return response
+
+    def _run_done(self, key: Hashable, future: asyncio.Future) -> None:
+        self._pending.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # mark the exception as retrieved even if all clients went away
 
 
 class JsonApiView(web.View):
-    async def post(self):
+    async def get_request_data(self):
         request_data = await self.request.read()
-        request_data = json.loads(request_data.decode('utf-8'))
+        return json.loads(request_data.decode('utf-8'))
 
+    async def post(self):
+        request_data = await self.get_request_data()
         response_data = await self.handle(request_data)
         return web.json_response(response_data)
 
 
 class TestView(JsonApiView):
+    """Run a test and return all results and tags at once.
+
+    Responses are cached (see :py:class:`ResultCache`), add ``"refresh": true`` to the request to bypass the
+    cache.
+    """
+
     def get_check_type(self, raw_typ):
         return getattr(Check, raw_typ.strip().upper())
 
-    async def handle(self, request_data):
+    def get_cache_key(self, request_data: dict) -> tuple:
+        """Get the cache key of a request, containing all parameters that influence the result."""
+
+        app = self.request.app
+        options = {k: v for k, v in request_data.items()
+                   if k not in ('domain', 'typ', 'ipv4', 'ipv6', 'xmpps', 'refresh')}
+        return (
+            self.request.match_info['test'],
+            request_data['domain'].strip().lower(),
+            self.get_check_type(request_data.get('typ', 'client')),
+            bool(app['ipv4'] and request_data.get('ipv4', True)),
+            bool(app['ipv6'] and request_data.get('ipv6', True)),
+            bool(app['xmpps'] and request_data.get('xmpps', True)),
+            json.dumps(options, sort_keys=True),
+        )
+
+    def get_test(self, request_data):
         test_name = self.request.match_info['test']
         domain = request_data['domain']
         typ = self.get_check_type(request_data.get('typ', 'client'))
@@ -45,20 +180,28 @@ class TestView(JsonApiView):
         ipv4 = self.request.app['ipv4'] and request_data.get('ipv4', True)
         ipv6 = self.request.app['ipv6'] and request_data.get('ipv6', True)
         xmpps = self.request.app['xmpps'] and request_data.get('xmpps', True)
+        scheduler = self.request.app['scheduler']
+        happy_eyeballs = bool(request_data.get('happy_eyeballs', False))
+        reuse = bool(request_data.get('reuse', False))
 
         if test_name == 'dns':
-            test = DNSTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps)
+            return DNSTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps)
         elif test_name == 'socket':
-            test = SocketTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps)
+            return SocketTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps, scheduler=scheduler,
+                              happy_eyeballs=happy_eyeballs)
         elif test_name == 'basic':
-            test = BasicConnectTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps)
+            return BasicConnectTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps, scheduler=scheduler,
+                                    happy_eyeballs=happy_eyeballs)
         elif test_name == 'tls_version':
-            test = TLSVersionTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps)
+            return TLSVersionTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps, scheduler=scheduler,
+                                  reuse=reuse)
         elif test_name == 'tls_cipher':
-            test = TLSCipherTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps)
-        else:
-            print('Unknown test name: "%s".' % test_name)
+            return TLSCipherTest(domain, typ=typ, ipv4=ipv4, ipv6=ipv6, xmpps=xmpps, scheduler=scheduler,
+                                 enumerate_ciphers=bool(request_data.get('enumerate', False)), reuse=reuse)
+
+        raise web.HTTPNotFound(text='Unknown test name: "%s".' % test_name)
 
+    async def run_test(self, test) -> dict:
         data, tags = await test.aio_start()
 
         return {
@@ -66,6 +209,157 @@ class TestView(JsonApiView):
             'tags': [t.as_dict() for t in tags],
         }
 
+    async def handle(self, request_data):
+        test = self.get_test(request_data)  # raises 404 for unknown tests before anything is cached
+        cache = self.request.app['result_cache']
+        return await cache.get_or_run(self.get_cache_key(request_data), lambda: self.run_test(test),
+                                      refresh=bool(request_data.get('refresh', False)))
+
+
+class TestStreamView(TestView):
+    """Stream results and tags of a test as they become available.
+
+    Every result and tag is written as soon as it is available, either as newline-delimited JSON (the default)
+    or, if the client accepts ``text/event-stream``, as Server-Sent Events. Each NDJSON line is an object
+    with a ``type`` (``"result"`` or ``"tag"``) and the ``data`` of the result or tag, SSE uses the same
+    values as event name and data. If the client disconnects, all pending connections of the test are
+    cancelled.
+    """
+
+    async def write(self, response: web.StreamResponse, typ: str, data: dict, sse: bool) -> None:
+        if sse:
+            chunk = 'event: %s\ndata: %s\n\n' % (typ, json.dumps(data))
+        else:
+            chunk = '%s\n' % json.dumps({'type': typ, 'data': data})
+        await response.write(chunk.encode('utf-8'))
+
+    async def post(self):
+        request_data = await self.get_request_data()
+        test = self.get_test(request_data)
+        sse = 'text/event-stream' in self.request.headers.get('Accept', '')
+
+        response = web.StreamResponse()
+        response.content_type = 'text/event-stream' if sse else 'application/x-ndjson'
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # disable buffering in nginx
+        await response.prepare(self.request)
+
+        results = test.aio_iter()
+        try:
+            async for result, tags in results:
+                if result is not None:
+                    await self.write(response, 'result', result.json(), sse)
+                for tag in tags:
+                    await self.write(response, 'tag', tag.as_dict(), sse)
+        except ConnectionResetError:
+            return response  # client went away, pending connections are cancelled by aclose() below
+        finally:
+            await results.aclose()
+
+        await response.write_eof()
+        return response
+
+
+class JobCreateView(TestView):
+    """Start a test in the background and return the job, poll :py:class:`JobView` for the results.
+
+    Responds with ``429 Too Many Requests`` if too many jobs are waiting to be started.
+    """
+
+    async def post(self):
+        request_data = await self.get_request_data()
+        test = self.get_test(request_data)
+
+        try:
+            job = self.request.app['jobs'].submit(self.request.match_info['test'], test)
+        except QueueFull as e:
+            raise web.HTTPTooManyRequests(text=str(e))
+
+        location = self.request.app.router['job'].url_for(id=job.id)
+        return web.json_response(job.as_dict(), status=202, headers={'Location': str(location)})
+
+
+class JobView(web.View):
+    """Get the status and (partial) results of a job, or cancel it."""
+
+    def get_job(self):
+        job = self.request.app['jobs'].get(self.request.match_info['id'])
+        if job is None:
+            raise web.HTTPNotFound(text='Unknown job.')
+        return job
+
+    async def get(self):
+        return web.json_response(self.get_job().as_dict())
+
+    async def delete(self):
+        job = self.get_job()
+        self.request.app['jobs'].cancel(job)
+        return web.json_response(job.as_dict())
+
+
+class MetricsView(web.View):
+    """Expose metrics of this server in the Prometheus text format."""
+
+    async def get(self):
+        app = self.request.app
+        exposition = Exposition()
+        metrics.collect(exposition)
+
+        for phase, histogram in histograms.histograms.items():
+            exposition.histogram('phase_duration_seconds', 'Time spent in every phase of a test.', histogram,
+                                 {'phase': phase})
+
+        exposition.gauge('open_connections', 'Connections to XMPP targets that are currently open.',
+                         metrics.open_connections)
+        scheduler = app['scheduler']
+        exposition.gauge('scheduler_active', 'Connections holding a scheduler slot.', scheduler.active)
+        exposition.gauge('scheduler_waiting', 'Connections waiting for a scheduler slot.', scheduler.waiting)
+
+        dns_cache = resolver.cache
+        exposition.counter('dns_cache_hits_total', 'DNS queries answered from the cache.', dns_cache.hits)
+        exposition.counter('dns_cache_misses_total', 'DNS queries not answered from the cache.',
+                           dns_cache.misses)
+        exposition.gauge('dns_cache_entries', 'Answers in the DNS cache.', len(dns_cache))
+
+        exposition.counter('certificate_cache_hits_total', 'Certificate chains that were already parsed.',
+                           certificate_cache.hits)
+        exposition.counter('certificate_cache_misses_total', 'Certificate chains that had to be parsed.',
+                           certificate_cache.misses)
+        exposition.gauge('certificate_cache_entries', 'Parsed certificates in the cache.',
+                         len(certificate_cache))
+
+        result_cache = app['result_cache']
+        exposition.counter('result_cache_hits_total', 'Requests answered from the result cache or by joining '
+                           'a running test.', result_cache.hits)
+        exposition.counter('result_cache_misses_total', 'Requests that started a new test.',
+                           result_cache.misses)
+        exposition.gauge('result_cache_entries', 'Responses in the result cache.', len(result_cache))
+
+        jobs = app['jobs']
+        exposition.gauge('jobs_queued', 'Background jobs waiting for a worker.', jobs.queued)
+        exposition.gauge('jobs_running', 'Background jobs that are running.',
+                         sum(1 for j in jobs.jobs.values() if j.task is not None))
+
+        loop_lag = app['loop_lag']
+        exposition.gauge('event_loop_lag_seconds', 'Most recently measured event loop lag.', loop_lag.lag)
+        exposition.histogram('event_loop_lag_distribution_seconds', 'Measured event loop lag.',
+                             loop_lag.histogram)
+
+        profiler = app['profiler']
+        if profiler is not None:
+            slow = collections.defaultdict(lambda: [0, 0.0])
+            for (test, target), (count, total, maximum) in profiler.monitor.slow.items():
+                slow[test][0] += count
+                slow[test][1] += total
+            exposition.add('counter', 'slow_callbacks_total', 'Callbacks that blocked the event loop.', [
+                ('', {'test': test}, count) for test, (count, total) in sorted(slow.items())])
+            exposition.add('counter', 'slow_callbacks_seconds_total', 'Time slow callbacks blocked the event '
+                           'loop.', [('', {'test': t}, total) for t, (count, total) in sorted(slow.items())])
+
+        response = web.Response(text=exposition.render())
+        response.headers['Content-Type'] = Exposition.content_type
+        return response
+
 
 class InfoView(web.View):
     async def get(self):
@@ -77,14 +371,54 @@ class InfoView(web.View):
         return web.json_response([d.json() for d in data])
 
 
-def run_server(ipv4: bool = True, ipv6: bool = True, xmpps: bool = True,
-               host: str = '0.0.0.0', port: int = None) -> None:
+def create_app(ipv4: bool = True, ipv6: bool = True, xmpps: bool = True, concurrency: int = 64,
+               host_concurrency: int = 8, host_delay: float = 0, cache_ttl: float = 300,
+               cache_size: int = 256, job_workers: int = 4, job_backlog: int = 64,
+               profiler: Optional[Profiler] = None) -> web.Application:
     app = web.Application()
     app['ipv4'] = ipv4
     app['ipv6'] = ipv6
     app['xmpps'] = xmpps
+    app['scheduler'] = Scheduler(limit=concurrency, host_limit=host_concurrency, host_delay=host_delay)
+    app['result_cache'] = ResultCache(ttl=cache_ttl, max_size=cache_size)
+    app['jobs'] = JobQueue(workers=job_workers, backlog=job_backlog)
+    app['loop_lag'] = LoopLagMonitor()
+    app['profiler'] = profiler
+
+    async def start_background(app):
+        app['jobs'].start()
+        app['loop_lag'].start()
+        if app['profiler'] is not None:
+            app['profiler'].start()
+
+    async def stop_background(app):
+        await app['jobs'].stop()
+        await app['loop_lag'].stop()
+        if app['profiler'] is not None:
+            await app['profiler'].stop()  # writes the profile, if requested
+
+    app.on_startup.append(start_background)
+    app.on_cleanup.append(stop_background)
 
     app.add_routes([web.post('/test/{test}/', TestView)])
+    app.add_routes([web.post('/test/{test}/stream/', TestStreamView)])
+    app.add_routes([web.post('/test/{test}/jobs/', JobCreateView)])
+    app.add_routes([web.view('/jobs/{id}/', JobView, name='job')])
     app.add_routes([web.get('/info/{what}/', InfoView)])
+    app.add_routes([web.get('/metrics', MetricsView)])
+    return app
+
+
+def run_server(ipv4: bool = True, ipv6: bool = True, xmpps: bool = True,
+               host: str = '0.0.0.0', port: int = None, dns_cache_size: int = None,
+               concurrency: int = 64, host_concurrency: int = 8, host_delay: float = 0,
+               cache_ttl: float = 300, cache_size: int = 256, job_workers: int = 4,
+               job_backlog: int = 64, profiler: Optional[Profiler] = None) -> None:
+    if dns_cache_size is not None:
+        resolver.cache.max_size = dns_cache_size
 
+    app = create_app(ipv4=ipv4, ipv6=ipv6, xmpps=xmpps, concurrency=concurrency,
+                     host_concurrency=host_concurrency, host_delay=host_delay, cache_ttl=cache_ttl,
+                     cache_size=cache_size, job_workers=job_workers, job_backlog=job_backlog,
+                     profiler=profiler)
     web.run_app(app, host=host, port=port)
@@ -0,0 +1,209 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Spread a bulk scan over several processes, each running its own event loop."""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .base import ResultRecord
+from .base import Test
+from .bulk import BulkScan
+from .bulk import BulkWriter
+from .bulk import Checkpoint
+from .bulk import Domains
+from .bulk import _ERROR
+from .bulk import _RESULT
+from .scheduler import Scheduler
+from .timings import PhaseHistograms
+from .timings import histograms
+
+
+def scan_shard(get_test: Callable[..., Test], domains: List[str], concurrency: int,
+               scheduler_options: dict) -> Tuple[List[Tuple], PhaseHistograms]:
+    """Test a shard of domains in a new event loop, called in a worker process.
+
+    Returns all items and the timing histograms of this shard.
+    """
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    histograms.clear()  # the worker may have tested other shards before
+    try:
+        scheduler = Scheduler(**scheduler_options)  # shared by all tests of this shard
+        scan = BulkScan(lambda domain: get_test(domain, scheduler=scheduler), concurrency=concurrency)
+
+        async def collect():
+            items = []
+            async for kind, domain, result, tags in scan.iter(domains):
+                if kind == _RESULT and result is not None:
+                    result = ResultRecord.from_result(result)
+                items.append((kind, domain, result, tags))
+            return items
+
+        return loop.run_until_complete(collect()), histograms
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class _Shard:
+    def __init__(self, domains: List[str]) -> None:
+        self.domains = domains
+        self.attempts = 0
+        self.future: Optional[asyncio.Future] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.items: Optional[List[Tuple]] = None
+
+
+class ShardedScan(BulkScan):
+    """Run a bulk scan in several worker processes.
+
+    Domains are split into shards of `shard_size` domains, and every shard is tested in one of `processes`
+    worker processes, each with its own event loop. Results of a shard are written once the whole shard is
+    done, and shards are written in the order of the input, so the output does not depend on which worker
+    finished first.
+
+    If a worker process crashes, all shards that were running in the pool are retried in a new pool up to
+    `retries` times. If a shard still fails, an error is written for each of its domains.
+
+    Parameters
+    ----------
+
+    get_test : callable
+        A picklable function that receives a domain and a ``scheduler`` keyword argument and returns the test
+        to run for that domain. Every worker creates one scheduler for each shard.
+    concurrency : int, optional
+        Maximum number of domains tested concurrently in each worker.
+    checkpoint : Checkpoint, optional
+        Domains in the checkpoint are skipped, and domains are added to it once they are completely tested.
+    processes : int, optional
+        Number of worker processes.
+    shard_size : int, optional
+        Number of domains in a shard.
+    retries : int, optional
+        How often a shard is retried after a worker crashed.
+    scheduler_options : dict, optional
+        Keyword arguments for the :py:class:`~xmpp_test.scheduler.Scheduler` of every shard. Note that
+        connection limits therefore apply per shard and not globally.
+    """
+
+    processes: int
+    shard_size: int
+    retries: int
+    scheduler_options: dict
+
+    def __init__(self, get_test: Callable[..., Test], concurrency: int = 16,
+                 checkpoint: Optional[Checkpoint] = None, processes: int = 2, shard_size: int = 32,
+                 retries: int = 2, scheduler_options: Optional[dict] = None) -> None:
+        super().__init__(get_test, concurrency=concurrency, checkpoint=checkpoint)
+        if processes < 1 or shard_size < 1:
+            raise ValueError("Number of processes and shard size must be at least 1.")
+
+        self.processes = processes
+        self.shard_size = shard_size
+        self.retries = retries
+        self.scheduler_options = scheduler_options or {}
+
+    async def shards(self, domains: Domains) -> AsyncIterator[_Shard]:
+        shard: List[str] = []
+        async for domain in self.filter_domains(domains):
+            shard.append(domain)
+            if len(shard) == self.shard_size:
+                yield _Shard(shard)
+                shard = []
+        if shard:
+            yield _Shard(shard)
+
+    def submit(self, executor: ProcessPoolExecutor, shard: _Shard) -> None:
+        loop = asyncio.get_event_loop()
+        shard.attempts += 1
+        shard.executor = executor
+        shard.future = loop.run_in_executor(executor, scan_shard, self.get_test, shard.domains,
+                                            self.concurrency, self.scheduler_options)
+
+    async def run(self, domains: Domains, writer: BulkWriter) -> Tuple[int, int]:
+        shards = self.shards(domains)
+        queued: Dict[int, _Shard] = {}  # shards that are running or wait to be written, by position
+        next_index = 0  # position of the next shard to submit
+        write_index = 0  # position of the next shard to write
+        exhausted = False
+
+        executor = ProcessPoolExecutor(self.processes)
+        try:
+            while True:
+                # Keep a few shards per process running, so that workers never wait for the parent. Finished
+                # shards are kept until all shards before them are written, but only up to a limit.
+                while not exhausted and len(queued) < self.processes * 8 and \
+                        sum(1 for s in queued.values() if s.items is None) < self.processes * 2:
+                    try:
+                        shard = await shards.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    self.submit(executor, shard)
+                    queued[next_index] = shard
+                    next_index += 1
+
+                # write all finished shards that are next in line
+                while write_index in queued and queued[write_index].items is not None:
+                    for item in queued.pop(write_index).items:
+                        self.handle(item, writer)
+                    write_index += 1
+
+                running = [s.future for s in queued.values() if s.items is None]
+                if not running:
+                    if exhausted:
+                        break
+                    continue
+
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                broken = False
+                for shard in queued.values():
+                    if shard.items is not None or not shard.future.done():
+                        continue
+
+                    try:
+                        shard.items, shard_histograms = shard.future.result()
+                        histograms.merge(shard_histograms)
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool) and shard.executor is executor:
+                            broken = True
+                        if shard.attempts > self.retries:
+                            error = 'Worker failed: %s' % (str(e) or type(e).__name__)
+                            shard.items = [(_ERROR, d, error, []) for d in shard.domains]
+                        else:
+                            shard.future = None
+
+                if broken:  # a crashed worker breaks the whole pool, so start a new one
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(self.processes)
+
+                for shard in queued.values():
+                    if shard.items is None and shard.future is None:
+                        self.submit(executor, shard)
+        finally:
+            for shard in queued.values():
+                if shard.future is not None:
+                    shard.future.cancel()
+            executor.shutdown(wait=False)
+
+        return self.tested, self.failed
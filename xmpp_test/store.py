@@ -0,0 +1,152 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Persist test results in an SQLite database."""
+
+import collections
+import enum
+import json
+import sqlite3
+import time
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .base import ResultRecord
+from .base import TestResult
+from .base import XMPPTarget
+from .tags import Tag
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    test TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    results TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (test, domain, source, target, ip, port, params)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    test TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (test, domain)
+);
+'''
+
+
+def _encode_param(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    return str(value)
+
+
+def encode_params(params: dict) -> str:
+    """Encode test parameters to a string that can be used as key.
+
+    >>> from .types import TLS_VERSION
+    >>> encode_params({'tls_version': TLS_VERSION.TLSv1_2, 'cipher': 'AES128-SHA'})
+    '{"cipher": "AES128-SHA", "tls_version": "TLSv1_2"}'
+    """
+    return json.dumps(params, sort_keys=True, default=_encode_param)
+
+
+class ResultStore:
+    """Store results of tests in an SQLite database.
+
+    Results are stored per test, domain, SRV record, IP address, port and test parameters (e.g. the TLS
+    version), so the results of a target are replaced whenever it is tested again. A result whose DNS records
+    changed (e.g. a new IP address) is stored under a new key, so stored results never apply to a changed
+    target.
+
+    Results are committed at most every `commit_interval` seconds, tags (which are stored once a test is
+    done) and closing the store always commit. The database uses write-ahead logging, so several processes
+    can use the same file.
+
+    Parameters
+    ----------
+
+    path : str
+        Path to the database, it is created if it does not exist.
+    commit_interval : float, optional
+        Maximum number of seconds between two commits.
+    """
+
+    path: str
+    commit_interval: float
+
+    def __init__(self, path: str, commit_interval: float = 1.0) -> None:
+        self.path = path
+        self.commit_interval = commit_interval
+
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        self._last_commit = time.monotonic()
+
+    def _key(self, test: str, target: XMPPTarget, params: dict) -> Tuple:
+        srv = target.srv
+        return (test, srv.domain, srv.source, srv.target, str(target.ip), srv.port, encode_params(params))
+
+    def _written(self) -> None:
+        if time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def get(self, test: str, target: XMPPTarget, params: dict,
+            max_age: Optional[float] = None) -> Optional[List[ResultRecord]]:
+        """Get stored results for `target`, or ``None`` if there are none or they are older than `max_age`."""
+
+        row = self._connection.execute(
+            'SELECT results, timestamp FROM results WHERE test = ? AND domain = ? AND source = ? '
+            'AND target = ? AND ip = ? AND port = ? AND params = ?', self._key(test, target, params)
+        ).fetchone()
+        if row is None:
+            return None
+
+        results, timestamp = row
+        if max_age is not None and timestamp < time.time() - max_age:
+            return None
+        return [ResultRecord(r['json'], r['tabulate'], timestamp=timestamp, target=target)
+                for r in json.loads(results, object_pairs_hook=collections.OrderedDict)]
+
+    def put(self, test: str, target: XMPPTarget, params: dict, results: Iterable[TestResult]) -> None:
+        """Store `results` of testing `target` with the given parameters, replacing any previous results."""
+
+        records = [ResultRecord.from_result(r) for r in results]
+        data = json.dumps([{'json': r.json(), 'tabulate': r.tabulate()} for r in records])
+        self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 self._key(test, target, params) + (data, time.time()))
+        self._written()
+
+    def put_tags(self, test: str, domain: str, tags: Iterable[Tag]) -> None:
+        """Store the tags raised while testing `domain`, replacing any previously stored tags."""
+
+        data = json.dumps([t.as_dict() for t in tags])
+        self._connection.execute('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)',
+                                 (test, domain, data, time.time()))
+        self.commit()
+
+    def commit(self) -> None:
+        self._connection.commit()
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        self.commit()
+        self._connection.close()
@@ -12,8 +12,9 @@
 # <http://www.gnu.org/licenses/>.
 
 import collections
-import threading
 import typing
+from contextvars import ContextVar
+from contextvars import Token
 
 from .constants import TAG_TYPE
 
@@ -33,16 +34,40 @@ class Tag(typing.NamedTuple):
         ])
 
 
+# Tags raised in the current context, see Tagger.collect()
+_collection: ContextVar[typing.Optional[typing.Deque[Tag]]] = ContextVar('tags', default=None)
+
+
 class Tagger:
-    data: threading.local = threading.local()
+    """Collect tags raised while running a test.
+
+    Tags are collected per :py:mod:`contextvars` context: :py:meth:`collect` starts a new collection in the
+    current context, and all tasks started from that context afterwards add their tags to the same
+    collection. Tests running concurrently in one event loop (or in different threads) thus never see each
+    other's tags. Tags raised outside of a collection are added to a fallback collection shared by the whole
+    process.
+    """
 
     def __init__(self) -> None:
-        self.data.tags = collections.deque()
-        self.data.lock = threading.Lock()
+        self._fallback: typing.Deque[Tag] = collections.deque()
+
+    def collect(self) -> Token:
+        """Start a new collection in the current context, returns a token for :py:meth:`reset`."""
+        return _collection.set(collections.deque())
+
+    def reset(self, token: Token) -> None:
+        """Restore the collection that was active before :py:meth:`collect` returned `token`."""
+        _collection.reset(token)
+
+    @property
+    def tags(self) -> typing.Deque[Tag]:
+        tags = _collection.get()
+        if tags is None:
+            return self._fallback
+        return tags
 
     def append(self, tag: Tag) -> None:
-        with self.data.lock:
-            self.data.tags.append(tag)
+        self.tags.append(tag)
 
     def debug(self, id: int, message: str, group: str) -> Tag:
         t = Tag(id, TAG_TYPE.DEBUG, message, group)
@@ -64,11 +89,9 @@ class Tagger:
         self.append(t)
         return t
 
-    def pop_all(self):
-        with self.data.lock:
-            tags = list(self.data.tags)
-            self.data.tags.clear()
-        return tags
+    def pop_all(self) -> typing.List[Tag]:
+        tags = self.tags
+        return [tags.popleft() for i in range(len(tags))]
 
 
 tag = Tagger()
@@ -17,9 +17,12 @@ from ..base import Test
 from ..base import TestResult
 from ..base import XMPPTarget
 from ..constants import Check
+from ..timings import format_timings
 
 
 class DNSTestResult(TestResult):
+    __slots__ = ()
+
     def __init__(self, target: XMPPTarget, success: bool = True) -> None:
         super().__init__(target, success)
 
@@ -28,15 +31,25 @@ class DNSTestResult(TestResult):
         d.pop('success')
         return d
 
-    def tabulate(self) -> dict:
-        return self.as_dict()
+    def tabulate(self, timings: bool = False) -> dict:
+        d = self.as_dict()
+        if timings:
+            d['timings'] = format_timings(self.timings.as_dict())
+        return d
 
 
 class DNSTest(Test):
-    async def run(self, domain: str, typ: Check = Check.CLIENT,
-                  ipv4: bool = True, ipv6: bool = True, xmpps: bool = True) -> tuple:
+    async def iter(self, domain: str, typ: Check = Check.CLIENT,
+                   ipv4: bool = True, ipv6: bool = True, xmpps: bool = True):
 
-        records = []
         async for target in XMPPTarget.from_domain(domain, typ, ipv4, ipv6, xmpps):
-            records.append(DNSTestResult(target))
-        return records
+            result = DNSTestResult(target)
+            if self.store is not None:
+                self.store.put(self.__class__.__name__, target, {}, [result])
+            yield result
+
+    async def run(self, *args, **kwargs) -> list:
+        return [r async for r in self.iter(*args, **kwargs)]
+
+    def sort_key(self, result: DNSTestResult) -> tuple:
+        return result.target.sort_key
@@ -12,21 +12,72 @@
 # <http://www.gnu.org/licenses/>.
 
 import asyncio
-import socket
 import ipaddress
+import socket
+import time
+from typing import List
+from typing import Optional
 
 from ..base import TestResult
 from ..base import XMPPTarget
 from ..base import XMPPTargetTest
+from ..happy_eyeballs import open_socket
+from ..happy_eyeballs import race
+from ..happy_eyeballs import sort_targets
+from ..metrics import metrics
+from ..probe import classify_error
+from ..timings import Timings
+from ..timings import histograms
 
 
 class SocketTestResult(TestResult):
     """A test result for a socket test."""
 
-    pass
+    __slots__ = ()
+
+
+class SocketRaceTestResult(SocketTestResult):
+    """A test result for a socket test in Happy Eyeballs mode.
+
+    ``target`` is the target that won the race, ``connect_time`` the time until the connection was
+    established.
+    """
+
+    __slots__ = ('connect_time', )
+
+    connect_time: Optional[float]
+
+    def __init__(self, target: XMPPTarget, success: bool, connect_time: Optional[float],
+                 timings: Optional[Timings] = None) -> None:
+        super().__init__(target, success, timings=timings)
+        self.connect_time = connect_time
+
+    def as_dict(self) -> dict:
+        d = super().as_dict()
+        d['connect_time'] = None if self.connect_time is None else round(self.connect_time * 1000, 1)
+        return d
 
 
 class SocketTest(XMPPTargetTest):
+    supports_happy_eyeballs = True
+
+    async def race_test(self, targets: List[XMPPTarget]) -> SocketRaceTestResult:
+        async def connect(target: XMPPTarget) -> socket.socket:
+            async with self.scheduler.slot(str(target.ip)):
+                return await open_socket(target, timeout=2)
+
+        start = time.monotonic()
+        winner, sock, connect_time = await race(targets, connect)
+        if winner is None:
+            return SocketRaceTestResult(sort_targets(targets)[0], False, None)
+
+        sock.close()
+        timings = winner.timings.copy()
+        timings.mark('start', start)
+        timings.mark('connect', start + connect_time)
+        histograms.observe_timings(timings, ['connect'])
+        return SocketRaceTestResult(winner, True, connect_time, timings=timings)
+
     async def target_test(self, target: XMPPTarget) -> SocketTestResult:
         ip = str(target.ip)
         port = target.srv.port
@@ -43,11 +94,18 @@ class SocketTest(XMPPTargetTest):
         s.setblocking(False)  # Required for async operations
 
         loop = asyncio.get_event_loop()
+        timings = target.timings.copy()
+        timings.mark('start')
         try:
             # Use async timeout handling
-            await asyncio.wait_for(loop.sock_connect(s, (ip, port)), timeout=2)
-            return SocketTestResult(target, True)
-        except (OSError, asyncio.TimeoutError):
-            return SocketTestResult(target, False)
+            with metrics.connection():
+                await asyncio.wait_for(loop.sock_connect(s, (ip, port)), timeout=2)
+            timings.mark('connect')
+            histograms.observe_timings(timings, ['connect'])
+            metrics.probe_done('success')
+            return SocketTestResult(target, True, timings=timings)
+        except (OSError, asyncio.TimeoutError) as e:
+            metrics.probe_done(classify_error(e))
+            return SocketTestResult(target, False, timings=timings)
         finally:
             s.close()  # Ensure socket is closed
@@ -11,34 +11,91 @@
 # You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import asyncio
+import collections
+import socket
 import ssl
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
 
 from ..base import TestResult
 from ..base import XMPPTarget
 from ..base import XMPPTargetTest
-from ..clients import BasicConnectClient
-from ..clients import TLSTestClient
+from ..certs import CertificateChain
+from ..certs import format_certificate
+from ..constants import SRV_TYPE
+from ..happy_eyeballs import open_socket
+from ..happy_eyeballs import race
+from ..happy_eyeballs import sort_targets
+from ..probe import CLIENT_NS
+from ..probe import SERVER_NS
+from ..probe import StreamProbe
+from ..timings import Timings
 from ..tls import get_protocol_ciphers
+from ..tls import get_session_context
 from ..tls import get_supported_protocols
+from ..tls import session_cache
 from ..types import TLS_VERSION
 from ..types import STARTTLS
+from ..types import Timeouts
+
+
+def get_probe(target: XMPPTarget, ssl_context: Optional[ssl.SSLContext] = None,
+              timeouts: Timeouts = Timeouts(), timings: Optional[Timings] = None, **kwargs) -> StreamProbe:
+    """Get a :py:class:`~xmpp_test.probe.StreamProbe` for the given target.
+
+    The probe adds its phases to `timings`, or to a copy of the timings of `target` if not given. Any other
+    keyword arguments are passed to the probe.
+    """
+
+    if target.srv.service in (SRV_TYPE.XMPP_SERVER.value, SRV_TYPE.XMPPS_SERVER.value):
+        default_ns = SERVER_NS
+    else:
+        default_ns = CLIENT_NS
+    if timings is None:
+        timings = target.timings.copy()
+    return StreamProbe(target.srv.domain, ssl_context=ssl_context, use_ssl=target.is_xmpps,
+                       default_ns=default_ns, timeouts=timeouts, timings=timings, **kwargs)
 
 
 class BasicConnectTestResult(TestResult):
+    """Result of a connection test.
+
+    ``error`` describes why the test failed (e.g. ``"timeout"``), it is ``None`` if the test succeeded.
+    ``certificate`` is the certificate chain of the server, if a TLS handshake was completed.
+    """
+
+    __slots__ = ('starttls_required', 'error', 'certificate')
+
     starttls_required: STARTTLS
+    error: Optional[str]
+    certificate: Optional[CertificateChain]
 
-    def __init__(self, target: XMPPTarget, success: bool, starttls_required: STARTTLS) -> None:
-        super().__init__(target, success)
+    def __init__(self, target: XMPPTarget, success: bool, starttls_required: STARTTLS,
+                 error: Optional[str] = None, timings: Optional[Timings] = None,
+                 certificate: Optional[CertificateChain] = None) -> None:
+        super().__init__(target, success, timings=timings)
         self.starttls_required = starttls_required
+        self.error = error
+        self.certificate = certificate
 
     def as_dict(self) -> dict:
         d = super().as_dict()
         d['starttls'] = self.starttls_required
+        d['error'] = self.error
+        if self.certificate is None:
+            d['certificate'] = None
+        else:
+            d['certificate'] = self.certificate.as_dict(self.target.srv.domain, self.target.srv.service)
         return d
 
-    def tabulate(self) -> dict:
-        d = super().tabulate()
+    def tabulate(self, timings: bool = False) -> dict:
+        d = super().tabulate(timings=timings)
         d['starttls'] = d['starttls'].name
+        d['certificate'] = format_certificate(d['certificate'])
         return d
 
     def json(self) -> dict:
@@ -47,62 +104,209 @@ class BasicConnectTestResult(TestResult):
         return d
 
 
+class BasicConnectRaceTestResult(BasicConnectTestResult):
+    """Result of a connection test in Happy Eyeballs mode.
+
+    ``target`` is the target that won the race, ``connect_time`` the time until the TCP connection was
+    established.
+    """
+
+    __slots__ = ('connect_time', )
+
+    connect_time: Optional[float]
+
+    def __init__(self, *args, connect_time: Optional[float], **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.connect_time = connect_time
+
+    def as_dict(self) -> dict:
+        d = super().as_dict()
+        d['connect_time'] = None if self.connect_time is None else round(self.connect_time * 1000, 1)
+        return d
+
+
 class BasicConnectTest(XMPPTargetTest):
-    async def target_test(self, target: XMPPTarget) -> BasicConnectTestResult:
-        ip = str(target.ip)
-        port = target.srv.port
+    supports_happy_eyeballs = True
+
+    async def race_test(self, targets: List[XMPPTarget]) -> BasicConnectRaceTestResult:
+        async def connect(target: XMPPTarget) -> socket.socket:
+            async with self.scheduler.slot(str(target.ip)):
+                return await open_socket(target, timeout=self.timeouts.connect)
 
-        kwargs = {
-            'use_ssl': target.is_xmpps,
-        }
-        client = BasicConnectClient(target.srv.domain, ip, port)
-        client.connect(ip, port, **kwargs)
-        await client.process(forever=False, timeout=10)
+        start = time.monotonic()
+        winner, sock, connect_time = await race(targets, connect)
+        if winner is None:
+            return BasicConnectRaceTestResult(sort_targets(targets)[0], False, STARTTLS.unknown,
+                                              error='connection failed', connect_time=None)
 
-        return BasicConnectTestResult(target, client._test_success, client.starttls_required)
+        timings = winner.timings.copy()
+        timings.mark('start', start)
+        timings.mark('connect', start + connect_time)
+        probe = get_probe(winner, timeouts=self.timeouts, timings=timings)
+        async with self.scheduler.slot(str(winner.ip)):
+            await probe.run(str(winner.ip), winner.srv.port, sock=sock)
+
+        return BasicConnectRaceTestResult(winner, probe.success, probe.starttls_required, error=probe.error,
+                                          connect_time=connect_time, timings=probe.timings,
+                                          certificate=probe.certificate)
+
+    async def target_test(self, target: XMPPTarget) -> BasicConnectTestResult:
+        probe = get_probe(target, timeouts=self.timeouts)
+        await probe.run(str(target.ip), target.srv.port)
+
+        return BasicConnectTestResult(target, probe.success, probe.starttls_required, error=probe.error,
+                                      timings=probe.timings, certificate=probe.certificate)
 
 
 class TLSVersionTestResult(BasicConnectTestResult):
-    context: ssl.SSLContext
+    """Result of a TLS version test.
+
+    ``resumed`` tells if a TLS session from a previous connection was resumed, it is ``None`` if no session
+    was offered (see ``reuse`` in :py:class:`TLSTargetTest`).
+
+    The result does not keep the ``SSLContext`` used for the test, the TLS version (and cipher) identify it.
+    """
+
+    __slots__ = ('tls_version', 'resumed')
+
     tls_version: TLS_VERSION
+    resumed: Optional[bool]
 
-    def __init__(self, target: XMPPTarget, success: bool,
-                 starttls_required: STARTTLS, context: ssl.SSLContext, tls_version: TLS_VERSION) -> None:
-        super().__init__(target, success, starttls_required=starttls_required)
-        self.context = context
+    def __init__(self, target: XMPPTarget, success: bool, starttls_required: STARTTLS,
+                 tls_version: TLS_VERSION, error: Optional[str] = None,
+                 timings: Optional[Timings] = None, resumed: Optional[bool] = None,
+                 certificate: Optional[CertificateChain] = None) -> None:
+        super().__init__(target, success, starttls_required=starttls_required, error=error, timings=timings,
+                         certificate=certificate)
         self.tls_version = tls_version
+        self.resumed = resumed
 
     def as_dict(self) -> dict:
         d = super().as_dict()
         d['protocol'] = self.tls_version.name
+        d['resumed'] = self.resumed
         return d
 
 
-class TLSVersionTest(XMPPTargetTest):
+class TLSTargetTest(XMPPTargetTest):
+    """Base class for tests that make TLS handshakes with different parameters.
+
+    With ``reuse=True``, connections are made cheaper for both sides:
+
+    * One :py:class:`~xmpp_test.tls.SessionContext` is shared for every TLS version and cipher string, and
+      the TLS session of every target is cached (see :py:data:`~xmpp_test.tls.session_cache`) and offered
+      again the next time the target is tested with the same parameters.
+    * For STARTTLS targets, the stream features are fetched only once per target. If the server offers
+      STARTTLS, later probes send the STARTTLS request without waiting for the stream features. If it does
+      not, no TLS handshake is attempted at all.
+
+    Parameters
+    ----------
+
+    reuse : bool, optional
+        Reuse contexts, sessions and stream features as described above.
+    """
+
+    reuse: bool
+
+    def __init__(self, *args, reuse: bool = False, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.reuse = reuse
+        self._features: Dict[Tuple[str, int, str], asyncio.Future] = {}
+
+    async def features_probe(self, target: XMPPTarget) -> StreamProbe:
+        probe = get_probe(target, timeouts=self.timeouts, negotiate_tls=False)
+        async with self.scheduler.slot(str(target.ip)):
+            await probe.run(str(target.ip), target.srv.port)
+        return probe
+
+    async def get_features(self, target: XMPPTarget) -> StreamProbe:
+        """Get a probe that fetched the stream features of `target`, fetched only once per target."""
+
+        key = (str(target.ip), target.srv.port, target.srv.service)
+        future = self._features.get(key)
+        if future is None:
+            future = self._features[key] = asyncio.ensure_future(self.features_probe(target))
+
+        # shield the shared probe, so that one probe being cancelled does not cancel it for all others
+        return await asyncio.shield(future)
+
+    async def probe(self, target: XMPPTarget, **kwargs):
+        if self.reuse and not target.is_xmpps:
+            # fetched outside of the scheduler slot, the features probe needs a slot of its own
+            kwargs['features'] = await self.get_features(target)
+        return await super().probe(target, **kwargs)
+
+    async def tls_probe(self, target: XMPPTarget, tls_version: TLS_VERSION, cipher: Optional[str] = None,
+                        features: Optional[StreamProbe] = None, cache_context: bool = True
+                        ) -> Tuple[StreamProbe, STARTTLS]:
+        """Make a TLS handshake with the given TLS version and cipher string.
+
+        `features` is the probe returned by :py:meth:`get_features` in reuse mode. If it shows that the server
+        does not offer STARTTLS, no connection is made and the returned probe is not successful.
+
+        If `cache_context` is ``False``, the context is not cached (see
+        :py:meth:`~xmpp_test.types.TLS_VERSION.get_context`) and, since sessions can only be resumed with the
+        same context, no session is offered or cached.
+
+        Returns the probe and the STARTTLS support of the server. In reuse mode, STARTTLS
+        support is known from `features` even if the TLS handshake fails.
+        """
+
+        if not self.reuse:
+            context = TLS_VERSION.get_context(tls_version, cipher, cache=cache_context)
+            probe = get_probe(target, context, timeouts=self.timeouts)
+            await probe.run(str(target.ip), target.srv.port)
+            return probe, probe.starttls_required
+
+        context = get_session_context(tls_version, cipher, cache=cache_context)
+        session_key = (str(target.ip), target.srv.port, target.srv.domain, context)
+        session = session_cache.get(session_key) if cache_context else None
+        pipeline = features is not None and features.success and features.starttls is not None
+        probe = get_probe(target, context, timeouts=self.timeouts, session=session, pipeline=pipeline)
+        starttls_required = features.starttls_required if features is not None and features.success else None
+
+        if starttls_required == STARTTLS.no:
+            probe.error = 'STARTTLS not offered'
+            return probe, starttls_required
+
+        await probe.run(str(target.ip), target.srv.port)
+        if cache_context and probe.success and probe.session is not None:
+            session_cache.set(session_key, probe.session)
+        return probe, starttls_required or probe.starttls_required
+
+
+class TLSVersionTest(TLSTargetTest):
     async def get_tests(self, domain, target, exclude=None):
         for tls_version in get_supported_protocols(exclude=exclude):
             yield {'tls_version': tls_version}
 
-    async def target_test(self, target: XMPPTarget, tls_version: TLS_VERSION) -> TLSVersionTestResult:
-        ip = str(target.ip)
-        port = target.srv.port
-
-        kwargs = {
-            'use_ssl': target.is_xmpps,
-        }
-        context = TLS_VERSION.get_context(tls_version)
-        client = TLSTestClient(context, target.srv.domain, ip, port)
-        client.connect(ip, port, **kwargs)
-        await client.process(forever=False, timeout=10)
+    async def target_test(self, target: XMPPTarget, tls_version: TLS_VERSION,
+                          features: Optional[StreamProbe] = None) -> TLSVersionTestResult:
+        probe, starttls_required = await self.tls_probe(target, tls_version, features=features)
 
-        return TLSVersionTestResult(target, client._test_success, context=context, tls_version=tls_version,
-                                    starttls_required=client.starttls_required)
+        return TLSVersionTestResult(target, probe.success, tls_version=tls_version,
+                                    starttls_required=starttls_required, error=probe.error,
+                                    timings=probe.timings, resumed=probe.session_reused,
+                                    certificate=probe.certificate)
 
 
 class TLSCipherTestResult(TLSVersionTestResult):
-    def __init__(self, *args, cipher: str, **kwargs):
+    """Result of a cipher test.
+
+    ``cipher`` is the cipher that was offered, ``negotiated_cipher`` the cipher that the server picked (or
+    ``None`` if the handshake failed).
+    """
+
+    __slots__ = ('cipher', 'negotiated_cipher')
+
+    cipher: Optional[str]
+    negotiated_cipher: Optional[str]
+
+    def __init__(self, *args, cipher: Optional[str], negotiated_cipher: Optional[str] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.cipher = cipher
+        self.negotiated_cipher = negotiated_cipher
 
     def as_dict(self) -> dict:
         d = super().as_dict()
@@ -110,27 +314,112 @@ class TLSCipherTestResult(TLSVersionTestResult):
         return d
 
 
-class TLSCipherTest(XMPPTargetTest):
-    async def get_tests(self, domain, target):
+class TLSCipherEnumerationResult(TLSCipherTestResult):
+    """Result of a cipher test in enumeration mode.
+
+    ``preference`` is the position of the cipher in the order in which the server picked ciphers (starting
+    with ``1``), or ``None`` if the server did not accept the cipher.
+    """
+
+    __slots__ = ('preference', )
+
+    preference: Optional[int]
+
+    def __init__(self, *args, preference: Optional[int], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preference = preference
+
+    def as_dict(self) -> dict:
+        d = super().as_dict()
+        d['preference'] = self.preference
+        return d
+
+
+class TLSCipherTest(TLSTargetTest):
+    """Test which ciphers are supported by a server.
+
+    By default, one handshake is made for every known cipher. With ``enumerate_ciphers=True``, the test
+    instead offers all remaining ciphers of a TLS version at once, removes the cipher that the server picked
+    and repeats until the handshake fails. This needs only one handshake per cipher the server accepts (plus
+    one) and reveals the order in which the server picks ciphers as a by-product. The error of the failed
+    handshake is reported for all remaining ciphers, so a connection error or timeout can be told apart from
+    ciphers that the server rejected.
+
+    Ciphers for TLSv1.3 cannot be restricted with the ``ssl`` module, so for TLSv1.3 only the cipher that the
+    server picks is reported, in both modes.
+    """
+
+    async def get_tests(self, domain, target, enumerate_ciphers=False):
+        if enumerate_ciphers is False:
+            tested_tls13 = False
+            async for tls_version, cipher in get_protocol_ciphers():
+                if tls_version != TLS_VERSION.TLSv1_3:
+                    yield {'tls_version': tls_version, 'cipher': cipher}
+                elif tested_tls13 is False:  # see class docstring
+                    tested_tls13 = True
+                    yield {'tls_version': tls_version}
+            return
+
+        protocol_ciphers = collections.OrderedDict()
         async for tls_version, cipher in get_protocol_ciphers():
-            yield {'tls_version': tls_version, 'cipher': cipher}
+            protocol_ciphers.setdefault(tls_version, []).append(cipher)
 
-    async def target_test(self, target: XMPPTarget, tls_version: TLS_VERSION,
-                          cipher: str) -> TLSVersionTestResult:
-        ip = str(target.ip)
-        port = target.srv.port
+        for tls_version, ciphers in protocol_ciphers.items():
+            yield {'tls_version': tls_version, 'ciphers': ciphers}
+
+    async def target_iter(self, target: XMPPTarget, tls_version: TLS_VERSION, cipher: Optional[str] = None,
+                          ciphers: Optional[List[str]] = None):
+        if ciphers is None:
+            yield await self.probe(target, tls_version=tls_version, cipher=cipher)
+            return
+
+        if tls_version == TLS_VERSION.TLSv1_3:
+            result = await self.probe(target, tls_version=tls_version)
+            yield self.enumeration_result(result, result.negotiated_cipher, 1 if result.success else None)
+            return
+
+        remaining = list(ciphers)
+        preference = 0
+        result = None
+        while remaining:
+            # Only the first cipher string (all ciphers) is the same for every server, the contexts for the
+            # others are not cached so that they do not evict contexts that are used again.
+            result = await self.probe(target, tls_version=tls_version, cipher=':'.join(remaining),
+                                      cache_context=len(remaining) == len(ciphers))
+            if not result.success or result.negotiated_cipher not in remaining:
+                break
+
+            preference += 1
+            remaining.remove(result.negotiated_cipher)
+            yield self.enumeration_result(result, result.negotiated_cipher, preference)
+
+        # The server did not accept any of the remaining ciphers, or the connection failed (see the error)
+        starttls_required = STARTTLS.unknown if result is None else result.starttls_required
+        error = None if result is None else result.error
+        for cipher in remaining:
+            yield TLSCipherEnumerationResult(
+                target, False, tls_version=tls_version, cipher=cipher,
+                starttls_required=starttls_required, error=error, preference=None)
 
-        kwargs = {
-            'use_ssl': target.is_xmpps,
-        }
+    def enumeration_result(self, result: TLSCipherTestResult, cipher: Optional[str],
+                           preference: Optional[int]) -> TLSCipherEnumerationResult:
+        return TLSCipherEnumerationResult(
+            result.target, result.success, tls_version=result.tls_version,
+            cipher=cipher, negotiated_cipher=result.negotiated_cipher,
+            starttls_required=result.starttls_required, error=result.error, preference=preference,
+            timings=result.timings, resumed=result.resumed, certificate=result.certificate)
 
-        context = TLS_VERSION.get_context(tls_version)
-        context.set_ciphers(cipher)
+    async def target_test(self, target: XMPPTarget, tls_version: TLS_VERSION, cipher: Optional[str] = None,
+                          features: Optional[StreamProbe] = None,
+                          cache_context: bool = True) -> TLSCipherTestResult:
+        probe, starttls_required = await self.tls_probe(target, tls_version, cipher, features,
+                                                        cache_context=cache_context)
 
-        client = TLSTestClient(context, target.srv.domain, ip, port)
-        client.connect(ip, port, **kwargs)
-        await client.process(forever=False, timeout=10)
+        if cipher is None:  # no cipher was requested, so report the cipher that was used
+            cipher = probe.cipher
 
-        return TLSCipherTestResult(target, client._test_success, context=context,
-                                   tls_version=tls_version, cipher=cipher,
-                                   starttls_required=client.starttls_required)
+        return TLSCipherTestResult(target, probe.success, tls_version=tls_version, cipher=cipher,
+                                   negotiated_cipher=probe.cipher,
+                                   starttls_required=starttls_required, error=probe.error,
+                                   timings=probe.timings, resumed=probe.session_reused,
+                                   certificate=probe.certificate)
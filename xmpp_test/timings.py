@@ -0,0 +1,303 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Record when the phases of a connection test were completed.
+
+Timestamps are taken with :py:func:`time.monotonic`. The timings of a test start with the SRV query, so they
+include the DNS queries that found the target. The phases are:
+
+* ``srv``: the SRV query returned.
+* ``a`` or ``aaaa``: the A or AAAA query for the SRV target returned.
+* ``start``: the test started, after waiting for the scheduler.
+* ``connect``: the TCP connection is established.
+* ``stream``: the server opened its stream.
+* ``features``: the server sent its stream features.
+* ``proceed``: the server accepted the ``<starttls/>`` request.
+* ``tls``: the TLS handshake is done.
+* ``negotiated``: the server sent its stream features over the encrypted stream.
+
+Phases that were not reached (e.g. because the connection failed) are missing.
+"""
+
+import bisect
+import collections
+import time
+from array import array
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+PHASES = ('srv', 'a', 'aaaa', 'start', 'connect', 'stream', 'features', 'proceed', 'tls', 'negotiated')
+"""All phases in the order in which they usually happen."""
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+"""Upper bounds (in seconds) of histogram buckets."""
+
+# All sequences of phases seen so far, so that timings with the same phases share one tuple
+_PHASE_SEQUENCES: Dict[Tuple[Tuple[str, ...], str], Tuple[str, ...]] = {}
+
+
+def _add_phase(phases: Tuple[str, ...], phase: str) -> Tuple[str, ...]:
+    key = (phases, phase)
+    sequence = _PHASE_SEQUENCES.get(key)
+    if sequence is None:
+        sequence = _PHASE_SEQUENCES[key] = phases + (phase, )
+    return sequence
+
+
+class Timings:
+    """Monotonic timestamps of the phases of a test.
+
+    Every probe has its own timings, so they are stored compactly: The phases are a tuple shared by all
+    timings with the same phases, timestamps are stored in an array.
+
+    Parameters
+    ----------
+
+    start : float, optional
+        The timestamp that all phases are relative to, the current time if not given.
+    """
+
+    __slots__ = ('start', 'phases', 'timestamps')
+
+    start: float
+    phases: Tuple[str, ...]
+    timestamps: array
+
+    def __init__(self, start: Optional[float] = None) -> None:
+        self.start = time.monotonic() if start is None else start
+        self.phases = ()
+        self.timestamps = array('d')
+
+    def __contains__(self, phase: str) -> bool:
+        return phase in self.phases
+
+    def __repr__(self) -> str:
+        return '<Timings: %s>' % format_timings(self.as_dict())
+
+    @property
+    def marks(self) -> Dict[str, float]:
+        """The timestamp of every phase."""
+
+        return collections.OrderedDict(zip(self.phases, self.timestamps))
+
+    def copy(self) -> 'Timings':
+        timings = Timings(self.start)
+        timings.phases = self.phases
+        timings.timestamps = array('d', self.timestamps)
+        return timings
+
+    def mark(self, phase: str, timestamp: Optional[float] = None) -> None:
+        """Record that `phase` was completed at `timestamp` (or now).
+
+        >>> t = Timings(10)
+        >>> t.mark('srv', 10.5)
+        >>> t.mark('a', 11)
+        >>> t.mark('srv', 10.25)
+        >>> dict(t.marks)
+        {'srv': 10.25, 'a': 11.0}
+        """
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if phase in self.phases:
+            self.timestamps[self.phases.index(phase)] = timestamp
+        else:
+            self.phases = _add_phase(self.phases, phase)
+            self.timestamps.append(timestamp)
+
+    def durations(self) -> Dict[str, float]:
+        """Get the time spent in every phase (in seconds), the time since the previous phase was completed.
+
+        >>> t = Timings(10)
+        >>> t.mark('srv', 10.5)
+        >>> t.mark('a', 11.25)
+        >>> dict(t.durations())
+        {'srv': 0.5, 'a': 0.75}
+        """
+
+        durations = collections.OrderedDict()
+        previous = self.start
+        for phase, timestamp in zip(self.phases, self.timestamps):
+            durations[phase] = timestamp - previous
+            previous = timestamp
+        return durations
+
+    def as_dict(self) -> Dict[str, float]:
+        """Get the time (in milliseconds) since the start for every phase.
+
+        >>> t = Timings(10)
+        >>> t.mark('srv', 10.5)
+        >>> dict(t.as_dict())
+        {'srv': 500.0}
+        """
+
+        return collections.OrderedDict((p, round((t - self.start) * 1000, 1))
+                                       for p, t in zip(self.phases, self.timestamps))
+
+
+def format_timings(timings: Optional[Dict[str, float]]) -> str:
+    """Format the output of :py:meth:`Timings.as_dict` as time spent in every phase, for display in tables.
+
+    >>> format_timings({'srv': 1.5, 'a': 2.0, 'start': 2.0, 'connect': 12.5})
+    'srv=1.5 a=0.5 start=0.0 connect=10.5'
+    >>> format_timings(None)
+    ''
+    """
+
+    if not timings:
+        return ''
+
+    durations = []
+    previous = 0.0
+    for phase, offset in timings.items():
+        durations.append('%s=%.1f' % (phase, offset - previous))
+        previous = offset
+    return ' '.join(durations)
+
+
+class Histogram:
+    """A histogram of durations with fixed buckets.
+
+    Like Prometheus histograms, bucket counts are cumulative: Every bucket counts all values less than or
+    equal to its upper bound.
+
+    >>> h = Histogram(buckets=(.1, 1))
+    >>> for value in (.05, .5, 5):
+    ...     h.observe(value)
+    >>> h.counts, h.count
+    ([1, 2], 3)
+    """
+
+    buckets: Sequence[float]
+    counts: List[int]
+    count: int
+    sum: float
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i in range(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: 'Histogram') -> None:
+        if tuple(other.buckets) != tuple(self.buckets):
+            raise ValueError('Cannot merge histograms with different buckets.')
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the `q`-quantile (``0 <= q <= 1``) by linear interpolation within its bucket.
+
+        Returns the largest bucket bound if the quantile is in the overflow bucket and ``None`` if there are
+        no values.
+
+        >>> h = Histogram(buckets=(1, 2))
+        >>> for value in (.5, 1.5, 1.5, 1.5):
+        ...     h.observe(value)
+        >>> h.quantile(.5)
+        1.3333333333333333
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        previous_bound, previous_count = 0.0, 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                if count == previous_count:
+                    return bound
+                return previous_bound + (bound - previous_bound) * (rank - previous_count) / (
+                    count - previous_count)
+            previous_bound, previous_count = bound, count
+        return self.buckets[-1]
+
+    def as_dict(self) -> dict:
+        return collections.OrderedDict([
+            ('buckets', collections.OrderedDict(zip([str(b) for b in self.buckets], self.counts))),
+            ('count', self.count),
+            ('sum', self.sum),
+        ])
+
+
+class PhaseHistograms:
+    """Histograms of the time spent in every phase, aggregated over all tests of this process."""
+
+    histograms: Dict[str, Histogram]
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.histograms = collections.OrderedDict()
+
+    def observe(self, phase: str, value: float) -> None:
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            histogram = self.histograms[phase] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def observe_timings(self, timings: Timings, phases: Iterable[str]) -> None:
+        """Add the durations of the given `phases` of `timings`."""
+
+        phases = set(phases)
+        for phase, duration in timings.durations().items():
+            if phase in phases:
+                self.observe(phase, duration)
+
+    def merge(self, other: 'PhaseHistograms') -> None:
+        """Add all values of `other`, e.g. histograms returned by another process."""
+
+        for phase, histogram in other.histograms.items():
+            if phase not in self.histograms:
+                self.histograms[phase] = Histogram(histogram.buckets)
+            self.histograms[phase].merge(histogram)
+
+    def clear(self) -> None:
+        self.histograms = collections.OrderedDict()
+
+    def summary(self) -> List[dict]:
+        """Get count, mean and estimated quantiles (in milliseconds) of every phase, for display in tables."""
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value * 1000, 1)
+
+        rows = []
+        for phase in sorted(self.histograms, key=lambda p: PHASES.index(p) if p in PHASES else len(PHASES)):
+            histogram = self.histograms[phase]
+            rows.append(collections.OrderedDict([
+                ('phase', phase),
+                ('count', histogram.count),
+                ('mean (ms)', ms(histogram.sum / histogram.count if histogram.count else None)),
+                ('p50 (ms)', ms(histogram.quantile(.5))),
+                ('p90 (ms)', ms(histogram.quantile(.9))),
+                ('p99 (ms)', ms(histogram.quantile(.99))),
+            ]))
+        return rows
+
+    def as_dict(self) -> dict:
+        return collections.OrderedDict((p, h.as_dict()) for p, h in self.histograms.items())
+
+
+histograms = PhaseHistograms()
+"""Histograms of all tests in this process."""
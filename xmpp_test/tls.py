@@ -11,17 +11,149 @@
 # You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
 # <http://www.gnu.org/licenses/>.
 
-import asyncio
+import collections
+import contextvars
 import ssl
 import sys
+import time
+from contextlib import contextmanager
+from typing import AsyncGenerator
+from typing import Dict
+from typing import Hashable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Tuple
 
+from .types import FrozenContext
 from .types import TLS_VERSION
 
 
 # if the ssl module has the HAS_* constants - added in Python 3.7.
 _SSL_HAS_HAS_CONSTANTS = sys.version_info[:2] >= (3, 7)
 
+# Ciphers to test, in OpenSSL cipher list format
+CIPHER_STRING = 'ALL:!aNULL:!SRP:!PSK'
+
+# Minimum protocol version of a cipher, as returned by SSLContext.get_ciphers()
+_CIPHER_PROTOCOLS = {
+    'SSLv2': TLS_VERSION.SSLv2,
+    'SSLv3': TLS_VERSION.SSLv3,
+    'TLSv1/SSLv3': TLS_VERSION.SSLv3,
+    'TLSv1.0': TLS_VERSION.TLSv1,
+    'TLSv1.1': TLS_VERSION.TLSv1_1,
+    'TLSv1.2': TLS_VERSION.TLSv1_2,
+    'TLSv1.3': TLS_VERSION.TLSv1_3,
+}
+
+# Cache of supported ciphers, keyed by OpenSSL version and TLS version
+_CIPHER_CACHE: Dict[Tuple[str, TLS_VERSION], Tuple[str, ...]] = {}
+
+# The session offered by SessionContext, see offer_session()
+_offered_session: contextvars.ContextVar = contextvars.ContextVar('offered_session', default=None)
+
+
+class SessionContext(FrozenContext):
+    """An SSLContext that offers a TLS session for resumption.
+
+    :py:mod:`asyncio` does not allow passing a session to :py:meth:`~asyncio.loop.start_tls`, so this
+    context offers the session set with :py:func:`offer_session` instead. A session can only be resumed with
+    the context that created it.
+    """
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = _offered_session.get()
+        try:
+            return super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                    server_hostname=server_hostname, session=session)
+        except ValueError:  # the session was created by another context
+            return super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                    server_hostname=server_hostname)
+
+
+@contextmanager
+def offer_session(session: Optional[ssl.SSLSession]) -> Iterator[None]:
+    """Offer `session` in TLS handshakes of a :py:class:`SessionContext` started in this block."""
+
+    token = _offered_session.set(session)
+    try:
+        yield
+    finally:
+        _offered_session.reset(token)
+
+
+class SessionCache:
+    """An LRU cache of TLS sessions, e.g. keyed by target and context.
+
+    Expired sessions (see :py:attr:`ssl.SSLSession.timeout`) are never returned.
+
+    Parameters
+    ----------
+
+    max_size : int, optional
+        Maximum number of sessions held in the cache.
+    """
+
+    max_size: int
+
+    def __init__(self, max_size: int = 4096) -> None:
+        self.max_size = max_size
+        self._data: collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[ssl.SSLSession]:
+        session = self._data.get(key)
+        if session is None:
+            return None
+        if session.time + session.timeout <= time.time():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return session
+
+    def set(self, key: Hashable, session: ssl.SSLSession) -> None:
+        if self.max_size <= 0:
+            return
+
+        self._data[key] = session
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+session_cache = SessionCache()
+"""Sessions of all tests that reuse connections."""
+
+
+def get_session_context(tls_version: TLS_VERSION, cipher: Optional[str] = None,
+                        cache: bool = True) -> SessionContext:
+    """Get a shared :py:class:`SessionContext` for the given TLS version and cipher string.
+
+    The same context is returned for the same parameters (as long as it is cached by
+    :py:meth:`~xmpp_test.types.TLS_VERSION.get_context`), so that sessions can be resumed. With
+    ``cache=False``, a new context is returned.
+    """
+
+    return TLS_VERSION.get_context(tls_version, cipher, context_class=SessionContext, cache=cache)
+
+
+def _cipher_supports(protocol: str, tls_version: TLS_VERSION) -> bool:
+    """Whether a cipher with the given minimum `protocol` can be used with `tls_version`."""
+
+    minimum = _CIPHER_PROTOCOLS.get(protocol, TLS_VERSION.SSLv3)
+
+    # SSLv2 and TLSv1.3 ciphers can only be used with SSLv2 and TLSv1.3 respectively
+    if TLS_VERSION.SSLv2 in (minimum, tls_version) or TLS_VERSION.TLSv1_3 in (minimum, tls_version):
+        return minimum == tls_version
+    return minimum.value <= tls_version.value
+
 
 def get_supported_protocols(exclude: List[TLS_VERSION] = None) -> List[TLS_VERSION]:
     """Get a list of supported protocols for the current system."""
@@ -46,18 +178,24 @@ def get_supported_protocols(exclude: List[TLS_VERSION] = None) -> List[TLS_VERSI
     return supported
 
 
-async def get_ciphers(tls_version: TLS_VERSION) -> List[str]:
-    ctx = TLS_VERSION.get_context(tls_version)
-    if hasattr(ctx, 'get_ciphers') and False:
-        ciphers = [p['name'] for p in ctx.get_ciphers()]
-    else:
-        create = asyncio.create_subprocess_exec('openssl', 'ciphers', 'ALL:!aNULL:!SRP:!PSK',
-                                                stdout=asyncio.subprocess.PIPE)
-        proc = await create
-        ciphers = await proc.stdout.read()
-        ciphers = ciphers.strip().decode('utf-8').split(':')
+def get_cipher_names(tls_version: TLS_VERSION) -> Tuple[str, ...]:
+    """Get the names of all ciphers that the local OpenSSL library supports for the given TLS version.
+
+    The list is computed only once per process (it can only change with the OpenSSL version).
+    """
+
+    key = (ssl.OPENSSL_VERSION, tls_version)
+    ciphers = _CIPHER_CACHE.get(key)
+    if ciphers is None:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.set_ciphers(CIPHER_STRING)
+        ciphers = _CIPHER_CACHE[key] = tuple(
+            c['name'] for c in ctx.get_ciphers() if _cipher_supports(c['protocol'], tls_version))
+    return ciphers
+
 
-    for c in ciphers:
+async def get_ciphers(tls_version: TLS_VERSION) -> AsyncGenerator[str, None]:
+    for c in get_cipher_names(tls_version):
         yield c
 
 
@@ -11,7 +11,9 @@
 # You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import collections
 import ssl
+import typing
 from enum import Enum
 
 from .constants import STARTTLS_NOT_APPLICABLE
@@ -41,26 +43,118 @@ class TLS_VERSION(Enum):
     def get_protocol_constant(tls_version: 'TLS_VERSION') -> ssl._SSLMethod:
         return getattr(ssl, 'OP_NO_%s' % tls_version.name)
 
-    def get_context(tls_version: 'TLS_VERSION') -> ssl.SSLContext:
-        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        ctx.verify_mode = ssl.CERT_OPTIONAL
+    def get_context(tls_version: 'TLS_VERSION', ciphers: typing.Optional[str] = None,
+                    verify_mode: ssl.VerifyMode = ssl.CERT_NONE,
+                    context_class: type = None, cache: bool = True) -> 'FrozenContext':
+        """Get a client context that allows only `tls_version` and, if given, the `ciphers`.
+
+        Contexts are cached (see ``CONTEXT_CACHE_SIZE``) and the same context is returned for the same
+        parameters, so the context is frozen and must never be modified. `context_class` must be a subclass of
+        :py:class:`FrozenContext`. Pass ``cache=False`` for contexts that are unlikely to be used again (e.g.
+        for cipher strings that depend on the server), so that they do not evict contexts that are.
+
+        The default verify mode is ``CERT_NONE``, as tests using this context check protocol support and not
+        the certificate of the server.
+
+        >>> ctx = TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES128-SHA')
+        >>> ctx is TLS_VERSION.get_context(TLS_VERSION.TLSv1_2, 'AES128-SHA')
+        True
+        >>> ctx.set_ciphers('ALL')
+        Traceback (most recent call last):
+            ...
+        TypeError: Shared SSL contexts must not be modified.
+        """
+
+        if context_class is None:
+            context_class = FrozenContext
+
+        key = (tls_version, ciphers, verify_mode, context_class)
+        ctx = _CONTEXT_CACHE.get(key) if cache else None
+        if ctx is not None:
+            _CONTEXT_CACHE.move_to_end(key)
+            return ctx
+
+        ctx = context_class(ssl.PROTOCOL_TLS_CLIENT)
 
         # TODO: without this flag, tests never return
         ctx.check_hostname = False
+        ctx.verify_mode = verify_mode
+
+        # disable all protocol versions except the one we want
+        ctx.options |= _NO_PROTOCOL_OPTIONS & ~TLS_VERSION.get_protocol_constant(tls_version)
+        if ciphers is not None:
+            ctx.set_ciphers(ciphers)
+        ctx.freeze()
+        if not cache:
+            return ctx
+
+        _CONTEXT_CACHE[key] = ctx
+        while len(_CONTEXT_CACHE) > CONTEXT_CACHE_SIZE:
+            _CONTEXT_CACHE.popitem(last=False)
+        return ctx
 
-        # first, disable all protocol versions
-        constants = [
-            'OP_NO_SSLv2', 'OP_NO_SSLv3', 'OP_NO_TLSv1', 'OP_NO_TLSv1_1', 'OP_NO_TLSv1_2', 'OP_NO_TLSv1_3',
-        ]
-        for constant in constants:
-            if not hasattr(ssl, constant):
-                continue
 
-            ctx.options |= getattr(ssl, constant)
+class FrozenContext(ssl.SSLContext):
+    """An SSLContext that can no longer be modified once :py:meth:`freeze` was called.
 
-        # Reenable the one version we want
-        ctx.options &= ~TLS_VERSION.get_protocol_constant(tls_version)
-        return ctx
+    Used for contexts that are shared between connections, see :py:meth:`TLS_VERSION.get_context`.
+    """
+
+    _frozen = False
+
+    def freeze(self) -> None:
+        object.__setattr__(self, '_frozen', True)
+
+    def _check_frozen(self) -> None:
+        if self._frozen:
+            raise TypeError('Shared SSL contexts must not be modified.')
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:
+        self._check_frozen()
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name: str) -> None:
+        self._check_frozen()
+        super().__delattr__(name)
+
+    def set_ciphers(self, *args: typing.Any) -> None:
+        self._check_frozen()
+        super().set_ciphers(*args)
+
+    def set_alpn_protocols(self, *args: typing.Any) -> None:
+        self._check_frozen()
+        super().set_alpn_protocols(*args)
+
+    def set_ecdh_curve(self, *args: typing.Any) -> None:
+        self._check_frozen()
+        super().set_ecdh_curve(*args)
+
+    def load_cert_chain(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        self._check_frozen()
+        super().load_cert_chain(*args, **kwargs)
+
+    def load_verify_locations(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        self._check_frozen()
+        super().load_verify_locations(*args, **kwargs)
+
+    def load_default_certs(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        self._check_frozen()
+        super().load_default_certs(*args, **kwargs)
+
+    def set_default_verify_paths(self) -> None:
+        self._check_frozen()
+        super().set_default_verify_paths()
+
+
+CONTEXT_CACHE_SIZE = 256
+"""Maximum number of contexts cached by :py:meth:`TLS_VERSION.get_context`."""
+
+_CONTEXT_CACHE: 'collections.OrderedDict[tuple, FrozenContext]' = collections.OrderedDict()
+
+# OP_NO_* options of all protocol versions known to the ssl module
+_NO_PROTOCOL_OPTIONS = 0
+for _version in TLS_VERSION:
+    _NO_PROTOCOL_OPTIONS |= getattr(ssl, 'OP_NO_%s' % _version.name, 0)
 
 
 class STARTTLS(Enum):
@@ -80,3 +174,20 @@ class STARTTLS(Enum):
 
     required: int = STARTTLS_REQUIRED
     """STARTTLS is required."""
+
+
+class Timeouts(typing.NamedTuple):
+    """Deadlines (in seconds) for the different phases of a connection test.
+
+    >>> Timeouts(connect=2).connect
+    2
+    """
+
+    connect: float = 5
+    """Opening the TCP connection."""
+
+    tls: float = 5
+    """The TLS handshake (for both XEP-0368 and STARTTLS)."""
+
+    features: float = 10
+    """Waiting for the server to open the stream and send its features (or to answer ``<starttls/>``)."""
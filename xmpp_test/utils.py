@@ -0,0 +1,82 @@
+# This file is part of xmpp-test (https://github.com/mathiasertl/xmpp-test).
+#
+# xmpp-test is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# xmpp-test is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License
+# for more details.
+#
+# You should have received a copy of the GNU General Public License along with xmpp-test.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Asynchronous helper functions."""
+
+import asyncio
+from typing import AsyncIterable
+from typing import AsyncIterator
+from typing import Iterable
+from typing import Set
+from typing import TypeVar
+from typing import Union
+
+T = TypeVar('T')
+
+_ITEM = 0
+_DONE = 1
+
+
+async def merge(sources: Union[Iterable[AsyncIterable[T]], AsyncIterable[AsyncIterable[T]]]
+                ) -> AsyncIterator[T]:
+    """Iterate over several asynchronous iterables concurrently, yielding items in the order they arrive.
+
+    `sources` may itself be an asynchronous iterable, in which case sources are started as soon as they are
+    produced. If any source raises an exception, all other sources are cancelled and the exception is
+    propagated. Closing the returned generator early also cancels all sources that are still running.
+
+    >>> async def delayed(value, delay):
+    ...     await asyncio.sleep(delay)
+    ...     yield value
+    >>> async def main():
+    ...     return [v async for v in merge([delayed('slow', 0.02), delayed('fast', 0.01)])]
+    >>> asyncio.get_event_loop().run_until_complete(main())
+    ['fast', 'slow']
+    """
+
+    queue: asyncio.Queue = asyncio.Queue()
+    tasks: Set[asyncio.Future] = set()
+
+    def finished(task: asyncio.Future) -> None:
+        tasks.discard(task)
+        queue.put_nowait((_DONE, task))
+
+    def start(coro) -> None:
+        task = asyncio.ensure_future(coro)
+        tasks.add(task)
+        task.add_done_callback(finished)
+
+    async def pump(source: AsyncIterable[T]) -> None:
+        async for item in source:
+            queue.put_nowait((_ITEM, item))
+
+    async def feed(sources: AsyncIterable[AsyncIterable[T]]) -> None:
+        async for source in sources:
+            start(pump(source))
+
+    if hasattr(sources, '__aiter__'):
+        start(feed(sources))  # type: ignore
+    else:
+        for source in sources:  # type: ignore
+            start(pump(source))
+
+    try:
+        while tasks or not queue.empty():
+            kind, value = await queue.get()
+            if kind == _ITEM:
+                yield value
+            else:
+                value.result()  # re-raises any exception of the source
+    finally:
+        for task in tasks:
+            task.cancel()